@@ -0,0 +1,164 @@
+"""
+Benchmarks the scoring pipeline on seeded synthetic data, reporting the time, throughput and peak memory
+of each stage as JSON so runs can be compared across commits. Stages are measured by the RunMetrics of a
+production run, so their reports can be compared with the --metrics-json of main.py too.
+
+All 16 source tables are generated with a realistic number of rows per candidate, publications are parsed
+by a local stub of the parsing API and results are written to a SQLite database standing in for MySQL.
+Journal names of the generated publications are drawn from the journal_ranks.csv of the working directory,
+or from generated journal titles when there is none.
+
+Usage:
+    python benchmark.py --candidates 1000 100000 --output benchmark.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from db_pool import ConnectionPool
+from instrumentation import RunMetrics
+from journal_matcher import load_journal_matcher
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from stub_parser_server import StubParserServer
+from synthetic import CITATION_TABLE, SQLiteConnection, synthetic_journal_ranks, synthetic_tables
+from table_schema import memory_usage
+
+# Scores are computed as of this date so runs agree
+AS_OF_DATE = '2024-01-01'
+
+# Number of journals generated when the working directory holds no journal_ranks.csv
+SYNTHETIC_JOURNALS = 15000
+
+
+def run_benchmark(candidates, seed=0, trace_memory=True, parser_latency=0.0, parser_workers=8, local_confidence=None,
+                  parser_batch_size=1):
+    """
+    Generates the tables for a number of candidates and runs every stage of the pipeline on them.
+
+    Parameters:
+    -----------
+    candidates : int
+        Number of candidates
+    seed : int, optional
+        Seed of the synthetic data
+    trace_memory : bool, optional
+        Whether the peak memory of each stage is traced, which slows the stages down
+    parser_latency : float, optional
+        Seconds the stub parsing API waits before each response
+    parser_workers : int, optional
+        Number of concurrent requests to the stub parsing API
+    local_confidence : float, optional
+        If given publications are parsed locally when at least this confident, see LocalFirstParserClient
+    parser_batch_size : int, optional
+        Maximum number of references per request to the stub parsing API, see ReferenceParserClient
+
+    Returns:
+    --------
+    dict
+        Sizes of the generated tables and, per stage, the RunMetrics report along with the rows it returned
+        and its throughput
+    """
+    with tempfile.TemporaryDirectory(prefix='score_benchmark_') as directory, \
+            StubParserServer(latency=parser_latency, seed=seed) as server:
+        # Draw journal names from journal_ranks.csv, or from generated journals ranked in a csv of the run's own
+        journal_ranks_csv = ScoreCalculator.JOURNAL_RANKS_CSV
+        if not os.path.exists(journal_ranks_csv):
+            journal_ranks_csv = os.path.join(directory, 'journal_ranks.csv')
+            synthetic_journal_ranks(SYNTHETIC_JOURNALS, seed).to_csv(journal_ranks_csv, index=False)
+        journal_titles = load_journal_matcher(journal_ranks_csv, ScoreCalculator.JOURNAL_TITLE_COLUMN,
+                                              ScoreCalculator.JOURNAL_QUARTILE_COLUMN).titles
+
+        start_time = time.perf_counter()
+        tables = synthetic_tables(candidates, seed, journal_titles)
+        report = {'candidates': candidates, 'seed': seed, 'generate_seconds': time.perf_counter() - start_time,
+                  'journals': 'synthetic' if journal_ranks_csv != ScoreCalculator.JOURNAL_RANKS_CSV else journal_ranks_csv,
+                  'table_rows': {name: len(df) for name, df in tables.items()},
+                  'table_bytes': {name: memory_usage(df) for name, df in tables.items()}}
+
+        database_path = os.path.join(directory, 'benchmark.sqlite')
+        with sqlite3.connect(database_path) as cnx:
+            cnx.execute(CITATION_TABLE)
+        parser_client = ReferenceParserClient(url=server.url, headers={}, max_workers=parser_workers,
+                                              batch_size=parser_batch_size)
+        if local_confidence is not None:
+            parser_client = LocalFirstParserClient(parser_client, min_confidence=local_confidence)
+        metrics = RunMetrics(trace_memory=trace_memory)
+        calculator = ScoreCalculator('localhost', 'benchmark', '', 'benchmark', *tables.values(), as_of_date=AS_OF_DATE,
+                                     parser_client=parser_client, pool=ConnectionPool(lambda: SQLiteConnection(database_path)),
+                                     metrics=metrics)
+        calculator.JOURNAL_RANKS_CSV = journal_ranks_csv
+
+        # Run the stages the way the pipeline does, each measured as a stage named after its method
+        results = {name: getattr(calculator, name)() for name in ['university_score', 'teaching_expereince_score',
+                                                                  'industry_experience_score', 'others_score',
+                                                                  'technical_publications_score']}
+        merged_df = calculator.assemble_scores(*results.values())
+        upload_stats = calculator.upload_cal_results(merged_df)
+        if local_confidence is not None:
+            report['local_share'] = parser_client.local_share
+        parser_client.close()
+        calculator.pool.close()
+
+    rows = {**{name: len(result) for name, result in results.items()},
+            'assemble_scores': len(merged_df), 'upload_cal_results': upload_stats['rows']}
+    report['stages'] = metrics.report()['stages']
+    for name, stage in report['stages'].items():
+        if name in rows:
+            stage['rows'] = rows[name]
+            stage['rows_per_second'] = rows[name]/stage['seconds'] if stage['seconds'] else None
+
+    return report
+
+
+def environment():
+    """
+    Describes the code and interpreter a benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'ran_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the scoring pipeline on synthetic data.")
+    parser.add_argument('--candidates', type=int, nargs='+', default=[1000],
+                        help="numbers of candidates to benchmark, e.g. 1000 100000 1000000")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help="do not trace the peak memory of each stage, tracing slows the stages down")
+    parser.add_argument('--parser-latency', type=float, default=0.0,
+                        help="seconds the stub parsing API waits before each response")
+    parser.add_argument('--parser-workers', type=int, default=8,
+                        help="concurrent requests to the stub parsing API")
+    parser.add_argument('--parser-batch-size', type=int, default=1,
+                        help="references per request to the stub parsing API, 1 sends one request per text")
+    parser.add_argument('--local-confidence', type=float,
+                        help="parse publications locally when at least this confident, only calling the stub API for the rest")
+    parser.add_argument('--output', help="write the JSON report to this file instead of printing it")
+    args = parser.parse_args()
+
+    benchmark = {'environment': environment(),
+                 'runs': [run_benchmark(candidates, args.seed, not args.no_trace_memory, args.parser_latency, args.parser_workers,
+                                        args.local_confidence, args.parser_batch_size)
+                          for candidates in args.candidates]}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark, f, indent=2)
+    else:
+        print(json.dumps(benchmark, indent=2))
@@ -0,0 +1,184 @@
+import time
+
+import pandas as pd
+
+from instrumentation import instrumented
+from journal_matcher import load_journal_matcher
+from reference_parser import ReferenceParserClient
+from scores import DBConnector, ScoreCalculator
+from table_schema import TABLE_SCHEMAS, apply_schema, select_query
+
+
+class CandidateScorer(DBConnector):
+    """
+    A class scoring one candidate, or a small batch, with low latency, e.g. to show a score on the application
+    form. Only the candidates' rows are fetched, with one parameterized query per table over a pooled
+    connection, and the journal index is loaded once up front.
+
+    Funded research is scored against the top funded amount of the whole pool, which is cached for
+    max_funded_ttl seconds. Scores match the batch pipeline run over the same data, and as in the batch
+    pipeline parsed publications go through the parse cache; they are not written to the citation table.
+
+    Attributes:
+    ----------
+    as_of_date : pandas.Timestamp
+        Date up to which current positions are counted
+    parse_cache : ParseCache
+        Persistent cache of parsed references, no caching if None
+    match_memo : JournalMatchMemo
+        Persistent memo of journal matches, no memo if None
+    parser_client : ReferenceParserClient
+        Client used to call the parsing API
+    max_funded_ttl : float
+        Seconds the top funded amount of the pool is cached for
+
+    Methods:
+    -------
+    load_candidate_tables(candidate_ids) -> dict
+        Fetches the rows of some candidates from every source table.
+    max_funded_amount(refresh=False) -> float
+        Returns the top funded amount of the pool.
+    score_candidate(candidate_id) -> dict
+        Scores one candidate.
+    score_candidates(candidate_ids) -> dict
+        Scores a batch of candidates.
+    """
+
+    def __init__(self, host, username, password, database, as_of_date=None, parse_cache=None, parser_client=None,
+                 max_funded_ttl=300, pool=None, pool_size=5, metrics=None, match_memo=None):
+        super().__init__(host, username, password, database, pool=pool, pool_size=pool_size, metrics=metrics)
+        self.as_of_date = as_of_date
+        self.parse_cache = parse_cache
+        self.match_memo = match_memo
+        self.parser_client = parser_client if parser_client is not None else ReferenceParserClient()
+        self.max_funded_ttl = max_funded_ttl
+        self._max_funded_amount = None
+        self._max_funded_at = None
+
+        # Load the journal index now rather than on the first request
+        load_journal_matcher(ScoreCalculator.JOURNAL_RANKS_CSV, ScoreCalculator.JOURNAL_TITLE_COLUMN,
+                             ScoreCalculator.JOURNAL_QUARTILE_COLUMN)
+
+    def load_candidate_tables(self, candidate_ids, names=None):
+        """
+        Fetches the rows of some candidates from the source tables, with their schema dtypes.
+
+        Parameters:
+        -----------
+        candidate_ids : int or list-like
+            Id of a candidate, or ids of several candidates
+        names : list, optional
+            Names of the tables to fetch, defaults to every source table
+
+        Returns:
+        --------
+        dict
+            The candidates' rows of each table, keyed by name in TABLE_SCHEMAS order
+        """
+        candidate_ids = [int(candidate_id) for candidate_id in (candidate_ids if pd.api.types.is_list_like(candidate_ids) else [candidate_ids])]
+        condition = "candidate_id = %s" if len(candidate_ids) == 1 else f"candidate_id IN ({', '.join(['%s']*len(candidate_ids))})"
+
+        tables = {}
+        with self.pool.connection() as cnx:
+            for name in (names if names is not None else TABLE_SCHEMAS):
+                df = pd.read_sql_query(f"{select_query(name)} WHERE {condition}", cnx, params=tuple(candidate_ids))
+                tables[name] = apply_schema(name, df)
+
+        return tables
+
+    def max_funded_amount(self, refresh=False):
+        """
+        Returns the top funded amount among the candidates of the pool, fetched again once the cached amount
+        is older than max_funded_ttl seconds. The top candidate is found in the database and their amounts
+        are summed the way the batch pipeline sums them, so both agree to the last digit.
+
+        Parameters:
+        -----------
+        refresh : bool, optional
+            If True the amount is fetched again even if the cached one is still fresh
+
+        Returns:
+        --------
+        float
+            The top funded amount, 0 if no candidate has funding
+        """
+        if not refresh and self._max_funded_at is not None and time.monotonic() - self._max_funded_at < self.max_funded_ttl:
+            return self._max_funded_amount
+
+        funded_research_table = TABLE_SCHEMAS['funded_research'][0]
+        candidate_table = TABLE_SCHEMAS['candidate'][0]
+        with self.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.execute(f"SELECT candidate_id FROM {funded_research_table} "
+                           f"WHERE candidate_id IN (SELECT candidate_id FROM {candidate_table}) "
+                           "GROUP BY candidate_id ORDER BY SUM(funded_amount_usd) DESC LIMIT 1")
+            top_candidate = cursor.fetchone()
+            cursor.close()
+
+        max_funded_amount = 0.0
+        if top_candidate is not None:
+            funded_research_df = self.load_candidate_tables(top_candidate[0], names=['funded_research'])['funded_research']
+            max_funded_amount = max(0.0, float(funded_research_df.groupby('candidate_id')['funded_amount_usd'].sum().max()))
+
+        self._max_funded_amount = max_funded_amount
+        self._max_funded_at = time.monotonic()
+
+        return max_funded_amount
+
+    @instrumented
+    def score_candidate(self, candidate_id):
+        """
+        Scores one candidate.
+
+        Parameters:
+        -----------
+        candidate_id : int
+            Id of the candidate
+
+        Returns:
+        --------
+        dict
+            The component scores and total_score of the candidate, None if the batch pipeline leaves the
+            candidate out of its results too, e.g. a candidate without publications
+
+        Raises:
+        -------
+        KeyError: If there is no such candidate.
+        """
+        scores = self.score_candidates([candidate_id])
+        if candidate_id not in scores:
+            raise KeyError(f"No candidate with id {candidate_id}.")
+
+        return scores[candidate_id]
+
+    @instrumented
+    def score_candidates(self, candidate_ids):
+        """
+        Scores a batch of candidates at once, fetching their rows with one query per table.
+
+        Parameters:
+        -----------
+        candidate_ids : list-like
+            Ids of the candidates
+
+        Returns:
+        --------
+        dict
+            The component scores and total_score of each candidate found, keyed by candidate_id. None for
+            candidates the batch pipeline leaves out of its results too, see score_candidate.
+        """
+        if len(candidate_ids) == 0:
+            return {}
+        tables = self.load_candidate_tables(candidate_ids)
+
+        calculator = ScoreCalculator(self.host, self.username, self.password, self.database, *tables.values(),
+                                     as_of_date=self.as_of_date, parse_cache=self.parse_cache,
+                                     parser_client=self.parser_client, pool=self.pool, metrics=self.metrics,
+                                     match_memo=self.match_memo)
+        scores = calculator.calculate_scores(self.max_funded_amount(), write_citations=False)
+
+        results = dict.fromkeys(tables['candidate']['candidate_id'].tolist())
+        for row in scores.to_dict('records'):
+            results[row['candidate_id']] = {column: value.item() if hasattr(value, 'item') else value for column, value in row.items()}
+
+        return results
@@ -0,0 +1,65 @@
+"""
+Fixtures shared by the tests: seeded synthetic source tables, SQLite databases standing in for MySQL, a
+working directory holding the journal_ranks.csv the scorers match journals against and a placeholder
+parsing API token.
+"""
+import pandas as pd
+import pytest
+
+from db_pool import ConnectionPool
+from synthetic import SQLiteConnection, synthetic_tables, write_sqlite_tables
+
+# Journals of the journal_ranks.csv written by the journal_ranks fixture, synthetic publications are drawn from them
+JOURNALS = ['Journal of Testing', 'Annals of Candidate Scoring', 'Review of Synthetic Results']
+
+
+@pytest.fixture
+def synthetic_pool():
+    """
+    Returns a function generating the source tables of a pool of candidates, see synthetic.synthetic_tables,
+    with publications in the journals of JOURNALS.
+    """
+    def generate(candidates, seed=0):
+        return synthetic_tables(candidates, seed, journal_titles=JOURNALS)
+
+    return generate
+
+
+@pytest.fixture
+def sqlite_pool(tmp_path):
+    """
+    Returns a function opening a ConnectionPool over a SQLite file in tmp_path, first writing the source
+    tables passed to it under their MySQL table names. The pools are closed after the test.
+    """
+    pools = []
+
+    def open_pool(tables=None, name='source.sqlite'):
+        path = str(tmp_path/name)
+        if tables is not None:
+            write_sqlite_tables(tables, path)
+        pools.append(ConnectionPool(lambda: SQLiteConnection(path)))
+        return pools[-1]
+
+    yield open_pool
+    for pool in pools:
+        pool.close()
+
+
+@pytest.fixture
+def journal_ranks(tmp_path, monkeypatch):
+    """
+    Runs the test in tmp_path, next to a journal_ranks.csv ranking the journals of JOURNALS. Returns their titles.
+    """
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'Title': JOURNALS, 'SJR Quartile': ['Q1', 'Q2', 'Q3']}).to_csv('journal_ranks.csv', index=False)
+
+    return JOURNALS
+
+
+@pytest.fixture(autouse=True)
+def parser_api_token(monkeypatch):
+    """
+    Sets a placeholder PARSER_API_TOKEN for the parsing API clients created without headers. No test
+    reaches the parsing API itself.
+    """
+    monkeypatch.setenv('PARSER_API_TOKEN', 'test-token')
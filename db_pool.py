@@ -0,0 +1,231 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection could be checked out of the pool within the timeout.
+    """
+
+
+class CountingConnection:
+    """
+    Wraps a database connection, counting the statements its cursors send to the server.
+    """
+
+    def __init__(self, cnx, count):
+        self._cnx = cnx
+        self._count = count
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._cnx.cursor(*args, **kwargs), self._count)
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+
+class CountingCursor:
+    """
+    Wraps a database cursor, counting execute and executemany calls as one round trip each.
+    """
+
+    def __init__(self, cursor, count):
+        self._cursor = cursor
+        self._count = count
+
+    def execute(self, *args, **kwargs):
+        self._count()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._count()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ConnectionPool:
+    """
+    A thread safe pool of database connections. Connections are created on demand up to size, checked
+    out with the connection() context manager and returned to the pool when the block ends. When every
+    connection is in use, checkouts wait for one to be returned.
+
+    Idle connections are health checked before being handed out and replaced if they are no longer
+    connected, and uncommitted work is rolled back when a connection is returned. Statements sent over
+    pooled connections are counted as round trips, an executemany call counting as one.
+
+    Attributes:
+    ----------
+    connect : callable
+        Function returning a new database connection
+    size : int
+        Maximum number of open connections
+    timeout : float
+        Seconds a checkout waits for a free connection before raising PoolTimeout
+    health_check : bool
+        Whether idle connections are checked before being handed out
+
+    Methods:
+    -------
+    connection() -> ContextManager[connection]
+        Checks out a connection for the duration of a with block.
+    close()
+        Closes the idle connections.
+    """
+
+    def __init__(self, connect, size=5, timeout=30, health_check=True):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._created = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._health_check_failures = 0
+        self._round_trips = 0
+
+    @staticmethod
+    def _is_healthy(cnx):
+        """
+        Pings a connection, connections without an is_connected method are assumed healthy.
+        """
+        is_connected = getattr(cnx, 'is_connected', None)
+        try:
+            return is_connected() if is_connected is not None else True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        with self._lock:
+            self._checkouts += 1
+            create = self._idle.empty() and self._open < self.size
+            if create:
+                self._open += 1
+
+        if create:
+            cnx = self._create()
+        else:
+            try:
+                cnx = self._idle.get_nowait()
+            except queue.Empty:
+                # Every connection is in use, wait for one to be returned
+                started_at = time.perf_counter()
+                try:
+                    cnx = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No database connection was free within {self.timeout} seconds.") from None
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_seconds += time.perf_counter() - started_at
+
+            # Replace idle connections that have gone away
+            if self.health_check and not self._is_healthy(cnx):
+                with self._lock:
+                    self._health_check_failures += 1
+                self._close_quietly(cnx)
+                cnx = self._create()
+
+        with self._lock:
+            self._in_use += 1
+
+        return cnx
+
+    def _count_round_trip(self):
+        with self._lock:
+            self._round_trips += 1
+
+    def _create(self):
+        try:
+            cnx = CountingConnection(self.connect(), self._count_round_trip)
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+        with self._lock:
+            self._created += 1
+
+        return cnx
+
+    def _checkin(self, cnx):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            cnx.rollback()
+        except Exception:
+            # The connection is broken, drop it so a new one is created on demand
+            self._close_quietly(cnx)
+            with self._lock:
+                self._open -= 1
+            return
+        self._idle.put(cnx)
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out a connection from the pool for the duration of a with block.
+
+        Yields:
+        -------
+        connection
+            An open database connection
+
+        Raises:
+        -------
+        PoolTimeout: If no connection was free within the timeout.
+        """
+        cnx = self._checkout()
+        try:
+            yield cnx
+        finally:
+            self._checkin(cnx)
+
+    @property
+    def stats(self):
+        """
+        Pool statistics: connections open, in use and idle, connections created, checkouts, checkouts
+        that had to wait and the total time waited, failed health checks and statements sent
+        """
+        with self._lock:
+            return {'size': self.size, 'open': self._open, 'in_use': self._in_use,
+                    'idle': self._open - self._in_use, 'created': self._created,
+                    'checkouts': self._checkouts, 'waits': self._waits, 'wait_seconds': self._wait_seconds,
+                    'health_check_failures': self._health_check_failures, 'round_trips': self._round_trips}
+
+    @property
+    def round_trips(self):
+        """
+        Number of statements sent over pooled connections so far
+        """
+        return self._round_trips
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        while True:
+            try:
+                cnx = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(cnx)
+            with self._lock:
+                self._open -= 1
@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+
+from scores import ScoreCalculator
+
+# Only these citation columns are input, the parsed columns are written back by the scoring run itself
+CITATION_INPUT_COLUMNS = ['candidate_id', 'cit_peer_reviewed_journals']
+
+
+def running_positions(candidate_index, tables, as_of_date):
+    """
+    Flags the candidates holding a current position not yet capped as of a date. Current positions run
+    up to the as of date, so these candidates' experience scores change from one day to the next even
+    when their rows do not.
+
+    Parameters:
+    -----------
+    candidate_index : pandas.Index
+        Ids of the candidates to flag
+    tables : dict
+        Source tables keyed by name. Experience tables aggregated in the database are skipped, their
+        aggregates already depend on the as of date, see ScoreCalculator.pushdown_query.
+    as_of_date : str or datetime.date
+        Date current positions run up to
+
+    Returns:
+    --------
+    numpy.ndarray
+        Whether each candidate of candidate_index holds such a position
+    """
+    as_of_date = pd.Timestamp(as_of_date).normalize()
+    running = np.zeros(len(candidate_index), dtype=bool)
+    for name, (prefix, _) in ScoreCalculator.PUSHDOWN_EXPERIENCE.items():
+        df = tables.get(name)
+        if df is None or f'{prefix}_current_position' not in df.columns:
+            continue
+        current = df[(df[f'{prefix}_current_position'] == 'yes').to_numpy()]
+        days = (as_of_date - pd.to_datetime(current[f'{prefix}_from_start_date']).dt.normalize()).dt.days
+        rows = candidate_index.get_indexer(current.loc[(days < ScoreCalculator.capped_position_days()).to_numpy(), 'candidate_id'])
+        running[rows[rows >= 0]] = True
+
+    return running
+
+
+def candidate_fingerprints(candidate_ids, tables, as_of_date=None):
+    """
+    Computes a fingerprint of each candidate's rows across the source tables. Rows are hashed with
+    pandas and the hashes of a candidate's rows are summed per table, so the fingerprint does not depend
+    on the order rows are read in; the per table sums are then hashed together.
+
+    Given an as of date, it is folded into the fingerprint of the candidates holding a current position
+    not yet capped, see running_positions, so they count as changed on every new date until the position
+    is capped.
+
+    Parameters:
+    -----------
+    candidate_ids : list-like
+        Ids of the candidates to fingerprint
+    tables : dict
+        Source tables keyed by name, each with a candidate_id column
+    as_of_date : str or datetime.date, optional
+        Date current positions run up to, the as_of_date of the ScoreCalculator scoring the tables
+
+    Returns:
+    --------
+    pandas.Series
+        uint64 fingerprint of each unique candidate, indexed by candidate_id
+    """
+    candidate_index = pd.Index(pd.unique(np.asarray(candidate_ids)))
+    table_hashes = {}
+    for name, df in tables.items():
+        if name == 'citation':
+            df = df[CITATION_INPUT_COLUMNS].drop_duplicates()
+        row_hashes = pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).to_numpy()
+
+        # Sum the row hashes of each candidate, wrapping around on overflow
+        rows = candidate_index.get_indexer(df['candidate_id'])
+        known = rows >= 0
+        candidate_hashes = np.zeros(len(candidate_index), dtype=np.uint64)
+        np.add.at(candidate_hashes, rows[known], row_hashes[known])
+        table_hashes[name] = candidate_hashes
+
+    fingerprints = pd.util.hash_pandas_object(pd.DataFrame(table_hashes, index=candidate_index), index=True)
+
+    # Fold the as of date into the fingerprints of the candidates whose experience grows with it
+    if as_of_date is not None:
+        running = running_positions(candidate_index, tables, as_of_date)
+        if running.any():
+            dated = pd.DataFrame({'fingerprint': fingerprints[running],
+                                  'as_of_date': pd.Timestamp(as_of_date).normalize().toordinal()})
+            fingerprints[running] = pd.util.hash_pandas_object(dated, index=False).to_numpy()
+
+    return fingerprints
+
+
+class FingerprintStore:
+    """
+    A class storing the fingerprint and total funded amount of every scored candidate in a MySQL table,
+    so the next run can tell which candidates changed and what the top funded amount was.
+
+    Attributes:
+    ----------
+    pool : ConnectionPool
+        Pool of connections to the database holding the table
+    table : str
+        Name of the fingerprint table
+
+    Methods:
+    -------
+    load() -> pd.DataFrame
+        Loads the stored fingerprints, creating the table if it does not exist.
+    save(fingerprints, funded_totals)
+        Upserts the fingerprints and funded totals of some candidates.
+    delete(candidate_ids)
+        Deletes the fingerprints of some candidates.
+    """
+
+    def __init__(self, pool, table='score_fingerprints'):
+        self.pool = pool
+        self.table = table
+
+    def load(self):
+        """
+        Loads the stored fingerprints, creating the table if it does not exist.
+
+        Returns:
+        -------
+        pd.DataFrame
+            df with candidate_id, fingerprint and funded_total columns
+        """
+        with self.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (candidate_id BIGINT PRIMARY KEY, "
+                           "fingerprint BIGINT UNSIGNED NOT NULL, funded_total DOUBLE NOT NULL)")
+            cursor.execute(f"SELECT candidate_id, fingerprint, funded_total FROM {self.table}")
+            rows = cursor.fetchall()
+            cnx.commit()
+            cursor.close()
+
+        return pd.DataFrame(rows, columns=['candidate_id', 'fingerprint', 'funded_total'])
+
+    def save(self, fingerprints, funded_totals):
+        """
+        Upserts the fingerprints and funded totals of some candidates.
+
+        Parameters:
+        -----------
+        fingerprints : pandas.Series
+            Fingerprint of each candidate, indexed by candidate_id
+        funded_totals : pandas.Series
+            Total funded amount of each candidate, indexed by candidate_id
+        """
+        rows = [(int(candidate_id), int(fingerprint), float(funded_totals.get(candidate_id, 0)))
+                for candidate_id, fingerprint in fingerprints.items()]
+        with self.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.executemany(f"INSERT INTO {self.table} (candidate_id, fingerprint, funded_total) VALUES (%s, %s, %s) "
+                               "ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), funded_total = VALUES(funded_total)", rows)
+            cnx.commit()
+            cursor.close()
+
+    def delete(self, candidate_ids):
+        """
+        Deletes the fingerprints of some candidates.
+
+        Parameters:
+        -----------
+        candidate_ids : list-like
+            Ids of the candidates to delete
+        """
+        with self.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.executemany(f"DELETE FROM {self.table} WHERE candidate_id = %s", [(int(candidate_id),) for candidate_id in candidate_ids])
+            cnx.commit()
+            cursor.close()
+
+
+def rescore_changed(calculator, store=None, batch_size=1000):
+    """
+    Rescores only the candidates that are new or whose rows changed since the last run and upserts their
+    results into score_cal_results.
+
+    Candidates holding a current position not yet capped are rescored whenever the as of date moves,
+    since their experience grows with it.
+
+    Funded research is scored against the top funded amount of the whole pool. When that amount differs
+    from the previous run, the funded research score of every unchanged candidate with funding is
+    renormalized in place, along with their others_total and total_score. Candidates no longer in the
+    pool are forgotten, their rows in score_cal_results are left as they are.
+
+    Parameters:
+    -----------
+    calculator : ScoreCalculator
+        Calculator over the whole applicant pool
+    store : FingerprintStore, optional
+        Where fingerprints are kept, defaults to the score_fingerprints table of the calculator's database
+    batch_size : int, optional
+        Number of rows sent per statement
+
+    Returns:
+    --------
+    dict
+        Number of candidates in the pool, rescored and renormalized, and the rescored results
+    """
+    store = store if store is not None else FingerprintStore(calculator.pool)
+
+    # Find the new and changed candidates
+    fingerprints = candidate_fingerprints(calculator.candidate_df['candidate_id'], calculator.source_tables,
+                                          calculator.as_of_date)
+    previous = store.load()
+    previous_fingerprints = previous.set_index('candidate_id')['fingerprint'].astype('uint64')
+    changed = ~fingerprints.index.isin(previous_fingerprints.index)
+    known = fingerprints.index[~changed]
+    changed[~changed] = fingerprints[known].to_numpy() != previous_fingerprints[known].to_numpy()
+    changed_ids = fingerprints.index[changed]
+
+    # Score the changed candidates against the top funded amount of the whole pool
+    funded_totals = calculator.funded_research_totals()
+    max_funded_amount = funded_totals.max() if len(funded_totals) else 0
+    results = None
+    if len(changed_ids):
+        changed_calculator = calculator.subset(changed_ids)
+
+        # Number new citations after the existing ones so rows of unchanged candidates are not overwritten
+        first_cit_id = 1
+        if 'cit_id' in calculator.citation_df and calculator.citation_df['cit_id'].notna().any():
+            first_cit_id = int(calculator.citation_df['cit_id'].max()) + 1
+
+        results = changed_calculator.calculate_scores(max_funded_amount, first_cit_id)
+        calculator.upload_cal_results(results, upsert=True, batch_size=batch_size)
+
+    # Renormalize the funded research score of unchanged funded candidates when the top amount moved
+    renormalized = 0
+    previous_max_funded_amount = previous['funded_total'].max() if len(previous) else None
+    if previous_max_funded_amount is not None and max_funded_amount != previous_max_funded_amount:
+        unchanged_totals = funded_totals[~funded_totals.index.isin(changed_ids) & (funded_totals > 0)]
+        scores = (unchanged_totals/max_funded_amount)*2
+        rows = [(float(score), float(score), float(score), int(candidate_id)) for candidate_id, score in scores.items()]
+        with calculator.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            # MySQL assigns left to right, so funded_research_others still holds the old score in the first two
+            query = ("UPDATE score_cal_results SET others_total = others_total - funded_research_others + %s, "
+                     "total_score = total_score - funded_research_others + %s, funded_research_others = %s "
+                     "WHERE candidate_id = %s")
+            for i in range(0, len(rows), batch_size):
+                cursor.executemany(query, rows[i:i + batch_size])
+            cnx.commit()
+            cursor.close()
+        renormalized = len(rows)
+
+    # Remember the fingerprints only once the results are stored, and forget candidates no longer in the pool
+    store.save(fingerprints[changed_ids], funded_totals)
+    removed_ids = previous.loc[~previous['candidate_id'].isin(fingerprints.index), 'candidate_id']
+    if len(removed_ids):
+        store.delete(removed_ids)
+
+    return {'candidates': len(fingerprints), 'rescored': len(changed_ids), 'renormalized': renormalized, 'results': results}
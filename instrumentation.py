@@ -0,0 +1,223 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """
+    Records the wall time, peak memory and counters of each stage of a scoring run, to find where the
+    time of a slow run went. Counters are functions returning a running total, e.g. the database round
+    trips of a connection pool, and each stage records how much they grew while it ran. Stages can be
+    nested, and a stage run several times is reported once with its totals.
+
+    Stages can run on several threads at once. Counters and the traced memory are process wide, so the
+    counters and peak memory of stages overlapping in time include each other's. Memory is traced from
+    the first stage entered until the last running stage, on any thread, exits.
+
+    Attributes:
+    ----------
+    trace_memory : bool
+        Whether the peak memory allocated by each stage is traced with tracemalloc, which slows stages down
+    profile_stages : set
+        Names of the stages profiled with cProfile
+    profile_dir : str
+        Directory the profiles are written to, one <stage>.prof file per profiled stage
+    counters : dict
+        Functions returning the running total of each counter, keyed by counter name
+
+    Methods:
+    -------
+    add_counter(name, function)
+        Registers a counter.
+    stage(name) -> ContextManager
+        Measures the stage run in a with block.
+    report() -> dict
+        Returns the measurements of every stage.
+    write_json(path)
+        Writes the run report as JSON.
+    prometheus() -> str
+        Returns the measurements in the Prometheus text exposition format.
+    write_prometheus(path)
+        Writes the measurements in the Prometheus text exposition format.
+    """
+
+    # Prefix of the exported Prometheus metrics
+    METRIC_PREFIX = 'score_stage'
+
+    def __init__(self, trace_memory=False, profile_stages=(), profile_dir='.'):
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.profile_dir = profile_dir
+        self.counters = {}
+        self.started_at = time.time()
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._traced_frames = []
+        self._started_tracing = False
+
+    def add_counter(self, name, function):
+        """
+        Registers a counter, replacing any counter of the same name.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the counter, e.g. 'db_round_trips'
+        function : callable
+            Function returning the running total of the counter
+        """
+        self.counters[name] = function
+
+    def __read_counters(self):
+        # Counters may be registered by another thread meanwhile
+        return {name: function() for name, function in list(self.counters.items())}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the stage run in a with block.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the stage
+        """
+        # Trace memory from the first stage running on any thread on. The peak is process wide, so before it
+        # is reset for this stage the peak so far is credited to every stage running, on any thread.
+        frame = {'peak': 0, 'start_memory': 0}
+        if self.trace_memory:
+            with self._lock:
+                if not self._traced_frames and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracing = True
+                current_memory, peak_memory = tracemalloc.get_traced_memory()
+                for running_frame in self._traced_frames:
+                    running_frame['peak'] = max(running_frame['peak'], peak_memory)
+                tracemalloc.reset_peak()
+                frame['start_memory'] = current_memory
+                self._traced_frames.append(frame)
+
+        # Only one profiler can be enabled at a time
+        profiler = None
+        with self._lock:
+            if name in self.profile_stages and not self._profiling:
+                profiler = cProfile.Profile()
+                self._profiling = True
+        if profiler is not None:
+            profiler.enable()
+
+        counters_before = self.__read_counters()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            counters_after = self.__read_counters()
+
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+                with self._lock:
+                    self._profiling = False
+
+            peak_bytes = None
+            if self.trace_memory:
+                with self._lock:
+                    frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                    peak_bytes = frame['peak'] - frame['start_memory']
+                    self._traced_frames = [running_frame for running_frame in self._traced_frames if running_frame is not frame]
+
+                    # Stop tracing once the last running stage exits, if tracing was started here
+                    if not self._traced_frames and self._started_tracing:
+                        tracemalloc.stop()
+                        self._started_tracing = False
+
+            with self._lock:
+                stage = self._stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': None, 'counters': {}})
+                stage['calls'] += 1
+                stage['seconds'] += seconds
+                if peak_bytes is not None:
+                    stage['peak_bytes'] = max(stage['peak_bytes'] or 0, peak_bytes)
+                for counter, value in counters_after.items():
+                    stage['counters'][counter] = stage['counters'].get(counter, 0) + value - counters_before.get(counter, 0)
+
+    def report(self):
+        """
+        Returns the measurements of every stage.
+
+        Returns:
+        --------
+        dict
+            Start time of the run and, per stage in the order they first finished, the number of calls, total
+            seconds, largest peak of bytes allocated and total growth of each counter
+        """
+        with self._lock:
+            return {'started_at': self.started_at,
+                    'stages': {name: {**stage, 'counters': dict(stage['counters'])} for name, stage in self._stages.items()}}
+
+    def write_json(self, path):
+        """
+        Writes the run report as JSON, see report.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def prometheus(self):
+        """
+        Returns the measurements in the Prometheus text exposition format, one series per stage.
+
+        Returns:
+        --------
+        str
+            The exposition text
+        """
+        metrics = {'calls_total': ('counter', "Number of times each scoring stage ran.", {}),
+                   'seconds_total': ('counter', "Wall time spent in each scoring stage.", {}),
+                   'peak_bytes': ('gauge', "Largest peak of memory allocated by each scoring stage.", {})}
+        for name, stage in self.report()['stages'].items():
+            metrics['calls_total'][2][name] = stage['calls']
+            metrics['seconds_total'][2][name] = stage['seconds']
+            if stage['peak_bytes'] is not None:
+                metrics['peak_bytes'][2][name] = stage['peak_bytes']
+            for counter, value in stage['counters'].items():
+                metrics.setdefault(f'{counter}_total', ('counter', f"Growth of the {counter} counter during each scoring stage.", {}))[2][name] = value
+
+        lines = []
+        for metric, (metric_type, help_text, values) in metrics.items():
+            if not values:
+                continue
+            metric = f'{self.METRIC_PREFIX}_{metric}'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            lines.extend(f'{metric}{{stage="{name}"}} {value}' for name, value in values.items())
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes the measurements in the Prometheus text exposition format, e.g. for the node exporter's
+        textfile collector. The file is replaced atomically so it is never scraped half written.
+        """
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+
+def instrumented(method):
+    """
+    Decorates a method of a class with a metrics attribute so each call is measured as a stage named
+    after the method.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.stage(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,389 @@
+import hashlib
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+
+# Guards the comparison counters of the matchers, matchers are pickled so they cannot hold a lock themselves
+_comparisons_lock = threading.Lock()
+
+
+def normalize_title(title):
+    """
+    Normalizes a title the way fuzz.token_sort_ratio does before comparing strings: non letters and
+    numbers are replaced by whitespace, the string is lower cased and its tokens are sorted.
+
+    Parameters:
+    -----------
+    title : str
+        The title to normalize
+
+    Returns:
+    --------
+    str
+        The normalized title, or None if title is None
+    """
+    if title is None:
+        return None
+    processed = utils.full_process(title if isinstance(title, str) else str(title), force_ascii=True)
+
+    return " ".join(sorted(processed.split()))
+
+
+class JournalMatcher:
+    """
+    An index over journal titles that finds the same best fuzzy match as scanning every title with
+    fuzz.token_sort_ratio, while only scoring a short list of titles.
+
+    Titles are normalized once. For a query, an upper bound of the similarity with every title is
+    computed from character counts in one vectorized pass (a match can never pair more characters than
+    the two strings have in common). Titles are then scored in decreasing order of that bound, and the
+    search stops as soon as no remaining title can reach the best score found so far.
+
+    Attributes:
+    ----------
+    titles : list
+        The journal titles in their original order
+    normalized_titles : list
+        The titles normalized with normalize_title
+    title_quartiles : dict
+        SJR quartile of each title, if quartiles were given
+    source_key : str
+        Identifies the journal list the matcher was built from, set by load_journal_matcher. Matches
+        memoized in a JournalMatchMemo are only reused by matchers of the same source key.
+
+    Methods:
+    -------
+    find_best_match(journal_name, min_score=None) -> Tuple[str, int]
+        Finds the best matching title for a journal name.
+    match_many(journal_names, min_score=None, memo=None) -> List[Tuple[str, int, str]]
+        Finds the best matching title and its quartile for each journal name, matching repeated names once.
+    """
+
+    def __init__(self, titles, quartiles=None):
+        self.titles = list(titles)
+        self.normalized_titles = [normalize_title(title) for title in self.titles]
+        self.comparisons = 0
+        self.source_key = None
+
+        # SJR quartile of each title, taken from its first row
+        self.title_quartiles = {}
+        if quartiles is not None:
+            for title, quartile in zip(self.titles, quartiles):
+                self.title_quartiles.setdefault(title, quartile)
+
+        # First title for each normalized title, these match a query with the same normalized form exactly
+        self.exact_matches = {}
+        for idx, normalized_title in enumerate(self.normalized_titles):
+            self.exact_matches.setdefault(normalized_title, idx)
+
+        # Character count matrix, one row per title and one column per character used in any title
+        codepoints = [np.frombuffer(title.encode('utf-32-le'), dtype=np.uint32) for title in self.normalized_titles]
+        self.lengths = np.array([len(title_codepoints) for title_codepoints in codepoints], dtype=np.int64)
+        all_codepoints = np.concatenate(codepoints) if codepoints else np.array([], dtype=np.uint32)
+        self.alphabet, char_columns = np.unique(all_codepoints, return_inverse=True)
+        title_rows = np.repeat(np.arange(len(self.titles)), self.lengths)
+        self.char_counts = np.bincount(title_rows*len(self.alphabet) + char_columns,
+                                       minlength=len(self.titles)*len(self.alphabet))
+        self.char_counts = self.char_counts.reshape(len(self.titles), len(self.alphabet)).astype(np.uint16)
+
+    def __upper_bounds(self, normalized_name):
+        """
+        Computes an upper bound of fuzz.ratio between a normalized name and every normalized title.
+
+        Returns:
+        --------
+        numpy.ndarray
+            Bound of the similarity (0-100, before rounding) for each title
+        """
+        codepoints = np.frombuffer(normalized_name.encode('utf-32-le'), dtype=np.uint32)
+        columns = np.searchsorted(self.alphabet, codepoints)
+        known = (columns < len(self.alphabet))
+        known[known] = self.alphabet[columns[known]] == codepoints[known]
+        name_counts = np.bincount(columns[known], minlength=len(self.alphabet)).astype(np.uint16)
+
+        common_chars = np.minimum(self.char_counts, name_counts).sum(axis=1)
+
+        return 200*common_chars/(len(codepoints) + self.lengths)
+
+    def _match(self, normalized_name, min_score=None):
+        """
+        Finds the index and score of the best matching title for a normalized name. Ties go to the
+        first title, as with a linear scan.
+
+        Returns:
+        --------
+        Tuple[int, int]
+            Index of the best title (None if no title was scored) and its similarity score
+        """
+        if not self.titles:
+            return None, float('-inf')
+
+        # fuzz.ratio gives 0 for a missing or empty string, unless both strings are equal
+        if normalized_name is None:
+            return 0, 0
+        if not normalized_name:
+            exact_idx = self.exact_matches.get('')
+            return (0, 0) if exact_idx is None else (exact_idx, 100)
+
+        best_idx = self.exact_matches.get(normalized_name)
+        best_score = 100 if best_idx is not None else float('-inf')
+
+        # Titles whose bound rounds below the score to beat can never win
+        upper_bounds = self.__upper_bounds(normalized_name) + 0.5 + 1e-9
+        lowest_score = float('-inf') if min_score is None else min_score + 1
+        candidates = np.flatnonzero(upper_bounds >= lowest_score)
+        comparisons = 0
+        for idx in candidates[np.lexsort((candidates, -upper_bounds[candidates]))]:
+            if upper_bounds[idx] < best_score:
+                break
+            score = fuzz.ratio(normalized_name, self.normalized_titles[idx])
+            comparisons += 1
+            if score > best_score or (score == best_score and idx < best_idx):
+                best_idx, best_score = idx, score
+
+        # Stages matching journals may run on several threads at once
+        with _comparisons_lock:
+            self.comparisons += comparisons
+
+        if best_idx is None:
+            return None, 0
+
+        return int(best_idx), best_score
+
+    def find_best_match(self, journal_name, min_score=None):
+        """
+        Finds the best matching title for a journal name. This gives the same result as scoring every
+        title with fuzz.token_sort_ratio and keeping the first title with the highest score.
+
+        Parameters:
+        -----------
+        journal_name : str
+            The journal name to find a match for
+        min_score : int, optional
+            Only scores above min_score are of interest. When no title scores above it the search stops
+            early and the returned match and score (<= min_score) are not guaranteed to be the best.
+
+        Returns:
+        --------
+        best_match : str
+            The best matching title
+        max_similarity_score : int
+            The similarity score between the journal name and the best matching title
+        """
+        idx, score = self._match(normalize_title(journal_name), min_score)
+
+        return (self.titles[idx] if idx is not None else None), score
+
+    def match_many(self, journal_names, min_score=None, memo=None):
+        """
+        Finds the best matching title for each journal name, with its SJR quartile; names normalizing to
+        the same string are matched once.
+
+        Parameters:
+        -----------
+        journal_names : list
+            The journal names to find matches for
+        min_score : int, optional
+            See find_best_match
+        memo : JournalMatchMemo, optional
+            Persistent memo of matches found before, looked up first and filled with the new matches.
+            Not used by matchers without a source_key.
+
+        Returns:
+        --------
+        list
+            A (best_match, max_similarity_score, quartile) tuple for each journal name
+        """
+        return _match_with_memo(journal_names, min_score, memo, self.source_key, lambda: self)
+
+    def _match_normalized(self, normalized_names, min_score=None):
+        """
+        Finds the best matching title and its quartile for each of some distinct normalized names.
+
+        Returns:
+        --------
+        dict
+            A (best_match, max_similarity_score, quartile) tuple for each normalized name
+        """
+        matches = {}
+        for normalized_name in normalized_names:
+            idx, score = self._match(normalized_name, min_score)
+            best_match = self.titles[idx] if idx is not None else None
+            matches[normalized_name] = (best_match, score, self.title_quartiles.get(best_match))
+
+        return matches
+
+
+def _match_with_memo(journal_names, min_score, memo, source_key, get_matcher):
+    """
+    Looks journal names up in a memo, if any, and matches the rest with the matcher returned by
+    get_matcher, which is only called when some name is missing from the memo.
+    """
+    normalized_names = [normalize_title(journal_name) for journal_name in journal_names]
+    matches = {}
+    memo = memo if source_key is not None else None
+    if memo is not None:
+        memo.use_source(source_key)
+        matches = memo.get_many([name for name in normalized_names if name is not None], min_score)
+
+    missing_names = [name for name in dict.fromkeys(normalized_names) if name not in matches]
+    if missing_names:
+        new_matches = get_matcher()._match_normalized(missing_names, min_score)
+        matches.update(new_matches)
+        if memo is not None:
+            memo.set_many({name: match for name, match in new_matches.items() if name is not None}, min_score)
+
+    return [matches[normalized_name] for normalized_name in normalized_names]
+
+
+def match_journals(journal_names, csv_path='journal_ranks.csv', column_name='Title', quartile_column=None,
+                   min_score=None, memo=None):
+    """
+    Finds the best matching title of a csv file for each journal name, with its SJR quartile, see
+    JournalMatcher.match_many. With a memo the matcher is only loaded if some name is missing from it,
+    so runs finding every name memoized never load the journal index.
+
+    Parameters:
+    -----------
+    journal_names : list
+        The journal names to find matches for
+    csv_path, column_name, quartile_column : str
+        The csv file and columns of the titles and quartiles, see load_journal_matcher
+    min_score : int, optional
+        See JournalMatcher.find_best_match
+    memo : JournalMatchMemo, optional
+        Persistent memo of matches found before, looked up first and filled with the new matches
+
+    Returns:
+    --------
+    list
+        A (best_match, max_similarity_score, quartile) tuple for each journal name
+    """
+    source_key = journal_source_key(csv_path, column_name, quartile_column) if memo is not None else None
+
+    return _match_with_memo(journal_names, min_score, memo, source_key,
+                            lambda: load_journal_matcher(csv_path, column_name, quartile_column))
+
+
+# Version of the precompiled matcher artifact format, bump it when JournalMatcher changes
+ARTIFACT_VERSION = 1
+
+# Matchers loaded in this process, keyed by the csv file they were built from
+_journal_matchers = {}
+
+# Artifact keys of the csv files seen in this process, keyed like _journal_matchers
+_artifact_keys = {}
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _csv_key(csv_path, column_name, quartile_column):
+    """
+    Identifies a csv file and its columns in this process, changing whenever the file is modified.
+    """
+    stat = os.stat(csv_path)
+
+    return (os.path.abspath(csv_path), column_name, quartile_column, stat.st_mtime_ns, stat.st_size)
+
+
+def _artifact_key(csv_path, column_name, quartile_column, key):
+    """
+    Returns the key of the artifact compiled from a csv file's contents, hashing the file once per key.
+    """
+    if key not in _artifact_keys:
+        _artifact_keys[key] = (ARTIFACT_VERSION, _file_sha256(csv_path), column_name, quartile_column)
+
+    return _artifact_keys[key]
+
+
+def journal_source_key(csv_path='journal_ranks.csv', column_name='Title', quartile_column=None):
+    """
+    Returns the source_key the JournalMatcher over a csv file has, without loading the matcher. It changes
+    with the csv's contents, see JournalMatchMemo.
+
+    Parameters:
+    -----------
+    csv_path, column_name, quartile_column : str
+        The csv file and columns, see load_journal_matcher
+
+    Returns:
+    --------
+    str
+        The source key
+    """
+    key = _csv_key(csv_path, column_name, quartile_column)
+
+    return ':'.join(map(str, _artifact_key(csv_path, column_name, quartile_column, key)))
+
+
+def load_journal_matcher(csv_path='journal_ranks.csv', column_name='Title', quartile_column=None, artifact_path=None):
+    """
+    Returns the JournalMatcher over the titles of a csv file. The matcher is precompiled into a binary
+    artifact next to the csv, rebuilt only when the csv's contents change, and loaded once per process.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path to the csv file containing the journal titles
+    column_name : str
+        Name of the column containing the journal titles
+    quartile_column : str, optional
+        Name of the column containing the SJR quartile of each journal
+    artifact_path : str, optional
+        Path to the precompiled artifact, defaults to the csv path with an .idx extension
+
+    Returns:
+    --------
+    JournalMatcher
+        The matcher over the titles in the csv file
+    """
+    key = _csv_key(csv_path, column_name, quartile_column)
+    if key in _journal_matchers:
+        return _journal_matchers[key]
+
+    artifact_path = artifact_path if artifact_path is not None else os.path.splitext(csv_path)[0] + '.idx'
+    artifact_key = _artifact_key(csv_path, column_name, quartile_column, key)
+
+    # Reuse the artifact if it was compiled from the same csv contents
+    matcher = None
+    try:
+        with open(artifact_path, 'rb') as f:
+            artifact = pickle.load(f)
+        if artifact['key'] == artifact_key:
+            matcher = artifact['matcher']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError):
+        pass
+
+    if matcher is None:
+        columns = [column_name] + ([quartile_column] if quartile_column is not None else [])
+        journal_ranks = pd.read_csv(csv_path, usecols=columns)
+        quartiles = journal_ranks[quartile_column] if quartile_column is not None else None
+        matcher = JournalMatcher(journal_ranks[column_name], quartiles)
+
+        # Write the artifact atomically so concurrent runs never read a partial file
+        with open(artifact_path + '.tmp', 'wb') as f:
+            pickle.dump({'key': artifact_key, 'matcher': matcher}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(artifact_path + '.tmp', artifact_path)
+
+    matcher.source_key = ':'.join(map(str, artifact_key))
+    _journal_matchers[key] = matcher
+
+    return matcher
+
+
+def comparisons_made():
+    """
+    Returns the number of fuzzy comparisons made so far by every matcher loaded in this process.
+    """
+    return sum(matcher.comparisons for matcher in _journal_matchers.values())
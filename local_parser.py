@@ -0,0 +1,234 @@
+import datetime
+import logging
+import re
+import threading
+
+from reference_parser import ReferenceParserClient
+
+logger = logging.getLogger(__name__)
+
+# DOI anywhere in a reference, bare or as a doi: / doi.org prefix, without trailing punctuation
+DOI_PATTERN = re.compile(r'(?:https?://(?:dx\.)?doi\.org/|\bdoi:\s*)?\b(10\.\d{4,9}/[^\s"<>]+?)[.,;]?(?=\s|$)', re.IGNORECASE)
+
+# Reference styles, each with the confidence a reference matching it has before its DOI and year are checked
+REFERENCE_PATTERNS = (
+    # APA: Authors (2020). Title. Journal, 12(3), 45-67. https://doi.org/...
+    ('apa', 0.6, re.compile(r'^(?P<authors>.+?)\s\((?P<year>\d{4})[a-z]?\)\.\s(?P<title>.+?)[.?!]\s'
+                            r'(?P<journal>[^,]+?),\s\d+(?:\([^)]*\))?(?:,\s[\w\-–]+)?\.?(?:\s|$)')),
+    # IEEE: Authors, "Title," Journal, vol. 12, no. 3, pp. 45-67, Mar. 2020, doi: ...
+    ('ieee', 0.6, re.compile(r'^(?P<authors>.+?),\s[“"](?P<title>.+?),?[”"],?\s(?:in\s)?(?P<journal>[^,]+),\s'
+                             r'(?:vol\.\s\w+,\s)?(?:no\.\s\w+,\s)?(?:pp\.\s[\w\-–]+,\s)?(?:[A-Z][a-z]{2,8}\.?\s)?(?P<year>\d{4})\b')),
+    # Plain: Title. Journal. 2020. 10.xxxx/...
+    ('plain', 0.5, re.compile(r'^(?P<title>[^.]+)\.\s(?P<journal>[^.]+)\.\s(?P<year>\d{4})\.\s(?P<doi>10\.\d{4,9}/\S+)$')),
+)
+
+# Styles whose title ends at the first period, so a period inside the title cuts it short
+PERIOD_SPLIT_STYLES = {'apa', 'plain'}
+
+# A title cut at the period of an abbreviation ends in it, e.g. 'A study of U.S' or 'Smith et al'
+ABBREVIATION_PATTERN = re.compile(r'(?:\b[A-Za-z]\.[A-Za-z]|\b(?:al|cf|Dr|etc|Inc|Jr|Mr|Mrs|Ms|No|Prof|St|vol|vs))$')
+
+# A sentence break left inside the journal, e.g. 'policy. Energy Policy' after a title cut short
+SENTENCE_BREAK_PATTERN = re.compile(r'[.?!]\s')
+
+
+class LocalReferenceParser:
+    """
+    Parses well formed academic references locally with compiled patterns of the APA, IEEE and plain
+    'title. journal. year. doi' styles, giving each parse a confidence between 0 and 1. A reference
+    matching a style gets its base confidence, raised when it has a DOI and a plausible year and lowered
+    when its title may have been cut at a period: the title ends in an abbreviation or the journal holds
+    a sentence break.
+
+    Methods:
+    -------
+    parse_reference(reference) -> tuple
+        Parses one reference into title, journal, year and doi, with its confidence.
+    parse(text) -> tuple
+        Parses the references of a text, one per line, with the confidence of the least confident.
+    """
+
+    # Confidence added by a DOI and by a year between MIN_YEAR and next year
+    DOI_CONFIDENCE = 0.3
+    YEAR_CONFIDENCE = 0.1
+    MIN_YEAR = 1900
+
+    # Confidence taken off a parse whose title may have been cut at a period
+    CUT_TITLE_PENALTY = 0.5
+
+    def parse_reference(self, reference):
+        """
+        Parses one reference into title, journal, year and doi.
+
+        Parameters:
+        -----------
+        reference : str
+            One academic reference
+
+        Returns:
+        --------
+        tuple
+            [title, journal, year, doi] and the confidence of the parse, (None, 0.0) if no style matches
+        """
+        reference = ' '.join(reference.split())
+        for style, confidence, pattern in REFERENCE_PATTERNS:
+            match = pattern.match(reference)
+            if match is None:
+                continue
+            fields = match.groupdict()
+            doi = fields.get('doi') or next((doi.group(1) for doi in DOI_PATTERN.finditer(reference)), '')
+            doi = doi.rstrip('.,;')
+            year = fields['year']
+
+            confidence += self.DOI_CONFIDENCE if doi else 0.0
+            confidence += self.YEAR_CONFIDENCE if self.MIN_YEAR <= int(year) <= datetime.date.today().year + 1 else 0.0
+
+            title, journal = fields['title'].strip().rstrip('.,'), fields['journal'].strip()
+            if style in PERIOD_SPLIT_STYLES and (ABBREVIATION_PATTERN.search(title) or SENTENCE_BREAK_PATTERN.search(journal)):
+                confidence -= self.CUT_TITLE_PENALTY
+
+            return [title, journal, year, doi], round(max(confidence, 0.0), 6)
+
+        return None, 0.0
+
+    def parse(self, text):
+        """
+        Parses the references of a text, one per non empty line, in the flat format of the parsing API.
+
+        Parameters:
+        -----------
+        text : str
+            Text of one or more academic references
+
+        Returns:
+        --------
+        tuple
+            Flat list of title, journal, year and doi for each reference and the confidence of the least
+            confident reference, (None, 0.0) if a reference matches no style or the text is empty
+        """
+        parsed, confidence = [], 1.0
+        for line in str(text).splitlines():
+            if not line.strip():
+                continue
+            reference, reference_confidence = self.parse_reference(line)
+            if reference is None:
+                return None, 0.0
+            parsed.extend(reference)
+            confidence = min(confidence, reference_confidence)
+
+        return (parsed, confidence) if parsed else (None, 0.0)
+
+
+class LocalFirstParserClient:
+    """
+    A parser client parsing references locally, only calling the parsing API for the references the local
+    parser is not confident about. Texts are split into their references, one per line, each distinct
+    reference is parsed once and the parses are put back together per text. It can be used wherever a
+    ReferenceParserClient is, e.g. as the parser_client of a ScoreCalculator.
+
+    Attributes:
+    ----------
+    remote : ReferenceParserClient
+        Client of the parsing API the references below min_confidence are sent to
+    local_parser : LocalReferenceParser
+        Parser tried first on every reference
+    min_confidence : float
+        Confidence a local parse needs to be kept, above 1 every reference goes to the parsing API
+    local_parses : int
+        Number of references parsed locally
+    remote_parses : int
+        Number of references sent to the parsing API
+
+    Methods:
+    -------
+    parse(text) -> list
+        Parses the references in a text.
+    parse_many(texts) -> dict
+        Parses many texts, returns their parses keyed by text.
+    """
+
+    def __init__(self, remote=None, min_confidence=0.8, local_parser=None):
+        self.remote = remote if remote is not None else ReferenceParserClient()
+        self.local_parser = local_parser if local_parser is not None else LocalReferenceParser()
+        self.min_confidence = min_confidence
+        self.local_parses = 0
+        self.remote_parses = 0
+        self._counter_lock = threading.Lock()
+
+    @property
+    def requests_made(self):
+        """
+        Number of HTTP requests made to the parsing API, including retries
+        """
+        return self.remote.requests_made
+
+    @property
+    def retries(self):
+        """
+        Number of retried requests to the parsing API
+        """
+        return self.remote.retries
+
+    @property
+    def local_share(self):
+        """
+        Share of the references parsed so far that were parsed locally, None before any reference is parsed
+        """
+        parses = self.local_parses + self.remote_parses
+
+        return self.local_parses/parses if parses else None
+
+    def __parse_locally(self, reference):
+        """
+        Returns the local parse of a reference if it is confident enough, otherwise None.
+        """
+        parsed, confidence = self.local_parser.parse_reference(reference)
+
+        return parsed if parsed is not None and confidence >= self.min_confidence else None
+
+    def __count(self, local, remote):
+        with self._counter_lock:
+            self.local_parses += local
+            self.remote_parses += remote
+
+    def parse(self, text):
+        """
+        Parses the references in a text, see ReferenceParserClient.parse.
+        """
+        return self.parse_many([text])[text]
+
+    def parse_many(self, texts):
+        """
+        Parses many texts reference by reference, locally when confident and the rest concurrently with
+        the parsing API, see ReferenceParserClient.parse_many. Texts holding no reference are sent to the
+        parsing API whole.
+        """
+        text_references = {text: [line.strip() for line in str(text).splitlines() if line.strip()]
+                           for text in dict.fromkeys(texts)}
+
+        # Parse each distinct reference once, locally if confident enough
+        parsed_references, remote_references = {}, []
+        for reference in dict.fromkeys(reference for references in text_references.values() for reference in references):
+            parsed = self.__parse_locally(reference)
+            if parsed is not None:
+                parsed_references[reference] = parsed
+            else:
+                remote_references.append(reference)
+        self.__count(len(parsed_references), len(remote_references))
+        if parsed_references or remote_references:
+            logger.info("Parsed %d of %d references locally, sending %d to the parsing API",
+                        len(parsed_references), len(parsed_references) + len(remote_references), len(remote_references))
+
+        empty_texts = [text for text, references in text_references.items() if not references]
+        parsed_remotely = self.remote.parse_many(remote_references + empty_texts)
+        parsed_references.update((reference, parsed_remotely[reference]) for reference in remote_references)
+
+        # Put the parses of each text's references back together, in order
+        return {text: [field for reference in references for field in parsed_references[reference]]
+                if references else parsed_remotely[text] for text, references in text_references.items()}
+
+    def close(self):
+        """
+        Closes the client of the parsing API.
+        """
+        self.remote.close()
@@ -1,55 +1,169 @@
 from scores import DBConnector, ScoreCalculator
+from parse_cache import ParseCache
+from match_memo import JournalMatchMemo
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from incremental import rescore_changed
+from snapshot import TableSnapshot
+from sharded import score_sharded
+from streaming import StreamingScorer
+from instrumentation import RunMetrics
+from pipeline import StageGraph
+import argparse
+import datetime
+import logging
+import os
 import warnings
-import pandas as pd
 warnings.filterwarnings('ignore')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
 
-# Instantiate an object of DBConnector class
-db = DBConnector(host="localhost", username="hussam", password="abcd123?", database="wire")
+parser = argparse.ArgumentParser(description="Score candidate applications and upload the results.")
+parser.add_argument('--incremental', action='store_true',
+                    help="only rescore candidates that are new or changed since the last incremental run")
+parser.add_argument('--parallel-load', type=int, default=0, metavar='WORKERS',
+                    help="load the source tables concurrently on this many connections")
+parser.add_argument('--snapshot', metavar='DIR',
+                    help="reuse unchanged tables from a local snapshot in DIR and snapshot the rest")
+parser.add_argument('--offline', action='store_true',
+                    help="read every table from the --snapshot and write only output.csv and the metrics, "
+                         "without contacting the database")
+parser.add_argument('--pushdown', action='store_true',
+                    help="aggregate the experience, others and funded research tables per candidate in the database")
+parser.add_argument('--local-confidence', type=float, default=0.8, metavar='C',
+                    help="parse references locally when at least this confident, above 1 always call the parsing API")
+parser.add_argument('--parser-batch-size', type=int, default=1, metavar='N',
+                    help="send up to N distinct references per parsing API request, 1 sends one request per text")
+parser.add_argument('--shards', type=int, default=0, metavar='N',
+                    help="score the candidates in N shards on a pool of processes")
+parser.add_argument('--metrics-json', metavar='PATH',
+                    help="write the wall time, memory and counters of each stage to PATH as JSON")
+parser.add_argument('--metrics-prometheus', metavar='PATH',
+                    help="write the stage metrics to PATH in the Prometheus text format")
+parser.add_argument('--trace-memory', action='store_true',
+                    help="trace the peak memory of each stage, slowing the run down")
+parser.add_argument('--profile-stage', action='append', default=[], metavar='STAGE',
+                    help="profile STAGE with cProfile into STAGE.prof, can be repeated")
+parser.add_argument('--stream', type=int, default=0, metavar='CHUNK',
+                    help="score the pool CHUNK candidates at a time without loading whole tables, writing each chunk out")
+parser.add_argument('--concurrency', type=int, default=4, metavar='N',
+                    help="run up to N independent pipeline stages at the same time")
+args = parser.parse_args()
+if args.pushdown and args.snapshot:
+    parser.error("--pushdown cannot be combined with --snapshot")
+if args.offline and not args.snapshot:
+    parser.error("--offline needs a --snapshot to read the tables from")
+if args.offline and args.incremental:
+    parser.error("--offline cannot be combined with --incremental, which keeps its fingerprints in the database")
+if args.stream and (args.incremental or args.snapshot or args.pushdown or args.shards > 1):
+    parser.error("--stream cannot be combined with --incremental, --snapshot, --pushdown or --shards")
+
+# Database credentials are read from the environment, every run but an offline one needs them
+credentials = {name: os.environ.get(name) for name in ('DB_USER', 'DB_PASSWORD', 'DB_NAME')}
+missing = [name for name, value in credentials.items() if value is None]
+if missing and not args.offline:
+    parser.error(f"set {', '.join(missing)} in the environment to connect to the database")
+
+# Tables are loaded and scored as of the same date
+as_of_date = datetime.date.today()
 
-# Load tables of interest from the db as pandas dfs
-candidate_df, degree_bsc_df, degree_master_df, dergee_phd_df,\
-teaching_exp_df, industry_exp_df, patents_df, supervision_bsc_df,\
-supervision_masters_df, supervision_phd_df, committee_work_df,\
-quality_accreditation_df, certificates_df, awards_df,funded_research_df,citation_df = db.load_tables()
+# Measure each stage of the run
+metrics = RunMetrics(trace_memory=args.trace_memory, profile_stages=args.profile_stage)
+
+# Instantiate an object of DBConnector class
+db = DBConnector(host=os.environ.get('DB_HOST', "localhost"), username=credentials['DB_USER'],
+                 password=credentials['DB_PASSWORD'], database=credentials['DB_NAME'],
+                 pool_size=max(5, args.parallel_load), metrics=metrics)
 
-# Instantiate ScoreCalculator class
-calculate_score = ScoreCalculator(db.host, db.username, db.password, db.database,candidate_df,
-                                degree_bsc_df, degree_master_df, dergee_phd_df, teaching_exp_df,
-                                industry_exp_df, patents_df,supervision_bsc_df, supervision_masters_df,
-                                supervision_phd_df,committee_work_df, quality_accreditation_df,
-                                certificates_df, awards_df, funded_research_df,citation_df)
+# Parse cache, journal match memo and parsing API client shared by every scorer of the run
+try:
+    remote_parser_client = ReferenceParserClient(batch_size=args.parser_batch_size)
+except ValueError as error:
+    parser.error(str(error))
+parser_client = LocalFirstParserClient(remote_parser_client, min_confidence=args.local_confidence)
+parse_cache = ParseCache('parse_cache.sqlite')
+match_memo = JournalMatchMemo('journal_match_memo.sqlite')
 
-# Calculate university ranking based candidate scores
-uni_ranking_scores = calculate_score.university_score()
+if args.stream:
+    # Score the pool a chunk of candidates at a time, writing each chunk out before fetching the next
+    streamer = StreamingScorer(db.host, db.username, db.password, db.database, as_of_date=as_of_date,
+                               parse_cache=parse_cache, parser_client=parser_client, pool=db.pool, metrics=metrics,
+                               match_memo=match_memo)
+    streamed = streamer.score_stream(chunk_size=args.stream)
+    print(f"Scored {streamed['candidates']} candidates in {streamed['chunks']} chunks, "
+          f"uploaded {streamed['rows_uploaded']} rows in {streamed['seconds']:.1f} s")
+else:
+    # Load tables of interest from the db as pandas dfs
+    snapshot = TableSnapshot(args.snapshot) if args.snapshot else None
+    candidate_df, degree_bsc_df, degree_master_df, dergee_phd_df,\
+    teaching_exp_df, industry_exp_df, patents_df, supervision_bsc_df,\
+    supervision_masters_df, supervision_phd_df, committee_work_df,\
+    quality_accreditation_df, certificates_df, awards_df,funded_research_df,citation_df = \
+        db.load_tables(parallel=args.parallel_load > 0, max_workers=max(1, args.parallel_load),
+                       snapshot=snapshot, offline=args.offline, pushdown=args.pushdown, as_of_date=as_of_date)
+    print(f"Loaded tables use {sum(db.table_memory_usage.values())/2**20:.1f} MiB: {db.table_memory_usage}")
 
-# Calculate teaching expereince based candidate score
-teaching_exp_scores = calculate_score.teaching_expereince_score()
+    # Instantiate ScoreCalculator class
+    calculate_score = ScoreCalculator(db.host, db.username, db.password, db.database,candidate_df,
+                                    degree_bsc_df, degree_master_df, dergee_phd_df, teaching_exp_df,
+                                    industry_exp_df, patents_df,supervision_bsc_df, supervision_masters_df,
+                                    supervision_phd_df,committee_work_df, quality_accreditation_df,
+                                    certificates_df, awards_df, funded_research_df,citation_df,
+                                    as_of_date=as_of_date, parse_cache=parse_cache, match_memo=match_memo,
+                                    parser_client=parser_client, pool=db.pool, metrics=metrics)
 
-# Calculate industry expereince based candidate score
-industry_exp_scores = calculate_score.industry_experience_score()
+    if args.incremental:
+        # Only rescore the candidates that changed since the last run and upsert their results
+        rescored = rescore_changed(calculate_score)
+        print(f"Rescored {rescored['rescored']} of {rescored['candidates']} candidates, "
+              f"renormalized funded research of {rescored['renormalized']}")
+    else:
+        # Calculate university ranking, teaching expereince, industry expereince, others and techinical publications
+        # based candidate scores, assembled on candidate_id along with their total_score. The stages run as a
+        # dependency graph so the publications stage, waiting on the parsing API, overlaps the other scorers.
+        stages = StageGraph()
+        # Offline runs write no parsed citations and upload nothing
+        write_citations = not args.offline
+        if args.shards > 1:
+            stages.add('scores', lambda: score_sharded(calculate_score, shards=args.shards, snapshot=snapshot,
+                                                       write_citations=write_citations))
+        else:
+            # The publications stage is added first so it starts first
+            stages.add('technical_publications_score',
+                       lambda: calculate_score.technical_publications_score(write_citations=write_citations))
+            for name in ['university_score', 'teaching_expereince_score', 'industry_experience_score', 'others_score']:
+                stages.add(name, getattr(calculate_score, name))
+            stages.add('scores', calculate_score.assemble_scores,
+                       {'uni_ranking_scores': 'university_score', 'teaching_exp_scores': 'teaching_expereince_score',
+                        'industry_exp_scores': 'industry_experience_score', 'others_scores': 'others_score',
+                        'tech_publications_scores': 'technical_publications_score'})
 
-# Calculate others based candidate score
-others_scores = calculate_score.others_score()
+        # Save the results in a csv called output, and upload them into 'score_cal_results' table of wire db
+        stages.add('output_csv', lambda merged_df: merged_df.to_csv('output.csv', index=False), ['scores'])
+        if not args.offline:
+            stages.add('upload', calculate_score.upload_cal_results, ['scores'])
 
-# Calculate techinical publications based candidate score
-tech_publications_scores = calculate_score.technical_publications_score()
+        results = stages.run(max_concurrency=args.concurrency)
+        merged_df = results['scores']
+        if not args.offline:
+            upload_stats = results['upload']
+            print(f"Uploaded {upload_stats['rows']} rows at {upload_stats['rows_per_second']:.0f} rows/s")
 
-# Merge the four dataframes based on candidate_id column
-merged_df = pd.merge(uni_ranking_scores, teaching_exp_scores, on="candidate_id")
-merged_df = pd.merge(merged_df, industry_exp_scores, on="candidate_id")
-merged_df = pd.merge(merged_df, others_scores, on="candidate_id")
-merged_df = pd.merge(merged_df, tech_publications_scores, on="candidate_id")
+        # Print results in the terminal
+        print(merged_df)
 
-# Create a total_score col in the merged_df
-merged_df['total_score'] = merged_df['uni_ranking_score']+merged_df['teaching_exp_score']+\
-                           merged_df['industry_exp_score']+merged_df['others_total']+\
-                           merged_df['technical_publications_score']
+# Report how many references were parsed without calling the parsing API
+if parser_client.local_share is not None:
+    print(f"Parsed {parser_client.local_share:.0%} of references locally, "
+          f"made {parser_client.requests_made} parsing API requests")
 
-# Save the results in a csv called output
-merged_df.to_csv('output.csv', index=False)
+# Report how many journal names were matched from the memo of previous runs
+print(f"Journal match memo: {match_memo.stats}")
 
-# Upload results into 'score_cal_results' table of wire db
-calculate_score.upload_cal_results()
+# Report how the shared connection pool was used
+print(f"Connection pool: {db.pool.stats}")
 
-# Print results in the terminal
-print(merged_df)
\ No newline at end of file
+# Export the stage metrics
+if args.metrics_json:
+    metrics.write_json(args.metrics_json)
+if args.metrics_prometheus:
+    metrics.write_prometheus(args.metrics_prometheus)
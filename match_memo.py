@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+
+# Journal names looked up per query, below SQLite's limit on the number of parameters
+LOOKUP_BATCH_SIZE = 500
+
+
+class JournalMatchMemo:
+    """
+    A persistent memo of journal matches, stored in a SQLite file and keyed by the normalized journal name,
+    so a journal name seen in a previous candidate or run is never fuzzy matched again. Each entry holds
+    the best matching title, its similarity and its SJR quartile.
+
+    Matches are only valid for the journal list they were found in. The memo records the source key of
+    the matcher that filled it, which changes with the contents of journal_ranks.csv, and is cleared when
+    used with a matcher of another source key.
+
+    Attributes:
+    ----------
+    path : str
+        Path to the SQLite file holding the memo
+    source_key : str
+        Source key of the matcher whose matches are memoized, None while the memo is empty
+    hits : int
+        Number of journal names found in the memo
+    misses : int
+        Number of journal names not found in the memo
+
+    Methods:
+    -------
+    use_source(source_key)
+        Clears the memo if it holds matches of another journal list.
+    get_many(normalized_names, min_score=None) -> dict
+        Returns the memoized matches of some normalized journal names.
+    set_many(matches, min_score=None)
+        Stores matches.
+    clear()
+        Drops every entry.
+    """
+
+    def __init__(self, path='journal_match_memo.sqlite'):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by all threads, serialized with a lock. Processes sharing the file wait
+        # for each other's writes.
+        self._lock = threading.Lock()
+        self._cnx = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._cnx.execute("CREATE TABLE IF NOT EXISTS journal_matches (match_key TEXT PRIMARY KEY, best_match TEXT, "
+                          "similarity REAL NOT NULL, quartile TEXT)")
+        self._cnx.execute("CREATE TABLE IF NOT EXISTS memo_source (source_key TEXT NOT NULL)")
+        self._cnx.commit()
+        row = self._cnx.execute("SELECT source_key FROM memo_source").fetchone()
+        self.source_key = row[0] if row is not None else None
+
+    @staticmethod
+    def key(normalized_name, min_score=None):
+        """
+        Returns the memo key of a normalized journal name. Matches found with a minimum score may stop
+        early, so they are keyed by it too.
+        """
+        return f'{min_score}:{normalized_name}'
+
+    def use_source(self, source_key):
+        """
+        Clears the memo if it holds matches of a journal list other than source_key's, see JournalMatcher.
+
+        Parameters:
+        -----------
+        source_key : str
+            Source key of the matcher about to use the memo
+        """
+        if source_key == self.source_key:
+            return
+        with self._lock:
+            self._cnx.execute("DELETE FROM journal_matches")
+            self._cnx.execute("DELETE FROM memo_source")
+            self._cnx.execute("INSERT INTO memo_source (source_key) VALUES (?)", (source_key,))
+            self._cnx.commit()
+            self.source_key = source_key
+
+    def get_many(self, normalized_names, min_score=None):
+        """
+        Returns the memoized matches of some normalized journal names.
+
+        Parameters:
+        -----------
+        normalized_names : list-like
+            Journal names normalized with normalize_title
+        min_score : int, optional
+            Minimum score the matches were found with, see JournalMatcher.find_best_match
+
+        Returns:
+        --------
+        dict
+            (best_match, similarity, quartile) of each name found in the memo, keyed by normalized name
+        """
+        names = {self.key(name, min_score): name for name in dict.fromkeys(normalized_names)}
+        keys = list(names)
+        matches = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + LOOKUP_BATCH_SIZE]
+                rows = self._cnx.execute("SELECT match_key, best_match, similarity, quartile FROM journal_matches "
+                                         f"WHERE match_key IN ({', '.join('?'*len(batch))})", batch).fetchall()
+                for match_key, best_match, similarity, quartile in rows:
+                    matches[names[match_key]] = (best_match, int(similarity) if similarity.is_integer() else similarity, quartile)
+            self.hits += len(matches)
+            self.misses += len(names) - len(matches)
+
+        return matches
+
+    def set_many(self, matches, min_score=None):
+        """
+        Stores matches, replacing any previous match of the same names.
+
+        Parameters:
+        -----------
+        matches : dict
+            (best_match, similarity, quartile) of each normalized journal name
+        min_score : int, optional
+            Minimum score the matches were found with
+        """
+        if not matches:
+            return
+        rows = [(self.key(name, min_score), best_match, float(similarity),
+                 None if quartile is None or quartile != quartile else str(quartile))
+                for name, (best_match, similarity, quartile) in matches.items()]
+        with self._lock:
+            self._cnx.executemany("INSERT OR REPLACE INTO journal_matches (match_key, best_match, similarity, quartile) "
+                                  "VALUES (?, ?, ?, ?)", rows)
+            self._cnx.commit()
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self._lock:
+            self._cnx.execute("DELETE FROM journal_matches")
+            self._cnx.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._cnx.execute("SELECT COUNT(*) FROM journal_matches").fetchone()[0]
+
+    @property
+    def stats(self):
+        """
+        Hit and miss counters of the memo as a dict
+        """
+        lookups = self.hits + self.misses
+
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/lookups if lookups else 0.0}
+
+    def close(self):
+        """
+        Closes the underlying SQLite connection.
+        """
+        with self._lock:
+            self._cnx.close()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ParseCacheMiss(LookupError):
+    """
+    Raised in cache only mode when a reference text has no cached parse.
+    """
+
+
+class ParseCache:
+    """
+    A persistent cache of parsed academic references, stored in a SQLite file and keyed by the
+    SHA-256 hash of the reference text, so unchanged references are never sent to the parsing API twice.
+
+    The size limit counts entries, not bytes: once the cache holds more than max_entries, set() drops the
+    least recently used entries, so the limit holds during a run. Entries older than max_age_days are
+    dropped when the cache is opened, unless evict_on_open is False, and whenever evict() is called.
+
+    Attributes:
+    ----------
+    path : str
+        Path to the SQLite file holding the cache
+    max_entries : int
+        Maximum number of entries kept in the cache, whatever their size, None for no limit
+    max_age_days : float
+        Entries parsed longer ago than this are dropped
+    cache_only : bool
+        If True, references missing from the cache raise ParseCacheMiss instead of calling the API
+    hits : int
+        Number of lookups answered from the cache
+    misses : int
+        Number of lookups not found in the cache
+
+    Methods:
+    -------
+    get(text) -> list
+        Returns the cached parse of a reference text, or None.
+    set(text, parsed)
+        Stores the parse of a reference text.
+    evict() -> int
+        Drops expired and least recently used entries, returns the number dropped.
+    """
+
+    def __init__(self, path='parse_cache.sqlite', max_entries=100000, max_age_days=180, cache_only=False, evict_on_open=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.cache_only = cache_only
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by all threads, serialized with a lock
+        self._lock = threading.Lock()
+        self._cnx = sqlite3.connect(path, check_same_thread=False)
+        self._cnx.execute("CREATE TABLE IF NOT EXISTS parsed_references (text_hash TEXT PRIMARY KEY, "
+                          "parsed TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._cnx.execute("CREATE INDEX IF NOT EXISTS parsed_references_accessed_at ON parsed_references (accessed_at)")
+        self._cnx.commit()
+        if evict_on_open:
+            self.evict()
+        else:
+            self._entries = self.__count()
+
+    @staticmethod
+    def key(text):
+        """
+        Returns the cache key of a reference text i.e. the hex SHA-256 digest of its UTF-8 bytes.
+        """
+        return hashlib.sha256(str(text).encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        """
+        Returns the cached parse of a reference text.
+
+        Parameters:
+        -----------
+        text : str
+            The reference text
+
+        Returns:
+        --------
+        list
+            The parsed reference, or None if it is not cached
+        """
+        text_hash = self.key(text)
+        with self._lock:
+            row = self._cnx.execute("SELECT parsed FROM parsed_references WHERE text_hash = ?", (text_hash,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._cnx.execute("UPDATE parsed_references SET accessed_at = ? WHERE text_hash = ?", (time.time(), text_hash))
+            self._cnx.commit()
+
+        return json.loads(row[0])
+
+    def set(self, text, parsed):
+        """
+        Stores the parse of a reference text, replacing any previous parse.
+
+        Parameters:
+        -----------
+        text : str
+            The reference text
+        parsed : list
+            The parsed reference, it must be JSON serializable
+        """
+        now = time.time()
+        text_hash = self.key(text)
+        with self._lock:
+            is_new = self._cnx.execute("SELECT 1 FROM parsed_references WHERE text_hash = ?", (text_hash,)).fetchone() is None
+            self._cnx.execute("INSERT OR REPLACE INTO parsed_references (text_hash, parsed, created_at, accessed_at) "
+                              "VALUES (?, ?, ?, ?)", (text_hash, json.dumps(list(parsed)), now, now))
+            self._entries += is_new
+
+            # Keep the cache within max_entries by dropping the least recently used entries
+            if self.max_entries is not None and self._entries > self.max_entries:
+                self._entries -= self._cnx.execute("DELETE FROM parsed_references WHERE text_hash IN (SELECT text_hash FROM "
+                                                   "parsed_references ORDER BY accessed_at, rowid LIMIT ?)",
+                                                   (self._entries - self.max_entries,)).rowcount
+            self._cnx.commit()
+
+    def evict(self):
+        """
+        Drops entries older than max_age_days, then the least recently used entries above max_entries.
+
+        Returns:
+        --------
+        int
+            The number of entries dropped
+        """
+        with self._lock:
+            dropped = self._cnx.execute("DELETE FROM parsed_references WHERE created_at < ?",
+                                        (time.time() - self.max_age_days*86400,)).rowcount
+            if self.max_entries is not None:
+                dropped += self._cnx.execute("DELETE FROM parsed_references WHERE text_hash IN (SELECT text_hash FROM "
+                                             "parsed_references ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                                             (self.max_entries,)).rowcount
+            self._cnx.commit()
+            self._entries = self.__count()
+
+        return dropped
+
+    def __count(self):
+        return self._cnx.execute("SELECT COUNT(*) FROM parsed_references").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self.__count()
+
+    @property
+    def stats(self):
+        """
+        Hit and miss counters of the cache as a dict
+        """
+        lookups = self.hits + self.misses
+
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/lookups if lookups else 0.0}
+
+    def close(self):
+        """
+        Closes the underlying SQLite connection.
+        """
+        with self._lock:
+            self._cnx.close()
@@ -0,0 +1,141 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraph:
+    """
+    A dependency graph of pipeline stages, run on a bounded thread pool. Each stage starts as soon as the
+    stages it depends on are done, so stages waiting on the network overlap with CPU bound ones.
+
+    Attributes:
+    ----------
+    stages : dict
+        (function, dependencies, keywords) of each stage, keyed by name in the order they were added. keywords
+        holds the argument each dependency's result is passed as, None when they are passed in order.
+    stage_seconds : dict
+        Seconds each stage took in the last run, keyed by name
+
+    Methods:
+    -------
+    add(name, function, dependencies=())
+        Adds a stage.
+    order() -> list
+        Returns the stage names in an order respecting their dependencies.
+    run(max_concurrency=4) -> dict
+        Runs every stage and returns their results.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.stage_seconds = {}
+
+    def add(self, name, function, dependencies=()):
+        """
+        Adds a stage.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the stage
+        function : callable
+            Function running the stage, called with the results of its dependencies
+        dependencies : list-like or dict, optional
+            Names of the stages whose results the stage needs, passed in order. A dict maps the keyword
+            arguments of the function to the stages whose results they are passed.
+
+        Returns:
+        --------
+        StageGraph
+            The graph, so calls can be chained
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already in the graph.")
+        if isinstance(dependencies, dict):
+            self.stages[name] = (function, tuple(dependencies.values()), tuple(dependencies))
+        else:
+            self.stages[name] = (function, tuple(dependencies), None)
+
+        return self
+
+    def order(self):
+        """
+        Returns the stage names in an order respecting their dependencies.
+
+        Raises:
+        -------
+        ValueError: If a stage depends on a stage not in the graph or the dependencies form a cycle.
+        """
+        order, visiting, done = [], set(), set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name not in self.stages:
+                raise ValueError(f"Stage {path[-1]} depends on unknown stage {name}.")
+            if name in visiting:
+                raise ValueError(f"Stages depend on each other in a cycle: {' -> '.join(path + [name])}.")
+            visiting.add(name)
+            for dependency in self.stages[name][1]:
+                visit(dependency, path + [name])
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+
+        return order
+
+    def run(self, max_concurrency=4):
+        """
+        Runs every stage, at most max_concurrency at the same time. If a stage fails, stages not yet
+        started are skipped, the running ones are waited for and the error is raised.
+
+        Parameters:
+        -----------
+        max_concurrency : int, optional
+            Maximum number of stages running at the same time
+
+        Returns:
+        --------
+        dict
+            The result of each stage, keyed by name
+        """
+        pending = self.order()
+        results, running = {}, {}
+        self.stage_seconds = {}
+
+        def run_stage(name):
+            function, dependencies, keywords = self.stages[name]
+            start_time = time.perf_counter()
+            if keywords is None:
+                result = function(*(results[dependency] for dependency in dependencies))
+            else:
+                result = function(**{keyword: results[dependency] for keyword, dependency in zip(keywords, dependencies)})
+            self.stage_seconds[name] = time.perf_counter() - start_time
+            logger.info("Stage %s done in %.3f s", name, self.stage_seconds[name])
+
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            while pending or running:
+                # Start the stages whose dependencies are done, in the order they were added
+                for name in [name for name in pending if all(dependency in results for dependency in self.stages[name][1])]:
+                    if len(running) >= max_concurrency:
+                        break
+                    pending.remove(name)
+                    running[executor.submit(run_stage, name)] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        wait(running)
+                        raise
+
+        return results
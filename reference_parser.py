@@ -0,0 +1,364 @@
+import ast
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Scale API deployment that splits academic references into title, journal, year and doi
+PARSER_API_URL = "https://dashboard.scale.com/spellbook/api/v2/deploy/9e63bii"
+
+# Environment variable holding the parsing API token, sent as the Basic authorization of every request
+PARSER_API_TOKEN_VARIABLE = 'PARSER_API_TOKEN'
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limited or a server side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# HTTP statuses of an API refusing the shape of a batch request
+BATCH_REJECTED_STATUSES = {400, 404, 405, 415, 422}
+
+
+class ReferenceParserError(Exception):
+    """
+    Raised when a reference could not be parsed by the parsing API.
+    """
+
+
+class BatchRejectedError(ReferenceParserError):
+    """
+    Raised when the parsing API does not take batch requests.
+    """
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket limiting how often requests are made. Tokens are added at rate per
+    second up to capacity and every request takes one token, waiting for it if the bucket is empty.
+
+    Attributes:
+    ----------
+    rate : float
+        Tokens added per second
+    capacity : float
+        Maximum number of tokens i.e. the largest burst of requests
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token from the bucket, blocking until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at)*self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens)/self.rate
+            time.sleep(wait)
+
+
+def parser_api_headers():
+    """
+    Returns the headers authorizing requests to the parsing API, with the token read from the
+    PARSER_API_TOKEN environment variable.
+
+    Returns:
+    --------
+    dict
+        The authorization header
+
+    Raises:
+    -------
+    ValueError: If PARSER_API_TOKEN is not set.
+    """
+    token = os.environ.get(PARSER_API_TOKEN_VARIABLE)
+    if not token:
+        raise ValueError(f"Set the {PARSER_API_TOKEN_VARIABLE} environment variable to the parsing API token, "
+                         "or pass the headers of the parsing API requests.")
+
+    return {"Authorization": f"Basic {token}"}
+
+
+class ReferenceParserClient:
+    """
+    Client for the reference parsing API. Requests go through one pooled HTTP session with a timeout,
+    are retried with exponential backoff on connection errors, timeouts and retryable statuses, and can
+    be rate limited with a token bucket. parse_many() parses references concurrently on a thread pool.
+
+    With a batch_size above 1, parse_many() splits texts into their references, one per line, parses
+    each distinct reference once and packs them into batch requests of at most batch_size references and
+    max_batch_chars characters. References the API fails to parse are retried in new batches on their own,
+    until max_retries rounds in a row parse none of them.
+
+    Batch requests assume the API takes {"inputs": [{"text": ...}, ...]} and answers {"outputs":
+    [{"output": ...}, ...]} in the same order, as stub_parser_server.py does. The deployed API is only
+    known to take {"input": {"text": ...}}, hence batch_size defaults to 1. If the API answers a batch
+    request with a client error or a response of another shape, the client logs a warning, sets
+    batches_rejected and sends one request per text from then on.
+
+    Attributes:
+    ----------
+    url : str
+        URL of the parsing API
+    headers : dict
+        Headers sent with every request, by default the authorization header with the token read from the
+        PARSER_API_TOKEN environment variable, see parser_api_headers
+    max_workers : int
+        Maximum number of references parsed concurrently
+    timeout : float
+        Timeout in seconds of each request
+    max_retries : int
+        Number of times a failed request is retried
+    backoff : float
+        Seconds waited before the first retry, doubled for every further retry
+    rate_limiter : TokenBucket
+        Limits the request rate, None for no limit
+    batch_size : int
+        Maximum number of references per batch request, 1 sends every text in a request of its own
+    max_batch_chars : int
+        Maximum number of reference characters per batch request
+    requests_made : int
+        Number of HTTP requests made, including retries
+    retries : int
+        Number of retried requests
+    item_retries : int
+        Number of references retried after the API failed to parse them in a batch
+    batches_rejected : bool
+        Whether the API rejected a batch request, after which every text is sent in a request of its own
+
+    Methods:
+    -------
+    parse(text) -> list
+        Parses the references in a text.
+    parse_many(texts) -> dict
+        Parses many texts concurrently, returns their parses keyed by text.
+    """
+
+    def __init__(self, url=PARSER_API_URL, headers=None, max_workers=8, timeout=60, max_retries=3,
+                 backoff=1.0, rate_limit=None, burst=None, batch_size=1, max_batch_chars=20000):
+        self.url = url
+        self.headers = dict(parser_api_headers() if headers is None else headers)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.requests_made = 0
+        self.retries = 0
+        self.item_retries = 0
+        self.batches_rejected = False
+        self._counter_lock = threading.Lock()
+
+        # Keep one connection alive per worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __count(self, retry):
+        with self._counter_lock:
+            self.requests_made += 1
+            self.retries += retry
+
+    def __post(self, payload):
+        """
+        Posts a payload to the API, retrying failed requests. Returns the decoded JSON response.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            self.__count(attempt > 0)
+            try:
+                response = self.session.post(self.url, json=payload, headers=self.headers, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.HTTPError(f"{response.status_code} response from the parsing API", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            # Back off exponentially, with jitter so concurrent workers do not retry in lockstep
+            if attempt < self.max_retries:
+                time.sleep(self.backoff*2**attempt*random.uniform(0.5, 1.0))
+
+        raise error
+
+    def parse(self, text):
+        """
+        Parses the references in a text with the parsing API.
+
+        Parameters:
+        -----------
+        text : str
+            The text of one or more academic references
+
+        Returns:
+        --------
+        list
+            Flat list of title, journal, year and doi for each reference in the text
+
+        Raises:
+        -------
+        ReferenceParserError: If the request fails after all retries or the response cannot be parsed.
+        """
+        try:
+            response = self.__post({"input": {"text": text}})
+
+            # The output is the repr of a python list
+            parsed = ast.literal_eval(response['output'])
+            if len(parsed) < 2:
+                raise ValueError("The parsed reference has no journal.")
+
+            return list(parsed)
+
+        # Catch any exceptions that occur during the API request or parsing and raise a new exception with a more informative message
+        except Exception as e:
+            raise ReferenceParserError("Error occurred while processing the API request or parsing the response.") from e
+
+    def parse_many(self, texts):
+        """
+        Parses many texts concurrently on up to max_workers threads; repeated texts are parsed once. With
+        a batch_size above 1 the texts' references are parsed in batches, see the class description.
+
+        Parameters:
+        -----------
+        texts : iterable
+            Texts of academic references
+
+        Returns:
+        --------
+        dict
+            The parse of each text, keyed by text
+
+        Raises:
+        -------
+        ReferenceParserError: If any text could not be parsed.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        if not unique_texts:
+            return {}
+        if self.batch_size > 1 and not self.batches_rejected:
+            try:
+                return self.__parse_batched(unique_texts)
+            except BatchRejectedError as e:
+                # Fall back to the single requests the API is known to take
+                logger.warning("The parsing API rejected a batch request (%s), sending one request per text from now on", e)
+                self.batches_rejected = True
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique_texts))) as executor:
+            return dict(zip(unique_texts, executor.map(self.parse, unique_texts)))
+
+    def __pack(self, references):
+        """
+        Packs references in order into batches of at most batch_size references and max_batch_chars
+        characters; a reference longer than max_batch_chars gets a batch of its own.
+        """
+        batches, batch, batch_chars = [], [], 0
+        for reference in references:
+            if batch and (len(batch) >= self.batch_size or batch_chars + len(reference) > self.max_batch_chars):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(reference)
+            batch_chars += len(reference)
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def __parse_batch(self, references):
+        """
+        Parses a batch of references in one request.
+
+        Returns:
+        --------
+        list
+            The title, journal, year and doi of each reference, None for the references the API failed to parse
+
+        Raises:
+        -------
+        BatchRejectedError: If the API answers with a client error or a response not holding one output per reference.
+        """
+        try:
+            response = self.__post({"inputs": [{"text": reference} for reference in references]})
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in BATCH_REJECTED_STATUSES:
+                raise BatchRejectedError(f"{e.response.status_code} response to a batch request") from e
+            raise
+        outputs = response.get('outputs') if isinstance(response, dict) else None
+        if not isinstance(outputs, list) or len(outputs) != len(references):
+            raise BatchRejectedError("the response does not hold one output per reference")
+
+        parsed_references = []
+        for output in outputs:
+            try:
+                parsed = ast.literal_eval(output['output'])
+                parsed_references.append(list(parsed) if len(parsed) >= 2 else None)
+            except Exception:
+                parsed_references.append(None)
+
+        return parsed_references
+
+    def __parse_batched(self, texts):
+        """
+        Parses texts reference by reference in batch requests, see parse_many.
+        """
+        # Split the texts into their references, parsing each distinct reference once
+        text_references = {text: [line.strip() for line in str(text).splitlines() if line.strip()] for text in texts}
+        if not all(text_references.values()):
+            raise ReferenceParserError("A text holds no reference to parse.")
+        pending = list(dict.fromkeys(reference for references in text_references.values() for reference in references))
+
+        # Retry the references that failed until max_retries rounds in a row parse none of them
+        parsed_references = {}
+        failed_rounds = 0
+        while pending and failed_rounds <= self.max_retries:
+            if parsed_references or failed_rounds:
+                with self._counter_lock:
+                    self.item_retries += len(pending)
+                logger.info("Retrying %d references the parsing API failed to parse", len(pending))
+                time.sleep(self.backoff*2**failed_rounds*random.uniform(0.5, 1.0))
+
+            batches = self.__pack(pending)
+            try:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                    for batch, parsed_batch in zip(batches, executor.map(self.__parse_batch, batches)):
+                        parsed_references.update((reference, parsed) for reference, parsed in zip(batch, parsed_batch)
+                                                 if parsed is not None)
+            except BatchRejectedError:
+                raise
+            except Exception as e:
+                raise ReferenceParserError("Error occurred while processing a batch request to the parsing API.") from e
+
+            # Only the references that failed are sent again
+            remaining = [reference for reference in pending if reference not in parsed_references]
+            failed_rounds = failed_rounds + 1 if len(remaining) == len(pending) else 0
+            pending = remaining
+
+        if pending:
+            raise ReferenceParserError(f"The parsing API failed to parse {len(pending)} references.")
+
+        # Put the parses of each text's references back together, in order
+        return {text: [field for reference in references for field in parsed_references[reference]]
+                for text, references in text_references.items()}
+
+    def close(self):
+        """
+        Closes the pooled HTTP session.
+        """
+        self.session.close()
@@ -0,0 +1,459 @@
+"""
+A long running HTTP/JSON service scoring candidates on demand. The journal index, the connection pool, the
+parse cache and the cached top funded amount stay warm between requests, so a request only pays for the
+candidate's own rows.
+
+Endpoints:
+    POST /score    {"candidate_id": 42} or {"candidate_ids": [42, 43]}
+    GET  /health   database reachability, uptime and pool and cache statistics
+    GET  /metrics  request latency histograms and stage metrics in the Prometheus text format
+
+Database credentials are read from the DB_HOST, DB_USER, DB_PASSWORD and DB_NAME environment variables,
+and the parsing API token from PARSER_API_TOKEN, so they stay out of the command line.
+
+Usage:
+    DB_USER=... DB_PASSWORD=... DB_NAME=... PARSER_API_TOKEN=... python scoring_service.py --port 8080 \
+        --parser-url http://127.0.0.1:8765/
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from candidate_scoring import CandidateScorer
+from instrumentation import RunMetrics
+from local_parser import LocalFirstParserClient
+from match_memo import JournalMatchMemo
+from parse_cache import ParseCache
+from reference_parser import PARSER_API_URL, ReferenceParserClient
+
+logger = logging.getLogger(__name__)
+
+# Reason phrases of the statuses the service answers with
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class LatencyHistogram:
+    """
+    A histogram of request latencies with cumulative buckets, the way Prometheus histograms are exposed.
+
+    Attributes:
+    ----------
+    buckets : tuple
+        Upper bounds of the buckets in seconds, ascending
+    count : int
+        Number of latencies observed
+    sum : float
+        Sum of the latencies observed in seconds
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._bucket_counts = [0]*(len(self.buckets) + 1)
+
+    def observe(self, seconds):
+        """
+        Records a latency.
+        """
+        self._bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative_counts(self):
+        """
+        Returns the number of latencies up to each bucket's upper bound, the last entry counting every latency.
+        """
+        counts, total = [], 0
+        for bucket_count in self._bucket_counts:
+            total += bucket_count
+            counts.append(total)
+
+        return counts
+
+    def quantile(self, q):
+        """
+        Estimates a quantile of the latencies as the upper bound of the bucket it falls in, None if no
+        latency was observed or it falls beyond the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q*self.count
+        for upper_bound, count in zip(self.buckets, self.cumulative_counts()):
+            if count >= rank:
+                return upper_bound
+
+        return None
+
+
+class ScoringService:
+    """
+    Serves candidate scores over HTTP from an asyncio event loop. Requests are read and answered on the
+    loop, while scoring, which queries the database, may call the parsing API and runs the fuzzy journal
+    matching, runs on a thread pool so slow requests do not hold up the others.
+
+    Scoring a batch of candidates costs little more than scoring one, so candidates requested while every
+    worker is busy are queued and scored together in the next batch a worker picks up.
+
+    Attributes:
+    ----------
+    scorer : CandidateScorer
+        Scorer holding the warm journal index, connection pool, parse cache and top funded amount
+    host : str
+        Address the service listens on
+    port : int
+        Port the service listens on, 0 picks a free port
+    max_workers : int
+        Number of batches scored at the same time. Scoring is mostly CPU bound and holds the GIL, so a
+        few workers scoring large batches serve more requests than many scoring small ones.
+    max_batch_size : int
+        Largest number of candidates accepted in one request
+    latencies : dict
+        LatencyHistogram of each route, keyed by route
+
+    Methods:
+    -------
+    start() -> ScoringService
+        Starts listening.
+    stop()
+        Stops listening and waits for the scoring threads.
+    score(payload) -> Tuple[int, dict]
+        Answers a score request.
+    health() -> Tuple[int, dict]
+        Answers a health check.
+    metrics() -> Tuple[int, str]
+        Answers a metrics scrape.
+    prometheus() -> str
+        Returns the request and stage metrics in the Prometheus text format.
+    """
+
+    MAX_BODY_BYTES = 1 << 20
+
+    def __init__(self, scorer, host='127.0.0.1', port=8080, max_workers=2, max_batch_size=1000):
+        self.scorer = scorer
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.max_batch_size = max_batch_size
+        self.latencies = {}
+        self.responses = {}
+        self.started_at = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='score')
+        self._server = None
+        self._queued = []
+        self._busy_workers = 0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/"
+
+    async def start(self):
+        """
+        Starts listening, on a free port if port is 0.
+        """
+        self._server = await asyncio.start_server(self.__handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started_at = time.time()
+        logger.info("Scoring service listening on %s", self.url)
+
+        return self
+
+    async def stop(self):
+        """
+        Stops listening and waits for the requests being scored.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def __handle_connection(self, reader, writer):
+        """
+        Answers the requests sent over a connection, keeping it open between requests unless asked not to.
+        """
+        try:
+            while True:
+                request = await self.__read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                start_time = time.perf_counter()
+                status, response = await self.__dispatch(method, path, body)
+                self.__write_response(writer, status, response, close=headers.get('connection', '').lower() == 'close')
+                await writer.drain()
+
+                route = path if path in ('/score', '/health', '/metrics') else 'other'
+                self.latencies.setdefault(route, LatencyHistogram()).observe(time.perf_counter() - start_time)
+                self.responses[(route, status)] = self.responses.get((route, status), 0) + 1
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def __read_request(self, reader):
+        """
+        Reads a request, returning its method, path, headers keyed by lower cased name and body, or None at the end of the
+        connection. Bodies larger than MAX_BODY_BYTES are not read and their request is answered with a 413.
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > self.MAX_BODY_BYTES:
+            headers['connection'] = 'close'
+            return method, target, headers, None
+        body = await reader.readexactly(length) if length else b''
+
+        return method, urlsplit(target).path, headers, body
+
+    async def __dispatch(self, method, path, body):
+        """
+        Routes a request, returning the response status and body.
+        """
+        routes = {'/score': ('POST', self.score), '/health': ('GET', self.health), '/metrics': ('GET', self.metrics)}
+        if path not in routes:
+            return 404, {'error': f"No route {path}."}
+        route_method, handler = routes[path]
+        if method != route_method:
+            return 405, {'error': f"{path} only accepts {route_method}."}
+        if body is None:
+            return 413, {'error': f"Request bodies are limited to {self.MAX_BODY_BYTES} bytes."}
+
+        try:
+            if route_method == 'POST':
+                try:
+                    payload = json.loads(body or b'{}')
+                except ValueError:
+                    return 400, {'error': "The request body is not valid JSON."}
+                return await handler(payload)
+            return await handler()
+        except Exception:
+            logger.exception("Failed to answer %s %s", method, path)
+            return 500, {'error': "Internal error."}
+
+    @staticmethod
+    def __write_response(writer, status, body, close=False):
+        if isinstance(body, str):
+            data, content_type = body.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            data, content_type = json.dumps(body).encode('utf-8'), 'application/json'
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n"
+                     .encode('latin-1') + data)
+
+    async def score(self, payload):
+        """
+        Answers a score request for one candidate, {"candidate_id": id}, or a batch, {"candidate_ids": [ids]}.
+
+        Returns:
+        --------
+        Tuple[int, dict]
+            The status and the scores of the candidate, or of each candidate keyed by id. Scores are null for
+            candidates the batch pipeline would not score either, unknown candidates are listed as missing.
+        """
+        if not isinstance(payload, dict):
+            return 400, {'error': "Send {\"candidate_id\": id} or {\"candidate_ids\": [ids]}."}
+
+        if 'candidate_id' in payload:
+            candidate_id = payload['candidate_id']
+            if not isinstance(candidate_id, int) or isinstance(candidate_id, bool):
+                return 400, {'error': "candidate_id must be an integer."}
+            scores = await self.__score_queued([candidate_id])
+            if candidate_id not in scores:
+                return 404, {'error': f"No candidate with id {candidate_id}."}
+            return 200, {'candidate_id': candidate_id, 'scores': scores[candidate_id]}
+
+        candidate_ids = payload.get('candidate_ids')
+        if not isinstance(candidate_ids, list) or not all(isinstance(candidate_id, int) and not isinstance(candidate_id, bool)
+                                                           for candidate_id in candidate_ids):
+            return 400, {'error': "Send {\"candidate_id\": id} or {\"candidate_ids\": [ids]}."}
+        if len(candidate_ids) > self.max_batch_size:
+            return 400, {'error': f"At most {self.max_batch_size} candidates can be scored per request."}
+
+        candidate_ids = list(dict.fromkeys(candidate_ids))
+        scores = await self.__score_queued(candidate_ids)
+        return 200, {'scores': {str(candidate_id): scores[candidate_id] for candidate_id in candidate_ids if candidate_id in scores},
+                     'missing': [candidate_id for candidate_id in candidate_ids if candidate_id not in scores]}
+
+    async def __score_queued(self, candidate_ids):
+        """
+        Queues candidates for scoring and waits for their scores, keyed by candidate_id as returned by
+        CandidateScorer.score_candidates.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queued.append((candidate_ids, future))
+        if self._busy_workers < self.max_workers:
+            self._busy_workers += 1
+            asyncio.create_task(self.__score_batches())
+
+        return await future
+
+    async def __score_batches(self):
+        """
+        Scores the queued candidates in batches of up to max_batch_size until the queue is empty.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self._queued:
+                # Take queued requests until the batch is full, always at least one
+                batch, batch_size = [], 0
+                while self._queued and (not batch or batch_size + len(self._queued[0][0]) <= self.max_batch_size):
+                    batch.append(self._queued.pop(0))
+                    batch_size += len(batch[-1][0])
+
+                candidate_ids = list(dict.fromkeys(candidate_id for candidate_ids, _ in batch for candidate_id in candidate_ids))
+                try:
+                    scores = await loop.run_in_executor(self._executor, self.scorer.score_candidates, candidate_ids)
+                except Exception as e:
+                    if len(batch) == 1:
+                        if not batch[0][1].done():
+                            batch[0][1].set_exception(e)
+                        continue
+                    # Rescore each coalesced request on its own so a failure only reaches the request causing it
+                    logger.warning("Scoring a batch of %d requests failed (%s), scoring them one by one", len(batch), e)
+                    for candidate_ids, future in batch:
+                        try:
+                            scores = await loop.run_in_executor(self._executor, self.scorer.score_candidates, candidate_ids)
+                        except Exception as request_error:
+                            if not future.done():
+                                future.set_exception(request_error)
+                            continue
+                        if not future.done():
+                            future.set_result({candidate_id: scores[candidate_id] for candidate_id in candidate_ids if candidate_id in scores})
+                    continue
+                for candidate_ids, future in batch:
+                    if not future.done():
+                        future.set_result({candidate_id: scores[candidate_id] for candidate_id in candidate_ids if candidate_id in scores})
+        finally:
+            self._busy_workers -= 1
+
+    async def health(self):
+        """
+        Answers a health check, pinging the database off the event loop.
+
+        Returns:
+        --------
+        Tuple[int, dict]
+            200 if the database answered, 503 otherwise, with uptime and pool, parse cache and match memo statistics
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.run_in_executor(None, self.__ping_database), timeout=5)
+            database = 'ok'
+        except Exception as e:
+            database = f'error: {e.__class__.__name__}'
+
+        return (200 if database == 'ok' else 503), {
+            'status': 'ok' if database == 'ok' else 'degraded',
+            'database': database,
+            'uptime_seconds': time.time() - self.started_at,
+            'pool': self.scorer.pool.stats,
+            'parse_cache': self.scorer.parse_cache.stats if self.scorer.parse_cache is not None else None,
+            'match_memo': self.scorer.match_memo.stats if self.scorer.match_memo is not None else None,
+            'requests': sum(self.responses.values()),
+            'score_latency_p50': self.latencies['/score'].quantile(0.5) if '/score' in self.latencies else None,
+            'score_latency_p95': self.latencies['/score'].quantile(0.95) if '/score' in self.latencies else None,
+        }
+
+    async def metrics(self):
+        """
+        Answers a metrics scrape, see prometheus.
+        """
+        return 200, self.prometheus()
+
+    def __ping_database(self):
+        with self.scorer.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+
+    def prometheus(self):
+        """
+        Returns the request latency histograms, response counts and stage metrics in the Prometheus text format.
+        """
+        lines = ['# HELP score_service_request_seconds Latency of the requests answered by the scoring service.',
+                 '# TYPE score_service_request_seconds histogram']
+        for route, histogram in self.latencies.items():
+            for upper_bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.cumulative_counts()):
+                lines.append(f'score_service_request_seconds_bucket{{route="{route}",le="{upper_bound}"}} {count}')
+            lines.append(f'score_service_request_seconds_sum{{route="{route}"}} {histogram.sum}')
+            lines.append(f'score_service_request_seconds_count{{route="{route}"}} {histogram.count}')
+        lines += ['# HELP score_service_responses_total Responses sent by the scoring service.',
+                  '# TYPE score_service_responses_total counter']
+        lines += [f'score_service_responses_total{{route="{route}",status="{status}"}} {count}'
+                  for (route, status), count in self.responses.items()]
+
+        return '\n'.join(lines) + '\n' + self.scorer.metrics.prometheus()
+
+
+async def serve(service):
+    """
+    Runs a service until SIGINT or SIGTERM, then stops it.
+    """
+    await service.start()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    await stopped.wait()
+    await service.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve candidate scores over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2, help="batches of candidates scored at the same time")
+    parser.add_argument('--db-host', default=os.environ.get('DB_HOST', 'localhost'), help="defaults to $DB_HOST")
+    parser.add_argument('--db-user', default=os.environ.get('DB_USER'), help="defaults to $DB_USER")
+    parser.add_argument('--database', default=os.environ.get('DB_NAME'), help="defaults to $DB_NAME")
+    parser.add_argument('--parser-url', default=PARSER_API_URL, help="parsing API, e.g. a local stub_parser_server.py")
+    parser.add_argument('--parser-batch-size', type=int, default=1, metavar='N',
+                        help="references per parsing API request, 1 sends one request per text")
+    parser.add_argument('--local-confidence', type=float, default=0.8, metavar='C',
+                        help="parse references locally when at least this confident, above 1 always call the parsing API")
+    parser.add_argument('--parse-cache', default='parse_cache.sqlite', metavar='PATH')
+    parser.add_argument('--match-memo', default='journal_match_memo.sqlite', metavar='PATH')
+    args = parser.parse_args()
+    if not args.db_user or not args.database:
+        parser.error("set the database user and name with DB_USER and DB_NAME, or --db-user and --database")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    try:
+        remote_parser_client = ReferenceParserClient(url=args.parser_url, batch_size=args.parser_batch_size)
+    except ValueError as error:
+        parser.error(str(error))
+    parser_client = LocalFirstParserClient(remote_parser_client, min_confidence=args.local_confidence)
+    # The password is only read from the environment
+    scorer = CandidateScorer(args.db_host, args.db_user, os.environ.get('DB_PASSWORD', ''), args.database,
+                             parse_cache=ParseCache(args.parse_cache), match_memo=JournalMatchMemo(args.match_memo),
+                             parser_client=parser_client,
+                             pool_size=args.workers + 1, metrics=RunMetrics())
+    asyncio.run(serve(ScoringService(scorer, args.host, args.port, max_workers=args.workers)))
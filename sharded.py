@@ -0,0 +1,161 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from journal_matcher import journal_source_key
+from match_memo import JournalMatchMemo
+from parse_cache import ParseCache
+from scores import ScoreCalculator
+from snapshot import TableSnapshot
+from table_schema import TABLE_SCHEMAS
+
+# Tables the first phase reads to find the top funded amount of each shard
+FUNDED_MAX_TABLES = ['candidate', 'funded_research']
+
+
+def shard_of(candidate_ids, shards):
+    """
+    Assigns candidates to shards by hashing their ids, the same way in every process.
+
+    Parameters:
+    -----------
+    candidate_ids : list-like
+        Candidate ids
+    shards : int
+        Number of shards
+
+    Returns:
+    --------
+    numpy.ndarray
+        Shard of each candidate id
+    """
+    return pd.util.hash_array(np.asarray(candidate_ids).astype('int64')) % shards
+
+
+def _load_shard(directory, typed, shard, shards, names):
+    """
+    Memory maps the snapshotted tables and keeps the rows of one shard's candidates, filtering the Arrow
+    tables before conversion so only the shard's rows are copied into the worker.
+    """
+    def in_shard(table):
+        return shard_of(table.column('candidate_id').to_numpy(), shards) == shard
+
+    return TableSnapshot(directory).load(typed=typed, names=names, row_filter=in_shard)
+
+
+def _funded_max(directory, typed, shard, shards):
+    """
+    First phase: the top funded amount among the candidates of a shard, 0 if none.
+    """
+    tables = _load_shard(directory, typed, shard, shards, FUNDED_MAX_TABLES)
+    funded_totals = (tables['funded_research'].groupby('candidate_id')['funded_amount_usd'].sum()
+                     .reindex(tables['candidate']['candidate_id'].unique(), fill_value=0))
+
+    return float(funded_totals.max()) if len(funded_totals) else 0.0
+
+
+def _score_shard(directory, typed, shard, shards, settings, max_funded_amount):
+    """
+    Second phase: scores the candidates of a shard against the top funded amount of the whole pool.
+    Publications are read from the run's parse store, the parsed citations are returned rather than written.
+    Journal matches are looked up in and added to the calculator's match memo, if any.
+    """
+    tables = _load_shard(directory, typed, shard, shards, list(TABLE_SCHEMAS))
+    parse_cache = ParseCache(settings['parse_store_path'], cache_only=True, evict_on_open=False)
+    match_memo = JournalMatchMemo(settings['match_memo_path']) if settings['match_memo_path'] else None
+    try:
+        calculator = ScoreCalculator(settings['host'], settings['username'], settings['password'], settings['database'],
+                                     *(tables[name] for name in TABLE_SCHEMAS), as_of_date=settings['as_of_date'],
+                                     parse_cache=parse_cache, match_memo=match_memo)
+        results = calculator.calculate_scores(max_funded_amount, write_citations=False)
+    finally:
+        parse_cache.close()
+        if match_memo is not None:
+            match_memo.close()
+
+    return results, calculator.parsed_citations
+
+
+def score_sharded(calculator, shards=4, max_workers=None, snapshot=None, first_cit_id=1, write_citations=True):
+    """
+    Scores the candidates of a calculator on a pool of processes, one shard of candidates per task, and
+    writes the parsed citations if write_citations. Gives the same scores, in the same order, as
+    calculator.calculate_scores().
+
+    Workers memory map the source tables from a snapshot instead of receiving them pickled. Publications
+    are parsed once up front by the calculator, so the parsing API is called from one process within its
+    rate limit, and workers read the parses in cache only mode from a store of the run's own, which unlike
+    the calculator's parse cache is never evicted. The top funded amount is reduced in two phases: every
+    shard reports its own, then every shard is scored against the largest.
+
+    Parameters:
+    -----------
+    calculator : ScoreCalculator
+        Calculator over the whole applicant pool
+    shards : int, optional
+        Number of shards the candidates are split into
+    max_workers : int, optional
+        Number of worker processes, defaults to one per shard
+    snapshot : TableSnapshot, optional
+        Snapshot holding the calculator's tables, e.g. the one they were loaded from. If None the tables
+        are snapshotted to a temporary directory.
+    first_cit_id : int, optional
+        cit_id of the first parsed publication, see technical_publications_score
+    write_citations : bool, optional
+        Whether the parsed citations are written to the citations table, else they are only kept in
+        calculator.parsed_citations
+
+    Returns:
+    --------
+    pandas.DataFrame
+        df with the component scores and total_score of each candidate
+    """
+    with tempfile.TemporaryDirectory(prefix='score_shards_') as temp_directory:
+        # Snapshot the tables for the workers to memory map
+        if snapshot is None:
+            snapshot = TableSnapshot(os.path.join(temp_directory, 'tables'))
+            snapshot.save(calculator.source_tables, {}, typed=True)
+        typed = snapshot.manifest()['typed']
+
+        # Parse every publication here, through the calculator's parse cache if any, and keep the parses
+        # in a store of this run's own that nothing evicts while the workers read it
+        parse_store = ParseCache(os.path.join(temp_directory, 'parse_cache.sqlite'), max_entries=None)
+        for text, parsed in calculator.parse_publications().items():
+            parse_store.set(text, parsed)
+        parse_store.close()
+
+        # Key the match memo to the journal list up front so no worker clears the others' matches
+        if calculator.match_memo is not None:
+            calculator.match_memo.use_source(journal_source_key(calculator.JOURNAL_RANKS_CSV, calculator.JOURNAL_TITLE_COLUMN,
+                                                                calculator.JOURNAL_QUARTILE_COLUMN))
+        settings = {'host': calculator.host, 'username': calculator.username, 'password': calculator.password,
+                    'database': calculator.database, 'as_of_date': calculator.as_of_date,
+                    'parse_store_path': parse_store.path,
+                    'match_memo_path': calculator.match_memo.path if calculator.match_memo is not None else None}
+
+        with ProcessPoolExecutor(max_workers=max_workers or shards) as executor:
+            # First phase: the top funded amount of each shard, reduced to the top amount of the pool
+            max_funded_amount = max(executor.map(_funded_max, *zip(*[(snapshot.directory, typed, shard, shards)
+                                                                     for shard in range(shards)])))
+
+            # Second phase: score every shard against the top amount of the pool
+            shard_results = list(executor.map(_score_shard, *zip(*[(snapshot.directory, typed, shard, shards,
+                                                                    settings, max_funded_amount)
+                                                                   for shard in range(shards)])))
+
+    # Number the citations of all shards consecutively, in shard order, and write them
+    citations = [citation for _, shard_citations in shard_results for citation in shard_citations]
+    for cit_id, citation in enumerate(citations, start=first_cit_id):
+        citation[0] = cit_id
+    calculator.parsed_citations = citations
+    if write_citations:
+        calculator.write_citations(citations)
+
+    # Put the candidates back in the order calculate_scores gives them
+    results = pd.concat([shard_result for shard_result, _ in shard_results], ignore_index=True)
+    candidate_order = pd.Index(calculator.candidate_df['candidate_id'].unique()).get_indexer(results['candidate_id'])
+
+    return results.iloc[np.argsort(candidate_order, kind='stable')].reset_index(drop=True)
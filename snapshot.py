@@ -0,0 +1,131 @@
+import json
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = feather = None
+
+
+class TableSnapshot:
+    """
+    A local snapshot of the source tables stored as uncompressed Feather (Arrow IPC) files, one per table,
+    next to a manifest recording the row count and checksum each table had in the database. Reading a
+    snapshot memory maps the files instead of pulling the tables over the network again.
+
+    A table's snapshot is only used while the database still reports the same row count and checksum for
+    it; passing no signatures skips that check, for offline use without database access.
+
+    Attributes:
+    ----------
+    directory : str
+        Directory holding the Feather files and the manifest
+
+    Methods:
+    -------
+    load(signatures=None, typed=True, names=None, row_filter=None) -> dict
+        Reads the tables whose snapshot is still valid.
+    save(tables, signatures, typed=True)
+        Writes tables to the snapshot along with their signatures.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory='snapshots'):
+        if feather is None:
+            raise ImportError("Table snapshots need pyarrow, install it with `pip install pyarrow`.")
+        self.directory = directory
+
+    def path(self, name):
+        """
+        Path to the Feather file of a table.
+        """
+        return os.path.join(self.directory, f'{name}.feather')
+
+    def manifest(self):
+        """
+        Reads the manifest, an empty one if there is no snapshot yet.
+
+        Returns:
+        --------
+        dict
+            The manifest with 'typed' and per table 'tables' entries
+        """
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'typed': None, 'tables': {}}
+
+    def load(self, signatures=None, typed=True, names=None, memory_map=True, row_filter=None):
+        """
+        Reads the tables whose snapshot is still valid.
+
+        Parameters:
+        -----------
+        signatures : dict, optional
+            Current {'rows': ..., 'checksum': ...} of each table in the database, keyed by name. Tables
+            whose signature differs from the snapshot's are skipped. If None, every snapshotted table is read.
+        typed : bool, optional
+            Whether the tables are wanted with their schema dtypes, snapshots of the other kind are skipped
+        names : list, optional
+            Names of the tables to read, defaults to every table in the snapshot
+        memory_map : bool, optional
+            Whether to memory map the files rather than reading them into memory
+        row_filter : callable, optional
+            Called with each table as a pyarrow.Table, returns a boolean mask of the rows to keep. The rows
+            are filtered before conversion to pandas, so only the kept rows are copied out of the mapping.
+
+        Returns:
+        --------
+        dict
+            The valid tables as DataFrames, keyed by name
+        """
+        manifest = self.manifest()
+        if manifest['typed'] != typed:
+            return {}
+
+        tables = {}
+        for name in (names if names is not None else manifest['tables']):
+            if name not in manifest['tables']:
+                continue
+            if signatures is not None and signatures.get(name) != manifest['tables'][name]:
+                continue
+            table = feather.read_table(self.path(name), memory_map=memory_map)
+            if row_filter is not None:
+                table = table.filter(pa.array(row_filter(table), type=pa.bool_()))
+            tables[name] = table.to_pandas(split_blocks=True)
+
+        return tables
+
+    def save(self, tables, signatures, typed=True):
+        """
+        Writes tables to the snapshot along with their signatures; tables already in the snapshot and not
+        passed in are kept.
+
+        Parameters:
+        -----------
+        tables : dict
+            DataFrames keyed by name
+        signatures : dict
+            {'rows': ..., 'checksum': ...} of each table in the database, keyed by name
+        typed : bool, optional
+            Whether the tables have their schema dtypes
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.manifest()
+        if manifest['typed'] != typed:
+            manifest = {'typed': typed, 'tables': {}}
+
+        for name, df in tables.items():
+            # Uncompressed files can be memory mapped without decoding
+            feather.write_feather(df.reset_index(drop=True), self.path(name), compression='uncompressed')
+            manifest['tables'][name] = signatures.get(name)
+
+        manifest['created_at'] = time.time()
+        manifest_path = os.path.join(self.directory, self.MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
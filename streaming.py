@@ -0,0 +1,169 @@
+import logging
+import time
+
+import pandas as pd
+
+from candidate_scoring import CandidateScorer
+from scores import ScoreCalculator
+from table_schema import TABLE_SCHEMAS, apply_schema, select_query
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingScorer(CandidateScorer):
+    """
+    A class scoring candidate pools too large to hold in memory. Candidate ids are paged through in order
+    with keyset pagination, and the candidates are scored a chunk at a time: the rows of a chunk's candidates
+    are fetched from every table, scored, and the results written out before the next chunk is fetched,
+    so memory stays bounded by the chunk size whatever the size of the pool.
+
+    Statistics over the whole pool are computed in a first pass before any chunk is scored. Funded research
+    is the only one: the top funded amount is found in the database, see CandidateScorer.max_funded_amount.
+
+    Methods:
+    -------
+    candidate_chunks(chunk_size) -> Iterator[list]
+        Pages through the candidate ids in chunks.
+    last_cit_id() -> int
+        Finds the largest cit_id in the citation table.
+    load_chunk_tables(candidate_ids) -> dict
+        Fetches the rows of a chunk of candidates from every source table.
+    score_stream(chunk_size=10000, output_csv='output.csv', upload=True, first_cit_id=None, write_citations=True) -> dict
+        Scores the whole pool chunk by chunk.
+    """
+
+    def candidate_chunks(self, chunk_size):
+        """
+        Pages through the distinct candidate ids in increasing order, one chunk per query. Each page starts
+        after the last id of the previous one, so only one chunk of ids is held on this side at a time and
+        no connection is held while a chunk is scored.
+
+        Parameters:
+        -----------
+        chunk_size : int
+            Number of candidates per chunk
+
+        Returns:
+        --------
+        Iterator[list]
+            The ids of each chunk of candidates
+        """
+        candidate_table = TABLE_SCHEMAS['candidate'][0]
+        last_id = None
+        while True:
+            # The first page starts at the smallest id, the next ones after the last id seen
+            condition, params = ("candidate_id IS NOT NULL", ()) if last_id is None else ("candidate_id > %s", (last_id,))
+            with self.pool.connection() as cnx:
+                cursor = cnx.cursor()
+                cursor.execute(f"SELECT DISTINCT candidate_id FROM {candidate_table} WHERE {condition} "
+                               "ORDER BY candidate_id LIMIT %s", params + (int(chunk_size),))
+                rows = cursor.fetchall()
+                cursor.close()
+            if rows:
+                last_id = rows[-1][0]
+                yield [row[0] for row in rows]
+            if len(rows) < chunk_size:
+                return
+
+    def last_cit_id(self):
+        """
+        Finds the largest cit_id in the citation table, 0 when it is empty.
+
+        Returns:
+        --------
+        int
+            The largest cit_id
+        """
+        with self.pool.connection() as cnx:
+            cursor = cnx.cursor()
+            cursor.execute(f"SELECT MAX(cit_id) FROM {TABLE_SCHEMAS['citation'][0]}")
+            last_cit_id = cursor.fetchone()[0]
+            cursor.close()
+
+        return int(last_cit_id) if last_cit_id is not None else 0
+
+    def load_chunk_tables(self, candidate_ids):
+        """
+        Fetches the rows of a chunk of candidates from every source table, with their schema dtypes. The
+        chunk's ids are consecutive, so each table is read with one range query.
+
+        Parameters:
+        -----------
+        candidate_ids : list
+            Ids of the candidates in increasing order, see candidate_chunks
+
+        Returns:
+        --------
+        dict
+            The candidates' rows of each table, keyed by name in TABLE_SCHEMAS order
+        """
+        tables = {}
+        with self.pool.connection() as cnx:
+            for name in TABLE_SCHEMAS:
+                df = pd.read_sql_query(f"{select_query(name)} WHERE candidate_id BETWEEN %s AND %s", cnx,
+                                       params=(int(candidate_ids[0]), int(candidate_ids[-1])))
+                df = apply_schema(name, df)
+
+                # Rows of ids missing from the candidate table are left out
+                tables[name] = df[df['candidate_id'].isin(candidate_ids)]
+
+        return tables
+
+    def score_stream(self, chunk_size=10000, output_csv='output.csv', upload=True, first_cit_id=None, write_citations=True):
+        """
+        Scores the whole pool chunk by chunk. The results of each chunk are appended to output_csv and
+        upserted into the score_cal_results table, and its parsed citations written, before the next chunk
+        is fetched.
+
+        Parameters:
+        -----------
+        chunk_size : int, optional
+            Number of candidates scored at a time
+        output_csv : str, optional
+            CSV file the results are written to, replaced at the start. Not written if None.
+        upload : bool, optional
+            If True the results are upserted into the score_cal_results table
+        first_cit_id : int, optional
+            cit_id of the first parsed publication, the citations of the chunks are numbered consecutively.
+            Defaults to the one after the largest cit_id in the citation table, so the publications of chunks
+            not yet fetched are not overwritten.
+        write_citations : bool, optional
+            If False the parsed publications are not written to the citation table
+
+        Returns:
+        --------
+        dict
+            Number of candidates and chunks scored, result rows written and uploaded, the top funded amount
+            and the seconds taken
+        """
+        start_time = time.perf_counter()
+
+        # First pass: the top funded amount of the whole pool, every chunk is scored against it
+        max_funded_amount = self.max_funded_amount(refresh=True)
+
+        stats = {'candidates': 0, 'chunks': 0, 'rows': 0, 'rows_uploaded': 0, 'max_funded_amount': max_funded_amount}
+        cit_id = first_cit_id if first_cit_id is not None else self.last_cit_id() + 1
+        for candidate_ids in self.candidate_chunks(chunk_size):
+            with self.metrics.stage('score_chunk'):
+                calculator = ScoreCalculator(self.host, self.username, self.password, self.database,
+                                             *self.load_chunk_tables(candidate_ids).values(), as_of_date=self.as_of_date,
+                                             parse_cache=self.parse_cache, parser_client=self.parser_client, pool=self.pool,
+                                             metrics=self.metrics, match_memo=self.match_memo)
+                scores = calculator.calculate_scores(max_funded_amount, first_cit_id=cit_id, write_citations=write_citations)
+                cit_id += len(calculator.parsed_citations)
+
+                # Write the chunk's results out before fetching the next chunk
+                if output_csv is not None:
+                    scores.to_csv(output_csv, mode='w' if stats['chunks'] == 0 else 'a', header=stats['chunks'] == 0, index=False)
+                if upload:
+                    stats['rows_uploaded'] += calculator.upload_cal_results(scores, upsert=True)['rows']
+
+            stats['candidates'] += len(candidate_ids)
+            stats['chunks'] += 1
+            stats['rows'] += len(scores)
+            logger.info("Scored chunk %d: candidates %s to %s, %d result rows", stats['chunks'], candidate_ids[0],
+                        candidate_ids[-1], len(scores))
+
+        stats['seconds'] = time.perf_counter() - start_time
+
+        return stats
@@ -0,0 +1,162 @@
+"""
+A local stand-in for the reference parsing API, so the parsing stage can be run and measured offline.
+
+Each non empty line of a posted text is taken as one reference whose '. ' separated parts are title,
+journal, year and doi. The server can add latency and fail a share of requests with a 503 to exercise
+timeouts and retries.
+
+Batch requests post {"inputs": [{"text": ...}, ...]} and get {"outputs": [...]} back in the same order,
+each output holding either the parse or an error. A share of the items of a batch can be failed to
+exercise retrying partial failures.
+
+Usage:
+    python stub_parser_server.py --port 8765 --latency 0.2 --failure-rate 0.1 --item-failure-rate 0.05
+
+then point a ReferenceParserClient at http://127.0.0.1:8765/.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_references(text):
+    """
+    Splits a text into references the way the stub server does.
+
+    Parameters:
+    -----------
+    text : str
+        Text with one reference per line
+
+    Returns:
+    --------
+    list
+        Flat list of title, journal, year and doi for each reference
+    """
+    parsed = []
+    for line in str(text).splitlines():
+        if line.strip():
+            parts = [part.strip() for part in line.split('. ')][:4]
+            parsed.extend(parts + [''] * (4 - len(parts)))
+
+    return parsed
+
+
+class StubParserServer:
+    """
+    A threaded HTTP server answering parsing API requests on localhost.
+
+    Attributes:
+    ----------
+    latency : float
+        Seconds waited before answering each request
+    failure_rate : float
+        Share of requests answered with a 503
+    item_failure_rate : float
+        Share of the items of batch requests answered with an error
+    requests_served : int
+        Number of requests received
+    items_served : int
+        Number of texts received, counting every item of a batch request
+    url : str
+        URL of the server once started
+
+    Methods:
+    -------
+    start() -> StubParserServer
+        Starts serving on a background thread.
+    stop()
+        Stops the server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, seed=None, item_failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.item_failure_rate = item_failure_rate
+        self.requests_served = 0
+        self.items_served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, body = stub.respond(payload)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def respond(self, payload):
+        """
+        Builds the status and JSON body answering a request payload.
+        """
+        inputs = payload['inputs'] if 'inputs' in payload else [payload['input']]
+        with self._lock:
+            self.requests_served += 1
+            self.items_served += len(inputs)
+            failed = self._random.random() < self.failure_rate
+            failed_items = [self._random.random() < self.item_failure_rate for _ in inputs] if 'inputs' in payload else []
+        if failed:
+            return 503, {'error': 'stub failure'}
+        if 'inputs' not in payload:
+            return 200, {'output': repr(parse_references(payload['input']['text']))}
+
+        return 200, {'outputs': [{'error': 'stub item failure'} if item_failed else {'output': repr(parse_references(item['text']))}
+                                 for item, item_failed in zip(inputs, failed_items)]}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stub of the reference parsing API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds waited before each response")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of requests failed with a 503")
+    parser.add_argument('--item-failure-rate', type=float, default=0.0,
+                        help="share of the items of batch requests failed with an error")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubParserServer(args.host, args.port, args.latency, args.failure_rate, args.seed, args.item_failure_rate)
+    print(f"Stub parsing API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
@@ -0,0 +1,266 @@
+"""
+Seeded synthetic source tables and a SQLite connection standing in for MySQL, shared by the benchmark and
+the tests so both run without a database.
+"""
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from table_schema import TABLE_SCHEMAS, apply_schema
+
+# Mean number of rows per candidate of the tables with a variable number of rows per candidate
+FAN_OUT = {
+    'teaching_exp': 1.5,
+    'industry_exp': 1.2,
+    'patents': 0.2,
+    'supervision_bsc': 0.8,
+    'supervision_masters': 0.5,
+    'supervision_phd': 0.2,
+    'committee_work': 0.6,
+    'quality_accreditation': 0.3,
+    'certificates': 1.0,
+    'awards': 0.3,
+    'funded_research': 0.4,
+    'publications': 4.0,
+}
+
+# Share of candidates holding a masters and a phd, and listing publications
+MASTER_SHARE = 0.6
+PHD_SHARE = 0.35
+PUBLICATION_SHARE = 0.7
+
+# Countries of teaching positions, the first half Arabic speaking
+COUNTRIES = ['Egypt', 'Saudi Arabia', 'Jordan', 'United Arab Emirates', 'Qatar',
+             'United States', 'United Kingdom', 'Germany', 'India', 'Malaysia']
+
+# Words generated journal titles are made of, e.g. 'International Journal of Applied Energy Systems'
+JOURNAL_PREFIXES = ['Journal of', 'International Journal of', 'Annals of', 'Review of', 'Advances in',
+                    'Transactions on', 'Letters in', 'Frontiers of', 'Bulletin of', 'Archives of']
+JOURNAL_QUALIFIERS = ['', 'Applied', 'Computational', 'Experimental', 'Theoretical', 'Clinical', 'Industrial',
+                      'Environmental', 'Molecular', 'Sustainable']
+JOURNAL_FIELDS = ['Energy', 'Physics', 'Chemistry', 'Materials', 'Mathematics', 'Biology', 'Medicine', 'Economics',
+                  'Policy', 'Engineering', 'Computing', 'Statistics', 'Geology', 'Robotics', 'Linguistics', 'Education',
+                  'Management', 'Psychology', 'Nursing', 'Architecture']
+JOURNAL_SUFFIXES = ['', 'Research', 'Systems', 'Letters', 'Reports', 'Science', 'and Society', 'and Technology']
+
+
+def synthetic_tables(candidates, seed=0, journal_titles=()):
+    """
+    Generates the 16 source tables for a number of candidates.
+
+    Parameters:
+    -----------
+    candidates : int
+        Number of candidates
+    seed : int, optional
+        Seed of the random generator, the same seed gives the same tables
+    journal_titles : list-like, optional
+        Journal names publications are drawn from, a few with a typo. Publications in made up journals
+        are added when empty.
+
+    Returns:
+    --------
+    dict
+        The tables with their schema dtypes, keyed by name in TABLE_SCHEMAS order
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, candidates + 1, dtype='int64')
+
+    def fan_out(name, from_ids=ids):
+        return np.repeat(from_ids, rng.poisson(FAN_OUT[name], len(from_ids)))
+
+    def qs_ranks(count):
+        return rng.integers(1, 1001, count).astype('float64')
+
+    def experience(name, prefix, admin_column):
+        candidate_ids = fan_out(name)
+        start_dates = pd.Timestamp('1990-01-01') + pd.to_timedelta(rng.integers(0, 12000, len(candidate_ids)), 'D')
+        df = pd.DataFrame({'candidate_id': candidate_ids,
+                           f'{prefix}_from_start_date': start_dates,
+                           f'{prefix}_to_end_date': start_dates + pd.to_timedelta(rng.integers(60, 3000, len(candidate_ids)), 'D'),
+                           f'{prefix}_current_position': rng.choice(['yes', 'no'], len(candidate_ids), p=[0.15, 0.85]),
+                           admin_column: rng.choice(['yes', 'no'], len(candidate_ids), p=[0.2, 0.8])})
+
+        return df
+
+    master_ids = ids[rng.random(candidates) < MASTER_SHARE]
+    phd_ids = master_ids[rng.random(len(master_ids)) < PHD_SHARE/MASTER_SHARE]
+
+    teaching_exp = experience('teaching_exp', 'teaching', 'teaching_administrative_position')
+    teaching_exp['teachingexp_country'] = rng.choice(COUNTRIES, len(teaching_exp))
+    industry_exp = experience('industry_exp', 'industry', 'industry_administritive_position')
+
+    funded_ids = fan_out('funded_research')
+    funded_research = pd.DataFrame({'candidate_id': funded_ids,
+                                    'funded_amount_usd': np.round(rng.lognormal(10, 1.5, len(funded_ids)), 2)})
+
+    tables = {
+        'candidate': pd.DataFrame({'candidate_id': ids}),
+        'degree_bsc': pd.DataFrame({'candidate_id': ids, 'QS_uni_rank_bsc': qs_ranks(candidates)}),
+        'degree_master': pd.DataFrame({'candidate_id': master_ids, 'QS_uni_rank_master': qs_ranks(len(master_ids))}),
+        'degree_phd': pd.DataFrame({'candidate_id': phd_ids, 'QS_uni_rank_phd': qs_ranks(len(phd_ids))}),
+        'teaching_exp': teaching_exp,
+        'industry_exp': industry_exp,
+    }
+    for name in ['patents', 'supervision_bsc', 'supervision_masters', 'supervision_phd', 'committee_work',
+                 'quality_accreditation', 'certificates', 'awards']:
+        tables[name] = pd.DataFrame({'candidate_id': fan_out(name)})
+    tables['funded_research'] = funded_research
+    tables['citation'] = synthetic_citations(rng, ids[rng.random(candidates) < PUBLICATION_SHARE], journal_titles)
+
+    return {name: apply_schema(name, tables[name]) for name in TABLE_SCHEMAS}
+
+
+def synthetic_journal_ranks(journals, seed=0):
+    """
+    Generates a journal_ranks.csv stand in: distinct journal titles with their SJR quartiles, for runs
+    without the real file.
+
+    Parameters:
+    -----------
+    journals : int
+        Number of journals, at most the number of distinct titles the JOURNAL_ words make
+    seed : int, optional
+        Seed of the random generator
+
+    Returns:
+    --------
+    pandas.DataFrame
+        df with the Title and SJR Quartile of each journal
+    """
+    rng = np.random.default_rng(seed)
+    titles = [' '.join(filter(None, [prefix, qualifier, field, suffix]))
+              for prefix in JOURNAL_PREFIXES for qualifier in JOURNAL_QUALIFIERS
+              for field in JOURNAL_FIELDS for suffix in JOURNAL_SUFFIXES]
+    titles = rng.permutation(np.asarray(titles, dtype=object))[:journals]
+
+    return pd.DataFrame({'Title': titles, 'SJR Quartile': rng.choice(['Q1', 'Q2', 'Q3', 'Q4'], len(titles))})
+
+
+def synthetic_citations(rng, candidate_ids, journal_titles):
+    """
+    Generates the citation table: one row per candidate with publications, holding one reference per line
+    in the 'title. journal. year. doi' form the stub parsing API splits.
+    """
+    journal_titles = np.asarray(list(journal_titles) or ['Unranked Journal of Synthetic Results'], dtype=object)
+    counts = rng.poisson(FAN_OUT['publications'], len(candidate_ids)) + 1
+    journals = journal_titles[rng.integers(0, len(journal_titles), counts.sum())]
+    years = rng.integers(2000, 2024, counts.sum())
+
+    # Misspell a tenth of the journal names and make up another tenth
+    noise = rng.random(counts.sum())
+    references = []
+    for i, (journal, year) in enumerate(zip(journals, years)):
+        if noise[i] < 0.1:
+            journal = journal[:-1]
+        elif noise[i] < 0.2:
+            journal = f'Proceedings of Workshop {i % 997}'
+        references.append(f'Article {i}. {journal}. {year}. 10.5555/{i}')
+
+    texts = ['\n'.join(references[end - count:end]) for count, end in zip(counts, np.cumsum(counts))]
+
+    return pd.DataFrame({'cit_id': np.arange(1, len(candidate_ids) + 1), 'candidate_id': candidate_ids,
+                         'cit_peer_reviewed_journals': texts})
+
+
+# The citation table keyed by cit_id, as parsed publications are upserted into it
+CITATION_TABLE = ("CREATE TABLE citation (cit_id INTEGER PRIMARY KEY, candidate_id INTEGER, cit_research_title TEXT, "
+                  "cit_journal_title TEXT, cit_year_publication_issue_volume TEXT, cit_doi TEXT, cit_peer_reviewed_journals TEXT)")
+
+
+class SQLiteConnection:
+    """
+    A SQLite connection taking the MySQL statements the pipeline issues, standing in for a MySQL server.
+    Placeholders, SHOW TABLES, ON DUPLICATE KEY UPDATE and the BINARY casts and DATEDIFF calls of the
+    pushdown queries are translated to SQLite. SQLite integers are signed, so BIGINT UNSIGNED values are
+    stored wrapped around to their signed 64 bit value.
+
+    Attributes:
+    ----------
+    path : str
+        Path to the SQLite file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cnx = sqlite3.connect(path, check_same_thread=False)
+
+    @staticmethod
+    def translate(query):
+        """
+        Translates a MySQL statement to SQLite.
+        """
+        query = re.sub(r"SHOW TABLES LIKE '([^']*)'", r"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '\1'", query)
+        query, upsert, updates = query.partition(' ON DUPLICATE KEY UPDATE ')
+        if upsert:
+            query += ' ON CONFLICT DO UPDATE SET ' + re.sub(r'VALUES\((\w+)\)', r'excluded.\1', updates)
+
+        # SQLite compares strings byte for byte already, and counts whole days between dates with julianday
+        query = re.sub(r'CAST\((.*?) AS BINARY\)', r'\1', query)
+        query = re.sub(r'DATEDIFF\((.*?), (\w+)\)', r'CAST(julianday(date(\1)) - julianday(date(\2)) AS INTEGER)', query)
+
+        return query.replace('%s', '?')
+
+    def cursor(self):
+        return SQLiteCursor(self._cnx.cursor())
+
+    def commit(self):
+        self._cnx.commit()
+
+    def rollback(self):
+        self._cnx.rollback()
+
+    def close(self):
+        self._cnx.close()
+
+
+class SQLiteCursor:
+    """
+    A SQLite cursor translating MySQL statements, see SQLiteConnection.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def signed(params):
+        """
+        Wraps integers above the signed 64 bit range around, as SQLite cannot store them.
+        """
+        return tuple(value - 2**64 if isinstance(value, int) and value >= 2**63 else value for value in params)
+
+    def execute(self, query, params=()):
+        self._cursor.execute(SQLiteConnection.translate(query), self.signed(params))
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(SQLiteConnection.translate(query), [self.signed(row) for row in rows])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+def write_sqlite_tables(tables, path):
+    """
+    Writes source tables keyed by name into a SQLite file under their MySQL table names, so a
+    SQLiteConnection to the file stands in for the source database. The citation table is created keyed
+    by cit_id, see CITATION_TABLE.
+    """
+    with sqlite3.connect(path) as cnx:
+        for name, df in tables.items():
+            df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+            if name == 'citation':
+                cnx.execute("DROP TABLE IF EXISTS citation")
+                cnx.execute(CITATION_TABLE)
+            df.to_sql(TABLE_SCHEMAS[name][0], cnx, index=False, if_exists='append' if name == 'citation' else 'replace')
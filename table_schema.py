@@ -0,0 +1,109 @@
+import pandas as pd
+
+# Source tables in the order DBConnector.load_tables returns them, keyed by name. Each entry gives the
+# MySQL table and the columns the scorers read with the compact dtype they are loaded as.
+TABLE_SCHEMAS = {
+    'candidate': ('candidate', {'candidate_id': 'int32'}),
+    'degree_bsc': ('degree_bsc', {'candidate_id': 'int32', 'QS_uni_rank_bsc': 'float32'}),
+    'degree_master': ('degree_master', {'candidate_id': 'int32', 'QS_uni_rank_master': 'float32'}),
+    'degree_phd': ('dergee_phd', {'candidate_id': 'int32', 'QS_uni_rank_phd': 'float32'}),
+    'teaching_exp': ('teaching_exp', {'candidate_id': 'int32',
+                                      'teaching_from_start_date': 'datetime64[ns]',
+                                      'teaching_to_end_date': 'datetime64[ns]',
+                                      'teaching_current_position': 'category',
+                                      'teaching_administrative_position': 'category',
+                                      'teachingexp_country': 'category'}),
+    'industry_exp': ('industry_exp', {'candidate_id': 'int32',
+                                      'industry_from_start_date': 'datetime64[ns]',
+                                      'industry_to_end_date': 'datetime64[ns]',
+                                      'industry_current_position': 'category',
+                                      'industry_administritive_position': 'category'}),
+    'patents': ('patents', {'candidate_id': 'int32'}),
+    'supervision_bsc': ('supervision_bsc', {'candidate_id': 'int32'}),
+    'supervision_masters': ('supervision_master', {'candidate_id': 'int32'}),
+    'supervision_phd': ('supervision_phd', {'candidate_id': 'int32'}),
+    'committee_work': ('committee_work', {'candidate_id': 'int32'}),
+    'quality_accreditation': ('quality_accreditation', {'candidate_id': 'int32'}),
+    'certificates': ('certificates', {'candidate_id': 'int32'}),
+    'awards': ('awards', {'candidate_id': 'int32'}),
+    'funded_research': ('funded_research', {'candidate_id': 'int32', 'funded_amount_usd': 'float64'}),
+    'citation': ('citation', {'cit_id': 'int32', 'candidate_id': 'int32', 'cit_peer_reviewed_journals': 'object'}),
+}
+
+
+# Columns of the experience tables when they are aggregated per candidate in the database, see
+# DBConnector.load_tables(pushdown=True): the rows of a candidate are grouped by rate per year and
+# administrative flag, with the days of positions under the cap summed and the capped positions counted.
+PUSHDOWN_SCHEMAS = {
+    'teaching_exp': {'candidate_id': 'int32',
+                     'teaching_administrative_position': 'category',
+                     'teaching_rate_per_year': 'float64',
+                     'teaching_days': 'float64',
+                     'teaching_capped_positions': 'int32'},
+    'industry_exp': {'candidate_id': 'int32',
+                     'industry_administritive_position': 'category',
+                     'industry_rate_per_year': 'float64',
+                     'industry_days': 'float64',
+                     'industry_capped_positions': 'int32'},
+}
+
+
+def select_query(name, typed=True):
+    """
+    Builds the query loading a source table.
+
+    Parameters:
+    -----------
+    name : str
+        Name of the source table in TABLE_SCHEMAS
+    typed : bool, optional
+        If True only the columns in the schema are selected, otherwise every column is
+
+    Returns:
+    --------
+    str
+        The SELECT query
+    """
+    table, columns = TABLE_SCHEMAS[name]
+    if not typed:
+        return f"SELECT * FROM {table}"
+
+    return f"SELECT {', '.join(f'`{column}`' for column in columns)} FROM {table}"
+
+
+def apply_schema(name, df, pushdown=False):
+    """
+    Casts the columns of a loaded source table to their schema dtypes.
+
+    Parameters:
+    -----------
+    name : str
+        Name of the source table in TABLE_SCHEMAS
+    df : pandas.DataFrame
+        The table as read from the database
+    pushdown : bool, optional
+        Whether the table was aggregated in the database, experience tables then have the PUSHDOWN_SCHEMAS columns
+
+    Returns:
+    --------
+    pandas.DataFrame
+        The table with compact dtypes
+    """
+    columns = PUSHDOWN_SCHEMAS[name] if pushdown and name in PUSHDOWN_SCHEMAS else TABLE_SCHEMAS[name][1]
+    typed_columns = {}
+    for column, dtype in columns.items():
+        if dtype.startswith('datetime64'):
+            typed_columns[column] = pd.to_datetime(df[column]).astype(dtype)
+        elif dtype.startswith(('int', 'float')):
+            typed_columns[column] = pd.to_numeric(df[column]).astype(dtype)
+        else:
+            typed_columns[column] = df[column].astype(dtype)
+
+    return pd.DataFrame(typed_columns, index=df.index)
+
+
+def memory_usage(df):
+    """
+    Returns the memory used by a table in bytes, including the contents of object columns.
+    """
+    return int(df.memory_usage(deep=True).sum())
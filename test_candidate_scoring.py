@@ -0,0 +1,95 @@
+"""
+Tests of the low latency CandidateScorer against the batch pipeline, over SQLite standing in for MySQL,
+and of calculators sharing one RunMetrics.
+
+Run with:
+    python -m pytest test_candidate_scoring.py
+"""
+import datetime
+import gc
+import weakref
+
+import pandas as pd
+import pytest
+
+from candidate_scoring import CandidateScorer
+from instrumentation import RunMetrics
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from table_schema import TABLE_SCHEMAS
+
+AS_OF_DATE = datetime.date(2024, 1, 1)
+
+# pandas reads over the SQLite stand in as it does over MySQL connections, warning about both
+pytestmark = pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+
+
+def batch_scores(tables):
+    """
+    Scores the whole pool with the batch pipeline, keyed by candidate_id.
+    """
+    calculator = ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS),
+                                 as_of_date=AS_OF_DATE, parser_client=LocalFirstParserClient(ReferenceParserClient()))
+
+    return calculator.calculate_scores(write_citations=False).set_index('candidate_id', drop=False)
+
+
+def assert_scores_equal(scores, expected):
+    """
+    Asserts that scores keyed by candidate_id equal the rows of the batch scores, None for the candidates
+    the batch pipeline leaves out.
+    """
+    assert {candidate_id for candidate_id, score in scores.items() if score is None} == set(scores) - set(expected.index)
+    found = pd.DataFrame([score for score in scores.values() if score is not None])
+    pd.testing.assert_frame_equal(found, expected.loc[found['candidate_id']].reset_index(drop=True), check_dtype=False)
+
+
+def test_scores_equal_the_batch_pipeline(journal_ranks, synthetic_pool, sqlite_pool):
+    tables = synthetic_pool(60, seed=5)
+    scorer = CandidateScorer('localhost', 'test', '', 'test', as_of_date=AS_OF_DATE,
+                             parser_client=LocalFirstParserClient(ReferenceParserClient()), pool=sqlite_pool(tables))
+    expected = batch_scores(tables)
+    candidate_ids = tables['candidate']['candidate_id'].tolist()
+
+    # The batch pipeline leaves some candidates out, e.g. those without publications
+    assert 0 < len(expected) < len(candidate_ids)
+    assert_scores_equal({candidate_id: scorer.score_candidate(candidate_id) for candidate_id in candidate_ids}, expected)
+    assert_scores_equal(scorer.score_candidates(candidate_ids[:25]), expected)
+    with pytest.raises(KeyError):
+        scorer.score_candidate(10**6)
+
+    # A new top funded amount, of a candidate outside the batch, only shows once the cached one is refreshed
+    top_candidate = candidate_ids[-1]
+    with scorer.pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute("INSERT INTO funded_research (candidate_id, funded_amount_usd) VALUES (%s, %s)", (top_candidate, 1e9))
+        cursor.close()
+        cnx.commit()
+    assert_scores_equal(scorer.score_candidates(candidate_ids[:25]), expected)
+
+    funded_research = tables['funded_research']
+    tables['funded_research'] = pd.concat([funded_research, pd.DataFrame({'candidate_id': [top_candidate],
+                                                                          'funded_amount_usd': [1e9]})
+                                          .astype(funded_research.dtypes.to_dict())], ignore_index=True)
+    renormalized = batch_scores(tables)
+    assert not renormalized['funded_research_others'].equals(expected['funded_research_others'])
+    expected = renormalized
+    assert scorer.max_funded_amount(refresh=True) == tables['funded_research'].groupby('candidate_id')['funded_amount_usd'].sum().max()
+    assert_scores_equal(scorer.score_candidates(candidate_ids[:25]), expected)
+
+
+def test_shared_metrics_do_not_keep_calculators_alive(synthetic_pool):
+    tables = synthetic_pool(5)
+    metrics = RunMetrics()
+    calculator = ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS),
+                                 as_of_date=AS_OF_DATE, metrics=metrics)
+    collected = weakref.ref(calculator)
+
+    del calculator
+    gc.collect()
+
+    assert collected() is None
+    # The counters still read the shared objects
+    assert metrics.counters['db_round_trips']() == 0
+    assert metrics.counters['api_calls']() == 0
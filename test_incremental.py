@@ -0,0 +1,136 @@
+"""
+Tests of incremental runs against full rescores of the pool, over SQLite standing in for MySQL: after
+rescore_changed the score_cal_results table holds what scoring the whole pool again would.
+
+Run with:
+    python -m pytest test_incremental.py
+"""
+import datetime
+
+import pandas as pd
+import pytest
+
+from incremental import FingerprintStore, rescore_changed
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from table_schema import TABLE_SCHEMAS
+
+AS_OF_DATE = datetime.date(2024, 1, 1)
+
+# pandas reads over the SQLite stand in as it does over MySQL connections, warning about both
+pytestmark = pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+
+
+def calculator_for(tables, pool=None):
+    """
+    Builds a ScoreCalculator over tables keyed by name, scoring as of AS_OF_DATE and parsing locally.
+    """
+    return ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS), as_of_date=AS_OF_DATE,
+                           parser_client=LocalFirstParserClient(ReferenceParserClient(headers={})), pool=pool)
+
+
+def full_rescore(tables):
+    """
+    Scores the whole pool again, ordered by candidate_id.
+    """
+    scores = calculator_for(tables).calculate_scores(write_citations=False)
+
+    return scores.sort_values('candidate_id', ignore_index=True)
+
+
+def stored_results(pool):
+    """
+    Reads score_cal_results, ordered by candidate_id.
+    """
+    with pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute("SELECT * FROM score_cal_results ORDER BY candidate_id")
+        rows = cursor.fetchall()
+        columns = [column[0] for column in cursor.description]
+        cursor.close()
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+def add_rows(tables, name, rows):
+    """
+    Appends rows, given as a dict of columns, to one of the tables keeping its dtypes.
+    """
+    df = tables[name]
+    tables[name] = pd.concat([df, pd.DataFrame(rows).astype(df.dtypes.to_dict())], ignore_index=True)
+
+
+def funded_totals(tables):
+    return tables['funded_research'].groupby('candidate_id')['funded_amount_usd'].sum()
+
+
+@pytest.fixture
+def scored_pool(journal_ranks, synthetic_pool, sqlite_pool):
+    """
+    A synthetic pool written to SQLite and scored once by rescore_changed. Returns its tables and the pool.
+    """
+    tables = synthetic_pool(60, seed=7)
+    pool = sqlite_pool(tables)
+    first = rescore_changed(calculator_for(tables, pool))
+
+    assert (first['candidates'], first['rescored'], first['renormalized']) == (60, 60, 0)
+    pd.testing.assert_frame_equal(stored_results(pool), full_rescore(tables), check_dtype=False)
+
+    return tables, pool
+
+
+def test_changed_candidate_below_the_top_is_rescored_alone(scored_pool):
+    tables, pool = scored_pool
+    totals = funded_totals(tables)
+    scored = stored_results(pool)['candidate_id']
+    candidate_id = int(scored[scored.isin(totals[totals < totals.max()].index)].iloc[0])
+    add_rows(tables, 'funded_research', {'candidate_id': [candidate_id], 'funded_amount_usd': [1.0]})
+
+    rescored = rescore_changed(calculator_for(tables, pool))
+
+    assert (rescored['rescored'], rescored['renormalized']) == (1, 0)
+    assert rescored['results']['candidate_id'].tolist() == [candidate_id]
+    pd.testing.assert_frame_equal(stored_results(pool), full_rescore(tables), check_dtype=False)
+
+
+def test_new_top_funded_candidate_renormalizes_the_others(scored_pool):
+    tables, pool = scored_pool
+    # The new candidate copies the rows of a scored one, along with a funded amount above every other
+    source_id, new_id = int(stored_results(pool)['candidate_id'].iloc[0]), 1000
+    for name, df in tables.items():
+        rows = df[df['candidate_id'] == source_id].assign(candidate_id=new_id)
+        if name == 'citation':
+            rows = rows.assign(cit_id=range(int(df['cit_id'].max()) + 1, int(df['cit_id'].max()) + 1 + len(rows)))
+        add_rows(tables, name, rows.to_dict('list'))
+    add_rows(tables, 'funded_research', {'candidate_id': [new_id], 'funded_amount_usd': [funded_totals(tables).max()*10]})
+
+    rescored = rescore_changed(calculator_for(tables, pool))
+
+    # Every other funded candidate is renormalized in place against the new top amount
+    totals = funded_totals(tables)
+    assert (rescored['rescored'], rescored['renormalized']) == (1, int((totals.drop(new_id) > 0).sum()))
+    expected = full_rescore(tables)
+    assert expected.set_index('candidate_id').loc[new_id, 'funded_research_others'] == 2
+    pd.testing.assert_frame_equal(stored_results(pool), expected, check_dtype=False)
+
+
+def test_removed_candidate_is_forgotten(scored_pool):
+    tables, pool = scored_pool
+    # Removing the top funded candidate also moves the top amount down
+    removed_id = int(funded_totals(tables).idxmax())
+    before = stored_results(pool).set_index('candidate_id')
+    for name, df in tables.items():
+        tables[name] = df[df['candidate_id'] != removed_id].reset_index(drop=True)
+
+    rescored = rescore_changed(calculator_for(tables, pool))
+
+    assert (rescored['candidates'], rescored['rescored']) == (59, 0)
+    assert rescored['renormalized'] > 0
+    assert removed_id not in FingerprintStore(pool).load()['candidate_id'].tolist()
+    # The removed candidate's results are left as they were
+    stored = stored_results(pool)
+    if removed_id in before.index:
+        pd.testing.assert_series_equal(stored.set_index('candidate_id').loc[removed_id], before.loc[removed_id])
+    pd.testing.assert_frame_equal(stored[stored['candidate_id'] != removed_id].reset_index(drop=True),
+                                  full_rescore(tables), check_dtype=False)
@@ -0,0 +1,105 @@
+"""
+Tests of the JournalMatcher index against the linear scan with fuzz.token_sort_ratio it replaced.
+
+Run with:
+    python -m pytest test_journal_matcher.py
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fuzzywuzzy import fuzz
+
+from journal_matcher import JournalMatcher
+
+WORDS = ['journal', 'of', 'applied', 'review', 'energy', 'policy', 'annals', 'physics', 'letters', 'systems',
+         'transactions', 'on', 'power', 'international', 'science', 'research', 'materials', 'chemistry']
+
+
+def linear_scan(titles, journal_name):
+    """
+    The scan the index replaced: every title is scored and the first one with the highest score is kept.
+    """
+    scores = [fuzz.token_sort_ratio(journal_name, title) for title in titles]
+    best_idx = max(range(len(titles)), key=lambda idx: (scores[idx], -idx))
+
+    return titles[best_idx], scores[best_idx]
+
+
+def misspell(rng, text):
+    """
+    Drops, doubles or swaps a few characters of a text.
+    """
+    chars = list(text)
+    for _ in range(rng.randint(0, 3)):
+        idx = rng.randrange(len(chars))
+        operation = rng.choice(['drop', 'double', 'swap'])
+        if operation == 'drop' and len(chars) > 1:
+            del chars[idx]
+        elif operation == 'double':
+            chars.insert(idx, chars[idx])
+        elif idx + 1 < len(chars):
+            chars[idx], chars[idx + 1] = chars[idx + 1], chars[idx]
+
+    return ''.join(chars)
+
+
+@pytest.fixture
+def titles():
+    """
+    Seeded journal titles drawn from WORDS, along with titles normalizing to the same string.
+    """
+    rng = random.Random(0)
+    titles = [' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 5))) for _ in range(300)]
+
+    # Titles normalizing to the same string, ties go to the first one
+    return titles + ['Energy Policy', 'policy, ENERGY', 'Energy & Policy', 'Journal of Physics: Letters']
+
+
+def journal_names(titles):
+    """
+    Misspelled titles, titles made of words in any order and names matching no title well.
+    """
+    rng = random.Random(1)
+    names = [misspell(rng, rng.choice(titles)) for _ in range(200)]
+    names += [' '.join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(100)]
+
+    return names + ['Energy Policy', 'policy energy', 'Physics Letters, Journal of', 'xyz', 'Zeitschrift für Physik', '12']
+
+
+def test_best_match_equals_the_linear_scan(titles):
+    matcher = JournalMatcher(titles)
+
+    for journal_name in journal_names(titles):
+        assert matcher.find_best_match(journal_name) == linear_scan(titles, journal_name), journal_name
+
+    # The index only scores a short list of titles
+    assert matcher.comparisons < len(journal_names(titles))*len(titles)/20
+
+
+@pytest.mark.parametrize('min_score', [0, 60, 85, 100])
+def test_min_score_only_stops_below_it(titles, min_score):
+    matcher = JournalMatcher(titles)
+
+    for journal_name in journal_names(titles):
+        best_match, score = linear_scan(titles, journal_name)
+        found = matcher.find_best_match(journal_name, min_score)
+
+        # The best match is found whenever it scores above min_score, else no score above it is returned
+        if score > min_score:
+            assert found == (best_match, score), journal_name
+        else:
+            assert found[1] <= min_score, journal_name
+
+
+def test_comparisons_are_counted_across_threads(titles):
+    names = journal_names(titles)*4
+    sequential = JournalMatcher(titles)
+    for journal_name in names:
+        sequential.find_best_match(journal_name)
+
+    threaded = JournalMatcher(titles)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(threaded.find_best_match, names))
+
+    assert threaded.comparisons == sequential.comparisons
@@ -0,0 +1,70 @@
+"""
+Offline tests of the local reference parser and of the local first client falling back to the parsing API
+reference by reference.
+
+Run with:
+    python -m pytest test_local_parser.py
+"""
+import pytest
+
+from local_parser import LocalFirstParserClient, LocalReferenceParser
+
+
+class RecordingRemote:
+    """
+    Stands in for a ReferenceParserClient, parsing every text as one remote reference and recording the
+    texts it was sent.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def parse_many(self, texts):
+        self.sent.extend(texts)
+        return {text: [f'remote {text}', 'journal', '', ''] for text in dict.fromkeys(texts)}
+
+
+APA = "Smith, J. (2020). A study of policy. Energy Policy, 12(3), 45-67. https://doi.org/10.1016/j.enpol.2020.1"
+PLAIN = "Title 1. Journal 2. 2020. 10.1000/ref1"
+UNSTRUCTURED = "some notes on a talk given in 2019"
+
+
+@pytest.mark.parametrize('reference', [
+    "Smith, J. (2020). A study of U.S. policy. Energy Policy, 12(3), 45-67. https://doi.org/10.1016/j.enpol.2020.1",
+    "Doe, A. (2019). Results by Smith et al. and others. Nature, 12, 4. https://doi.org/10.1000/x",
+    "Doe, A. (2019). Why now? A study of things. Energy Policy, 12, 4. https://doi.org/10.1000/y",
+])
+def test_titles_cut_at_a_period_are_not_confident(reference):
+    parsed, confidence = LocalReferenceParser().parse_reference(reference)
+
+    assert parsed is not None
+    assert confidence < 0.8
+
+
+def test_well_formed_references_are_confident():
+    parser = LocalReferenceParser()
+
+    assert parser.parse_reference(APA) == (['A study of policy', 'Energy Policy', '2020', '10.1016/j.enpol.2020.1'], 1.0)
+    assert parser.parse_reference(PLAIN) == (['Title 1', 'Journal 2', '2020', '10.1000/ref1'], 0.9)
+    # Periods inside the quoted IEEE title do not cut it
+    assert parser.parse_reference('A. Doe, "A study of U.S. policy," IEEE Trans. Power Syst., vol. 3, pp. 1-2, '
+                                  '2020, doi: 10.1109/x') == (['A study of U.S. policy', 'IEEE Trans. Power Syst.',
+                                                               '2020', '10.1109/x'], 1.0)
+
+
+def test_only_unconfident_references_go_remote():
+    remote = RecordingRemote()
+    client = LocalFirstParserClient(remote)
+    texts = [f"{APA}\n{UNSTRUCTURED}", f"{PLAIN}\n\n{APA}", PLAIN, f"{UNSTRUCTURED}\n{PLAIN}", ""]
+
+    parsed_texts = client.parse_many(texts + texts[:2])
+
+    # Each distinct reference is parsed once, only the unstructured one and the empty text go remote
+    assert remote.sent == [UNSTRUCTURED, ""]
+    assert (client.local_parses, client.remote_parses) == (2, 1)
+    assert client.local_share == pytest.approx(2/3)
+    apa, plain = ['A study of policy', 'Energy Policy', '2020', '10.1016/j.enpol.2020.1'], ['Title 1', 'Journal 2', '2020', '10.1000/ref1']
+    unstructured = [f'remote {UNSTRUCTURED}', 'journal', '', '']
+    assert parsed_texts == {texts[0]: apa + unstructured, texts[1]: plain + apa, texts[2]: plain,
+                            texts[3]: unstructured + plain, "": ['remote ', 'journal', '', '']}
+    assert client.parse(texts[3]) == unstructured + plain
@@ -0,0 +1,79 @@
+"""
+Tests of the command line run of main.py.
+
+Run with:
+    python -m pytest test_main.py
+"""
+import datetime
+import json
+import os
+import runpy
+import sys
+
+import mysql.connector
+import pandas as pd
+import pytest
+
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from snapshot import TableSnapshot
+from table_schema import TABLE_SCHEMAS
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_offline_run_needs_no_database(tmp_path, monkeypatch, journal_ranks, synthetic_pool, shards):
+    tables = synthetic_pool(40)
+    TableSnapshot(str(tmp_path/'snapshot')).save(tables, {}, typed=True)
+
+    def no_database(**kwargs):
+        raise mysql.connector.InterfaceError("No database is available to offline runs.")
+
+    monkeypatch.setattr(mysql.connector, 'connect', no_database)
+    # Offline runs need no database credentials either
+    for name in ('DB_USER', 'DB_PASSWORD', 'DB_NAME'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(sys, 'argv', ['main.py', '--offline', '--snapshot', 'snapshot', '--shards', str(shards),
+                                      '--metrics-json', 'metrics.json'])
+    run = runpy.run_path(MAIN_PATH, run_name='__main__')
+
+    # The csv holds the scores of the whole pool
+    calculator = ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS),
+                                 as_of_date=datetime.date.today(),
+                                 parser_client=LocalFirstParserClient(ReferenceParserClient()))
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path/'output.csv'), calculator.calculate_scores(write_citations=False),
+                                  check_dtype=False)
+    assert 'load_tables' in json.loads((tmp_path/'metrics.json').read_text())['stages']
+    # Nothing was uploaded and no connection was ever opened
+    assert 'upload' not in run['results']
+    assert run['db'].pool.stats['created'] == 0
+    # Every synthetic reference is parsed locally, without the parsing API
+    assert run['parser_client'].requests_made == 0
+
+
+def test_online_run_needs_database_credentials(monkeypatch, capsys):
+    monkeypatch.setenv('DB_USER', 'scorer')
+    monkeypatch.delenv('DB_PASSWORD', raising=False)
+    monkeypatch.delenv('DB_NAME', raising=False)
+    monkeypatch.setattr(sys, 'argv', ['main.py'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        runpy.run_path(MAIN_PATH, run_name='__main__')
+
+    assert exit_info.value.code == 2
+    assert "set DB_PASSWORD, DB_NAME in the environment" in capsys.readouterr().err
+
+
+def test_run_needs_a_parsing_api_token(monkeypatch, capsys):
+    for name in ('DB_USER', 'DB_PASSWORD', 'DB_NAME'):
+        monkeypatch.setenv(name, 'scorer')
+    monkeypatch.delenv('PARSER_API_TOKEN')
+    monkeypatch.setattr(sys, 'argv', ['main.py'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        runpy.run_path(MAIN_PATH, run_name='__main__')
+
+    assert exit_info.value.code == 2
+    assert "Set the PARSER_API_TOKEN environment variable" in capsys.readouterr().err
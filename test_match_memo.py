@@ -0,0 +1,58 @@
+"""
+Tests of the persistent journal match memo: matches are only reused with the journal list they were
+found in, and with the minimum score they were found with.
+
+Run with:
+    python -m pytest test_match_memo.py
+"""
+import pandas as pd
+
+from journal_matcher import journal_source_key, load_journal_matcher, match_journals
+from match_memo import JournalMatchMemo
+
+
+def test_changed_journal_list_clears_the_memo(tmp_path, journal_ranks):
+    memo = JournalMatchMemo(str(tmp_path/'memo.sqlite'))
+    names = ['Journal of Testing', 'Annals of Candidate Scorng', 'Reviews in Synthetics']
+
+    first = match_journals(names, quartile_column='SJR Quartile', memo=memo)
+    again = match_journals(names, quartile_column='SJR Quartile', memo=memo)
+
+    assert again == first
+    assert (memo.hits, memo.misses, len(memo)) == (3, 3, 3)
+    source_key = memo.source_key
+    assert source_key == journal_source_key(quartile_column='SJR Quartile')
+
+    # A title matching the third name better is added to the csv
+    pd.DataFrame({'Title': journal_ranks + ['Reviews in Synthetics'], 'SJR Quartile': ['Q1', 'Q2', 'Q3', 'Q4']}) \
+        .to_csv('journal_ranks.csv', index=False)
+    memo.close()
+    memo = JournalMatchMemo(str(tmp_path/'memo.sqlite'))
+    changed = match_journals(names, quartile_column='SJR Quartile', memo=memo)
+
+    assert memo.source_key == journal_source_key(quartile_column='SJR Quartile') != source_key
+    assert (memo.hits, memo.misses, len(memo)) == (0, 3, 3)
+    assert changed[:2] == first[:2]
+    assert changed[2] == ('Reviews in Synthetics', 100, 'Q4') != first[2]
+    memo.close()
+
+
+def test_matches_are_keyed_by_min_score(tmp_path, journal_ranks):
+    memo = JournalMatchMemo(str(tmp_path/'memo.sqlite'))
+    name = 'Annals of Candidates'
+    best_match = load_journal_matcher(quartile_column='SJR Quartile').match_many([name])
+
+    # No title scores above 95, so the search stops before scoring any title
+    early = match_journals([name], quartile_column='SJR Quartile', min_score=95, memo=memo)
+    assert early == [(None, 0, None)] != best_match
+
+    # The early match is not reused without a minimum score, or with another one
+    assert match_journals([name], quartile_column='SJR Quartile', memo=memo) == best_match
+    assert match_journals([name], quartile_column='SJR Quartile', min_score=50, memo=memo) == best_match
+    assert (memo.hits, memo.misses, len(memo)) == (0, 3, 3)
+    assert memo.get_many(['annals candidates of'], min_score=95) == {'annals candidates of': early[0]}
+
+    assert match_journals([name], quartile_column='SJR Quartile', min_score=95, memo=memo) == early
+    assert match_journals([name], quartile_column='SJR Quartile', memo=memo) == best_match
+    assert (memo.hits, memo.misses) == (3, 3)
+    memo.close()
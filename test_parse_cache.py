@@ -0,0 +1,51 @@
+"""
+Tests of the size limit of the parse cache.
+
+Run with:
+    python -m pytest test_parse_cache.py
+"""
+from parse_cache import ParseCache
+
+
+def test_set_keeps_the_cache_within_max_entries(tmp_path):
+    cache = ParseCache(str(tmp_path/'parse_cache.sqlite'), max_entries=10)
+    try:
+        for i in range(25):
+            cache.set(f'reference {i}', [f'title {i}', 'journal', '2020', ''])
+            # Reading an entry keeps it from being the least recently used
+            assert cache.get('reference 0') is not None
+            assert len(cache) <= 10
+
+        assert len(cache) == 10
+        assert cache.get('reference 0') is not None
+        assert cache.get('reference 24') is not None
+        assert cache.get('reference 1') is None
+    finally:
+        cache.close()
+
+
+def test_replacing_an_entry_does_not_count_twice(tmp_path):
+    cache = ParseCache(str(tmp_path/'parse_cache.sqlite'), max_entries=3)
+    try:
+        for parsed in (['a'], ['b'], ['c'], ['d']):
+            cache.set('reference', parsed)
+        cache.set('other reference', ['e'])
+
+        assert len(cache) == 2
+        assert cache.get('reference') == ['d']
+    finally:
+        cache.close()
+
+
+def test_no_limit_without_max_entries(tmp_path):
+    path = str(tmp_path/'parse_cache.sqlite')
+    cache = ParseCache(path, max_entries=None)
+    for i in range(50):
+        cache.set(f'reference {i}', [str(i)])
+    cache.close()
+
+    cache = ParseCache(path, max_entries=None)
+    try:
+        assert len(cache) == 50
+    finally:
+        cache.close()
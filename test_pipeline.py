@@ -0,0 +1,87 @@
+"""
+Tests of the StageGraph running pipeline stages in dependency order on a bounded thread pool.
+
+Run with:
+    python -m pytest test_pipeline.py
+"""
+import threading
+import time
+
+import pytest
+
+from pipeline import StageGraph
+
+
+def test_order_puts_dependencies_first():
+    stages = (StageGraph().add('scores', print, ['university', 'publications']).add('publications', print)
+              .add('university', print).add('upload', print, ['scores']))
+
+    order = stages.order()
+
+    assert order.index('university') < order.index('scores') and order.index('publications') < order.index('scores')
+    assert order[-1] == 'upload'
+
+
+def test_order_rejects_cycles_and_unknown_stages():
+    with pytest.raises(ValueError, match="cycle: a -> b -> c -> a"):
+        StageGraph().add('a', print, ['b']).add('b', print, ['c']).add('c', print, ['a']).order()
+    with pytest.raises(ValueError, match="Stage b depends on unknown stage missing"):
+        StageGraph().add('a', print).add('b', print, ['a', 'missing']).order()
+    with pytest.raises(ValueError, match="already in the graph"):
+        StageGraph().add('a', print).add('a', print)
+
+
+def test_results_are_passed_in_order_or_by_keyword():
+    stages = (StageGraph().add('x', lambda: 2).add('y', lambda: 3)
+              .add('difference', lambda a, b: a - b, ['y', 'x'])
+              .add('keywords', lambda first, second: (first, second), {'second': 'x', 'first': 'difference'}))
+
+    assert stages.run() == {'x': 2, 'y': 3, 'difference': 1, 'keywords': (1, 2)}
+    assert set(stages.stage_seconds) == {'x', 'y', 'difference', 'keywords'}
+
+
+def test_run_bounds_the_stages_running_at_once():
+    lock = threading.Lock()
+    running, most_running = [0], [0]
+
+    def stage():
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    stages = StageGraph()
+    for i in range(6):
+        stages.add(f'stage {i}', stage)
+
+    stages.run(max_concurrency=2)
+
+    assert most_running[0] == 2
+
+
+def test_failing_stage_raises_and_skips_its_dependents():
+    started = []
+
+    def fail():
+        raise RuntimeError("The stage failed.")
+
+    stages = (StageGraph().add('fail', fail).add('slow', lambda: time.sleep(0.1) or started.append('slow'))
+              .add('after', lambda _: started.append('after'), ['fail']))
+    errors = []
+
+    def run():
+        try:
+            stages.run(max_concurrency=2)
+        except RuntimeError as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(5)
+
+    # The error is raised once the running stage is done rather than the run waiting forever
+    assert not thread.is_alive()
+    assert [str(error) for error in errors] == ["The stage failed."]
+    assert started == ['slow']
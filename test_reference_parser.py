@@ -0,0 +1,184 @@
+"""
+Offline tests of the parsing client, one text per request and batched, against the local stub of the
+parsing API and a stub rejecting batch requests.
+
+Run with:
+    python -m pytest test_reference_parser.py
+"""
+import collections
+import math
+import random
+import threading
+
+import pytest
+
+from reference_parser import ReferenceParserClient, ReferenceParserError
+from stub_parser_server import StubParserServer, parse_references
+
+
+class RecordingStubParserServer(StubParserServer):
+    """
+    A stub server also recording how many times each reference was posted and failed.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.posted = collections.Counter()
+        self.failed = collections.Counter()
+        self._record_lock = threading.Lock()
+
+    def respond(self, payload):
+        status, body = super().respond(payload)
+        inputs = payload['inputs'] if 'inputs' in payload else [payload['input']]
+        outputs = body.get('outputs', [body] * len(inputs))
+        with self._record_lock:
+            for item, output in zip(inputs, outputs):
+                self.posted[item['text']] += 1
+                if status != 200 or 'error' in output:
+                    self.failed[item['text']] += 1
+
+        return status, body
+
+
+class SingleOnlyStubParserServer(StubParserServer):
+    """
+    A stub server taking only single requests, answering batch requests with a 400 or, if answer_batches,
+    as if their payload held one text.
+    """
+
+    def __init__(self, answer_batches=False, **kwargs):
+        super().__init__(**kwargs)
+        self.answer_batches = answer_batches
+        self.batch_requests = 0
+
+    def respond(self, payload):
+        if 'inputs' not in payload:
+            return super().respond(payload)
+        self.batch_requests += 1
+        if self.answer_batches:
+            return super().respond({'input': payload['inputs'][0]})
+
+        return 400, {'error': 'unknown field inputs'}
+
+
+def reference_texts(count=200, distinct_references=120, seed=0):
+    """
+    Builds publication texts of one to five references each, drawn from a smaller set of references so
+    many references are shared between texts.
+    """
+    rng = random.Random(seed)
+    references = [f"Title {i}. Journal {i % 17}. {1990 + i % 30}. 10.1000/ref{i}" for i in range(distinct_references)]
+
+    return ['\n'.join(rng.sample(references, rng.randint(1, 5))) for _ in range(count)]
+
+
+def distinct_references(texts):
+    return {line.strip() for text in texts for line in text.splitlines() if line.strip()}
+
+
+def test_parses_equal_the_stub_parses_despite_failures():
+    texts = reference_texts(count=60)
+    with StubParserServer(failure_rate=0.3, seed=4) as stub:
+        client = ReferenceParserClient(url=stub.url, max_workers=4, max_retries=8, backoff=0)
+        try:
+            parsed_texts = client.parse_many(texts + texts[:10])
+        finally:
+            client.close()
+
+    assert parsed_texts == {text: parse_references(text) for text in texts}
+    # Repeated texts are parsed once, failed requests are retried
+    assert client.retries > 0
+    assert stub.requests_served == client.requests_made == len(set(texts)) + client.retries
+
+
+def test_gives_up_after_max_retries():
+    with StubParserServer(failure_rate=1.0) as stub:
+        client = ReferenceParserClient(url=stub.url, max_retries=2, backoff=0)
+        try:
+            with pytest.raises(ReferenceParserError):
+                client.parse("Title. Journal. 2020. 10.1000/ref")
+        finally:
+            client.close()
+
+    assert stub.requests_served == client.requests_made == 3
+    assert client.retries == 2
+
+
+def test_stub_parses_each_line_as_a_reference():
+    assert parse_references("Title. Journal. 2020. 10.1000/ref\n\nOther title. Other journal") == \
+        ['Title', 'Journal', '2020', '10.1000/ref', 'Other title', 'Other journal', '', '']
+
+
+@pytest.mark.parametrize('batch_size', [2, 16, 64])
+def test_batched_parses_equal_single_parses(batch_size):
+    texts = reference_texts()
+    with StubParserServer(failure_rate=0.1, item_failure_rate=0.1, seed=1) as stub:
+        client = ReferenceParserClient(url=stub.url, max_retries=5, backoff=0, batch_size=batch_size)
+        try:
+            parsed_texts = client.parse_many(texts)
+        finally:
+            client.close()
+
+    assert parsed_texts == {text: parse_references(text) for text in texts}
+
+
+def test_shared_references_are_posted_once():
+    texts = reference_texts()
+    with RecordingStubParserServer(seed=2) as stub:
+        client = ReferenceParserClient(url=stub.url, backoff=0, batch_size=16)
+        try:
+            client.parse_many(texts + texts[:50])
+        finally:
+            client.close()
+
+    assert set(stub.posted) == distinct_references(texts)
+    assert set(stub.posted.values()) == {1}
+    assert client.item_retries == 0
+
+
+def test_only_failed_items_are_retried():
+    texts = reference_texts()
+    with RecordingStubParserServer(item_failure_rate=0.2, seed=3) as stub:
+        client = ReferenceParserClient(url=stub.url, max_retries=5, backoff=0, batch_size=16)
+        try:
+            parsed_texts = client.parse_many(texts)
+        finally:
+            client.close()
+
+    assert parsed_texts == {text: parse_references(text) for text in texts}
+    assert stub.failed
+    # Every reference is posted once, plus once more after each failure
+    assert all(stub.posted[reference] == 1 + stub.failed[reference] for reference in distinct_references(texts))
+    assert client.item_retries == sum(stub.failed.values())
+
+
+@pytest.mark.parametrize('answer_batches', [False, True])
+def test_falls_back_to_single_requests_when_batches_are_rejected(answer_batches):
+    texts = reference_texts(count=30)
+    with SingleOnlyStubParserServer(answer_batches=answer_batches, seed=5) as stub:
+        client = ReferenceParserClient(url=stub.url, backoff=0, batch_size=16)
+        try:
+            parsed_texts = client.parse_many(texts)
+            more_parsed_texts = client.parse_many(texts[:5] + ["Other title. Other journal. 2021. 10.1000/other"])
+        finally:
+            client.close()
+
+    assert parsed_texts == {text: parse_references(text) for text in texts}
+    assert more_parsed_texts["Other title. Other journal. 2021. 10.1000/other"] == \
+        ['Other title', 'Other journal', '2021', '10.1000/other']
+    # Only the batches of the first round are sent, then every text goes on its own
+    assert client.batches_rejected
+    assert 1 <= stub.batch_requests <= math.ceil(len(distinct_references(texts))/16)
+    assert client.requests_made == stub.batch_requests + len(set(texts)) + 6
+
+
+def test_token_is_read_from_the_environment(monkeypatch):
+    monkeypatch.setenv('PARSER_API_TOKEN', 'secret')
+    assert ReferenceParserClient().headers == {'Authorization': 'Basic secret'}
+    assert ReferenceParserClient(headers={}).headers == {}
+
+    monkeypatch.delenv('PARSER_API_TOKEN')
+    with pytest.raises(ValueError, match="Set the PARSER_API_TOKEN environment variable"):
+        ReferenceParserClient()
+    # Clients given their headers need no token
+    assert ReferenceParserClient(headers={'Authorization': 'Bearer other'}).headers == {'Authorization': 'Bearer other'}
@@ -0,0 +1,332 @@
+"""
+Offline tests of the vectorized scorers of ScoreCalculator against the row by row loops they replaced, and
+of the pushdown queries against the in-memory aggregation, over SQLite standing in for MySQL.
+
+Run with:
+    python -m pytest test_scores.py
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scores import DBConnector, ScoreCalculator
+from table_schema import TABLE_SCHEMAS, apply_schema
+
+AS_OF_DATE = datetime.date(2024, 1, 1)
+
+
+def calculator_for(tables, pool=None):
+    """
+    Builds a ScoreCalculator over tables keyed by name, scoring as of AS_OF_DATE.
+    """
+    return ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS), as_of_date=AS_OF_DATE,
+                           pool=pool)
+
+
+def baseline_university_score(tables, c=ScoreCalculator):
+    """
+    The row by row university_score the rules table replaced.
+    """
+    degree_phd_df, degree_master_df, degree_bsc_df = tables['degree_phd'], tables['degree_master'], tables['degree_bsc']
+
+    def phd(candidate_id):
+        return degree_phd_df.loc[degree_phd_df['candidate_id']==candidate_id, 'QS_uni_rank_phd'].iloc[0]
+
+    def master(candidate_id):
+        return degree_master_df.loc[degree_master_df['candidate_id']==candidate_id, 'QS_uni_rank_master'].iloc[0]
+
+    def bsc(candidate_id):
+        return degree_bsc_df.loc[degree_bsc_df['candidate_id']==candidate_id, 'QS_uni_rank_bsc'].iloc[0]
+
+    scores = {}
+    for candidate_id in tables['candidate']['candidate_id']:
+        if candidate_id in degree_phd_df['candidate_id'].to_list():
+            if phd(candidate_id) <= 100:
+                if master(candidate_id) <= 100 and bsc(candidate_id) <= 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_LT_100
+                elif master(candidate_id) > 100 and bsc(candidate_id) < 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_LT_100 - c.DEDUCTION
+                elif bsc(candidate_id) > 100 and master(candidate_id) < 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_LT_100 - c.DEDUCTION
+                else:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_LT_100 - c.DEDUCTION*1.2
+            else:
+                if master(candidate_id) <= 100 and bsc(candidate_id) <= 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_GT_100
+                elif master(candidate_id) > 100 and bsc(candidate_id) < 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_GT_100 - c.DEDUCTION
+                elif bsc(candidate_id) > 100 and master(candidate_id) < 100:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_GT_100 - c.DEDUCTION
+                else:
+                    scores[candidate_id] = c.MAX_SCORE_WITH_PHD_QS_GT_100 - 2*c.DEDUCTION/2
+        elif degree_master_df.loc[degree_master_df['candidate_id']==candidate_id].empty:
+            if bsc(candidate_id) < 100:
+                scores[candidate_id] = c.NO_PHD_MAX_SCORE - c.DEDUCTION/2
+            elif bsc(candidate_id) > 100:
+                scores[candidate_id] = c.DEDUCTION/3
+        else:
+            if bsc(candidate_id) < 100 and master(candidate_id) < 100:
+                scores[candidate_id] = c.NO_PHD_MAX_SCORE
+            elif bsc(candidate_id) < 100 and master(candidate_id) > 100:
+                scores[candidate_id] = c.NO_PHD_MAX_SCORE - c.DEDUCTION/3.5
+            elif bsc(candidate_id) > 100 and master(candidate_id) < 100:
+                scores[candidate_id] = c.NO_PHD_MAX_SCORE - c.DEDUCTION/3.5
+            else:
+                scores[candidate_id] = c.NO_PHD_MAX_SCORE - c.DEDUCTION/2
+
+    return pd.DataFrame(scores.items(), columns=['candidate_id', 'uni_ranking_score'])
+
+
+def baseline_experience_score(tables, name, prefix, column, max_score, rate_per_year):
+    """
+    The row by row teaching_expereince_score and industry_experience_score the interval engine replaced,
+    counting current positions up to AS_OF_DATE rather than today.
+    """
+    exp_df = tables[name]
+    scores = {}
+    for candidate_id in tables['candidate']['candidate_id']:
+        candidate_score = 0
+        for _, row in exp_df[exp_df['candidate_id']==candidate_id].iterrows():
+            if row[f'{prefix}_current_position'] == 'yes':
+                end_date = AS_OF_DATE
+            else:
+                end_date = pd.to_datetime(row[f'{prefix}_to_end_date']).date()
+            start_date = pd.to_datetime(row[f'{prefix}_from_start_date']).date()
+
+            # Cap duration to a maximum of 5 years
+            duration_years = min((end_date - start_date).days/365.25, 5)
+            candidate_score += rate_per_year(row)*duration_years
+        scores[candidate_id] = max_score if candidate_score > max_score else candidate_score
+
+    return pd.DataFrame(scores.items(), columns=['candidate_id', column])
+
+
+def baseline_teaching_score(tables, c=ScoreCalculator):
+    def rate_per_year(row):
+        is_arab_country = row['teachingexp_country'].lower() in c.ARABIC_SPEAKING_COUNTRIES
+        return c.MAX_SCORE_ARABIC_PER_YEAR if is_arab_country else c.MAX_SCORE_NON_ARABIC_PER_YEAR
+
+    return baseline_experience_score(tables, 'teaching_exp', 'teaching', 'teaching_exp_score', 15, rate_per_year)
+
+
+def baseline_industry_score(tables, c=ScoreCalculator):
+    return baseline_experience_score(tables, 'industry_exp', 'industry', 'industry_exp_score', 5,
+                                     lambda row: c.MAX_IND_EXP_SCORE_PER_YEAR)
+
+
+def baseline_others_score(tables):
+    """
+    The row by row others_score the isin flags replaced, leaving out the patents and supervision flags
+    whose behaviour was fixed, see test_others_flags_count_rows_of_the_candidate.
+    """
+    teaching_exp_df, industry_exp_df, funded_research_df = tables['teaching_exp'], tables['industry_exp'], tables['funded_research']
+    candidate_ids = tables['candidate']['candidate_id'].unique().tolist()
+    scores = {'committe_others': {}, 'qa_others': {}, 'certificates_others': {}, 'awards_others': {},
+              'managemnet_exp_others': {}, 'funded_research_others': {}}
+    funded_research_total_per_candidate = {}
+    for candidate_id in candidate_ids:
+        for column, name, points in (('committe_others', 'committee_work', 1), ('qa_others', 'quality_accreditation', 1),
+                                     ('certificates_others', 'certificates', 1), ('awards_others', 'awards', 1)):
+            scores[column][candidate_id] = points if candidate_id in tables[name]['candidate_id'].unique().tolist() else 0
+        is_manager = 'yes' in teaching_exp_df[teaching_exp_df['candidate_id']==candidate_id]['teaching_administrative_position'].tolist() or \
+                     'yes' in industry_exp_df[industry_exp_df['candidate_id']==candidate_id]['industry_administritive_position'].tolist()
+        scores['managemnet_exp_others'][candidate_id] = 1 if is_manager else 0
+        funded_research_total_per_candidate[candidate_id] = funded_research_df[funded_research_df['candidate_id']==candidate_id]['funded_amount_usd'].sum()
+
+    max_funded_amount = max(funded_research_total_per_candidate.values())
+    for candidate_id in candidate_ids:
+        candidate_funded_amount = funded_research_total_per_candidate[candidate_id]
+        scores['funded_research_others'][candidate_id] = (candidate_funded_amount/max_funded_amount)*2 if max_funded_amount != 0 else 0
+
+    df = pd.DataFrame(scores)
+    df['others_total'] = df.sum(axis=1)
+    df['candidate_id'] = candidate_ids
+
+    return df
+
+
+def edge_case_tables():
+    """
+    Tables covering the rank band boundaries, NaN ranks, open ended current positions, the cap of a
+    position's years and the cap of the total experience score.
+    """
+    ranks = [1, 99, 100, 101, 1000, np.nan]
+    candidates = []
+    degree_bsc, degree_master, degree_phd = [], [], []
+    candidate_id = 1
+    # Every combination of phd, masters and bsc rank, with masters only and bsc only candidates
+    for phd_rank in ranks + [None]:
+        for master_rank in ranks + [None]:
+            if phd_rank is not None and master_rank is None:
+                continue
+            for bsc_rank in ranks:
+                candidates.append(candidate_id)
+                degree_bsc.append((candidate_id, bsc_rank))
+                if master_rank is not None:
+                    degree_master.append((candidate_id, master_rank))
+                if phd_rank is not None:
+                    degree_phd.append((candidate_id, phd_rank))
+                candidate_id += 1
+
+    capped_days = ScoreCalculator.capped_position_days()
+    start = pd.Timestamp('2010-01-01')
+    positions = [
+        # candidate, start, end, current, admin, country
+        (1, start, start + pd.Timedelta(days=capped_days - 1), 'no', 'no', 'Egypt'),
+        (2, start, start + pd.Timedelta(days=capped_days), 'no', 'yes', 'Germany'),
+        (3, pd.Timestamp('2020-03-15'), pd.NaT, 'yes', 'no', 'QATAR'),
+        (3, pd.Timestamp('2015-06-01'), pd.Timestamp('2016-06-01'), 'no', 'no', 'India'),
+        (4, pd.Timestamp('2021-01-01'), pd.Timestamp('2022-01-01'), 'yes', 'no', 'united arab emirates'),
+        (5, pd.Timestamp('2000-01-01'), pd.NaT, 'yes', 'yes', 'Jordan'),
+    ]
+    # Enough capped positions to go over the maximum score
+    positions += [(6, start, start + pd.Timedelta(days=3000), 'no', 'no', 'United States')]*3
+    positions += [(7, pd.Timestamp('2023-12-31'), pd.Timestamp('2023-12-31'), 'no', 'no', 'Oman')]
+    positions += [(8, start, start + pd.Timedelta(days=400), 'no', 'no', 'Egypt')]*2
+
+    def experience(prefix, admin_column):
+        df = pd.DataFrame(positions, columns=['candidate_id', f'{prefix}_from_start_date', f'{prefix}_to_end_date',
+                                              f'{prefix}_current_position', admin_column, 'teachingexp_country'])
+        return df if prefix == 'teaching' else df.drop(columns='teachingexp_country')
+
+    def ids(*candidate_ids):
+        return pd.DataFrame({'candidate_id': list(candidate_ids)})
+
+    return {
+        'candidate': pd.DataFrame({'candidate_id': candidates + candidates[:3]}),
+        'degree_bsc': pd.DataFrame(degree_bsc, columns=['candidate_id', 'QS_uni_rank_bsc']),
+        'degree_master': pd.DataFrame(degree_master, columns=['candidate_id', 'QS_uni_rank_master']),
+        'degree_phd': pd.DataFrame(degree_phd, columns=['candidate_id', 'QS_uni_rank_phd']),
+        'teaching_exp': experience('teaching', 'teaching_administrative_position'),
+        'industry_exp': experience('industry', 'industry_administritive_position'),
+        'patents': ids(1, 4),
+        'supervision_bsc': ids(2),
+        'supervision_masters': ids(3, 3),
+        'supervision_phd': ids(9),
+        'committee_work': ids(1, 2, 2),
+        'quality_accreditation': ids(5),
+        'certificates': ids(6, 7),
+        'awards': ids(8),
+        'funded_research': pd.DataFrame({'candidate_id': [1, 1, 4, 10], 'funded_amount_usd': [1000.0, 500.5, 3000.0, 0.0]}),
+        'citation': pd.DataFrame({'cit_id': [], 'candidate_id': [], 'cit_peer_reviewed_journals': []}),
+    }
+
+
+@pytest.fixture(params=['edge_cases', 'synthetic'])
+def tables(request, synthetic_pool):
+    """
+    The edge case tables, then synthetic tables with the typing undone so the baseline reads them as
+    SELECT * would load them.
+    """
+    if request.param == 'edge_cases':
+        return edge_case_tables()
+
+    return {name: df.astype({column: 'object' for column in df.select_dtypes('category')})
+            for name, df in synthetic_pool(300, seed=4).items()}
+
+
+SCORERS = [
+    ('university_score', baseline_university_score),
+    ('teaching_expereince_score', baseline_teaching_score),
+    ('industry_experience_score', baseline_industry_score),
+]
+
+
+@pytest.mark.parametrize('scorer, baseline', SCORERS)
+def test_vectorized_scorers_equal_baseline(tables, scorer, baseline):
+    typed_tables = {table: apply_schema(table, df) for table, df in tables.items()}
+    scores = getattr(calculator_for(typed_tables), scorer)()
+
+    pd.testing.assert_frame_equal(scores, baseline(tables), check_dtype=False)
+
+
+def test_vectorized_others_score_equals_baseline(tables):
+    typed_tables = {table: apply_schema(table, df) for table, df in tables.items()}
+    scores = calculator_for(typed_tables).others_score()
+    expected = baseline_others_score(tables)
+
+    columns = [column for column in expected.columns if column != 'others_total']
+    pd.testing.assert_frame_equal(scores[columns], expected[columns], check_dtype=False, check_index_type=False)
+    others_total = scores['others_total'] - scores['patent_others'] - scores['supervision_others']
+    np.testing.assert_allclose(others_total.to_numpy(), expected['others_total'].to_numpy())
+
+
+def test_edge_cases_cover_every_rule():
+    tables = {table: apply_schema(table, df) for table, df in edge_case_tables().items()}
+    scores = calculator_for(tables).university_score()
+
+    expected_scores = {rule[4](ScoreCalculator) for rule in ScoreCalculator.UNIVERSITY_SCORE_RULES}
+    assert expected_scores <= set(scores['uni_ranking_score'])
+    # bsc only candidates ranked exactly 100 match no rule and get no score
+    assert len(scores) < tables['candidate']['candidate_id'].nunique()
+
+
+def test_others_flags_count_rows_of_the_candidate():
+    # The loops flagged patents by the patents table's row index, and supervision for every candidate as
+    # soon as the masters or phd supervision table had any row. Both now flag the candidates having rows.
+    tables = {table: apply_schema(table, df) for table, df in edge_case_tables().items()}
+    tables['candidate'] = pd.DataFrame({'candidate_id': [0, 1, 2, 3, 4, 9, 11]}).astype('int32')
+    scores = calculator_for(tables).others_score().set_index('candidate_id')
+
+    # patents_df has rows of candidates 1 and 4 at index 0 and 1
+    assert scores['patent_others'].to_dict() == {0: 0, 1: 2, 2: 0, 3: 0, 4: 2, 9: 0, 11: 0}
+    # Candidate 2 supervised a bsc, 3 a masters and 9 a phd
+    assert scores['supervision_others'].to_dict() == {0: 0, 1: 0, 2: 2, 3: 2, 4: 0, 9: 2, 11: 0}
+
+
+def test_results_table_is_keyed_by_an_integer_candidate_id(sqlite_pool):
+    tables = {table: apply_schema(table, df) for table, df in edge_case_tables().items()}
+    calculator = calculator_for(tables, pool=sqlite_pool(name='results.sqlite'))
+    results = pd.DataFrame({'candidate_id': np.array([3, 1, 2], dtype='int32'), 'total_score': [1.5, 2.0, np.nan]})
+
+    calculator.upload_cal_results(results)
+    calculator.upload_cal_results(results.assign(total_score=[4.0, 5.0, 6.0]), upsert=True)
+
+    with calculator.pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute("PRAGMA table_info(score_cal_results)")
+        columns = {row[1]: (row[2], row[5]) for row in cursor.fetchall()}
+        cursor.execute("SELECT candidate_id, total_score FROM score_cal_results ORDER BY candidate_id")
+        rows = cursor.fetchall()
+        cursor.close()
+
+    assert columns == {'candidate_id': ('INT', 1), 'total_score': ('FLOAT', 0)}
+    assert rows == [(1, 5.0), (2, 6.0), (3, 4.0)]
+
+
+def pushed_down_calculator(tables, pool):
+    """
+    Builds a ScoreCalculator over tables aggregated by the pushdown queries, run on the tables written to
+    the database of a pool.
+    """
+    connector = DBConnector('localhost', 'test', '', 'test', pool=pool)
+
+    return calculator_for(dict(zip(TABLE_SCHEMAS, connector.load_tables(pushdown=True, as_of_date=AS_OF_DATE))))
+
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_pushdown_scores_equal_in_memory_scores(tables, sqlite_pool):
+    typed_tables = {table: apply_schema(table, df) for table, df in tables.items()}
+    pushed_down = pushed_down_calculator(typed_tables, sqlite_pool(typed_tables))
+    in_memory = calculator_for(typed_tables)
+
+    # One row per candidate, administrative flag and rate instead of one per position
+    assert 'teaching_days' in pushed_down.teaching_exp_df.columns
+    assert len(pushed_down.funded_research_df) == typed_tables['funded_research']['candidate_id'].nunique()
+    for scorer in ('teaching_expereince_score', 'industry_experience_score', 'others_score'):
+        pd.testing.assert_frame_equal(getattr(pushed_down, scorer)(), getattr(in_memory, scorer)(), check_dtype=False)
+
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_pushdown_covers_the_day_cap_and_the_top_funded_amount(sqlite_pool):
+    tables = {table: apply_schema(table, df) for table, df in edge_case_tables().items()}
+    pushed_down = pushed_down_calculator(tables, sqlite_pool(tables))
+
+    # The positions one day either side of the cap
+    teaching = pushed_down.teaching_exp_df.set_index('candidate_id')
+    assert teaching.loc[1, 'teaching_days'] == ScoreCalculator.capped_position_days() - 1
+    assert (teaching.loc[2, 'teaching_days'], teaching.loc[2, 'teaching_capped_positions']) == (0, 1)
+    # Candidate 4's single grant is the top funded amount
+    assert pushed_down.others_score().set_index('candidate_id').loc[4, 'funded_research_others'] == 2
@@ -0,0 +1,144 @@
+"""
+Tests of the scoring service on localhost: coalescing of queued requests into batches, the per request
+fallback when a batch fails, and the /health and /metrics endpoints.
+
+Run with:
+    python -m pytest test_scoring_service.py
+"""
+import asyncio
+import threading
+
+import requests
+
+from db_pool import ConnectionPool
+from instrumentation import RunMetrics
+from scoring_service import ScoringService
+
+
+class RecordingScorer:
+    """
+    Stands in for a CandidateScorer. Scores candidate c as {'total_score': c/2}, leaves out candidates
+    above 100 as unknown and fails every batch holding a negative id. Batches are recorded and wait while
+    the gate is closed.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.parse_cache = None
+        self.match_memo = None
+        self.metrics = RunMetrics()
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def score_candidates(self, candidate_ids):
+        self.batches.append(list(candidate_ids))
+        self.started.set()
+        self.gate.wait(10)
+        if any(candidate_id < 0 for candidate_id in candidate_ids):
+            raise ValueError("A negative candidate id.")
+
+        return {candidate_id: {'total_score': candidate_id/2} for candidate_id in candidate_ids if candidate_id <= 100}
+
+
+def run_service(scorer, scenario, max_workers=1):
+    """
+    Runs a scenario coroutine against a service listening on a free localhost port, returning its result.
+    """
+    async def run():
+        service = await ScoringService(scorer, port=0, max_workers=max_workers).start()
+        try:
+            return await scenario(service)
+        finally:
+            await service.stop()
+
+    return asyncio.run(run())
+
+
+async def call(method, url, payload=None):
+    """
+    Sends a request off the event loop, returning the response status and JSON body or text.
+    """
+    response = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: requests.request(method, url, json=payload, timeout=10))
+
+    return response.status_code, response.json() if response.headers['Content-Type'] == 'application/json' else response.text
+
+
+async def post_while_busy(service, scorer, payloads):
+    """
+    Posts a request for candidate 1, then the payloads while it is being scored so they queue up behind it.
+    """
+    scorer.gate.clear()
+    first = asyncio.ensure_future(call('POST', service.url + 'score', {'candidate_id': 1}))
+    await asyncio.get_running_loop().run_in_executor(None, scorer.started.wait, 10)
+
+    queued = [asyncio.ensure_future(call('POST', service.url + 'score', payload)) for payload in payloads]
+    while len(service._queued) < len(payloads):
+        await asyncio.sleep(0.01)
+    scorer.gate.set()
+
+    return await asyncio.gather(first, *queued)
+
+
+def test_queued_requests_are_scored_in_one_batch(sqlite_pool):
+    scorer = RecordingScorer(sqlite_pool())
+    payloads = [{'candidate_id': 2}, {'candidate_ids': [3, 2, 101]}, {'candidate_id': 101}]
+    responses = run_service(scorer, lambda service: post_while_busy(service, scorer, payloads))
+
+    # The queued requests arrive in any order but are scored together
+    assert scorer.batches[0] == [1]
+    assert len(scorer.batches) == 2 and sorted(scorer.batches[1]) == [2, 3, 101]
+    assert responses == [(200, {'candidate_id': 1, 'scores': {'total_score': 0.5}}),
+                         (200, {'candidate_id': 2, 'scores': {'total_score': 1.0}}),
+                         (200, {'scores': {'3': {'total_score': 1.5}, '2': {'total_score': 1.0}}, 'missing': [101]}),
+                         (404, {'error': "No candidate with id 101."})]
+
+
+def test_failed_batch_is_rescored_request_by_request(sqlite_pool):
+    scorer = RecordingScorer(sqlite_pool())
+    payloads = [{'candidate_id': 2}, {'candidate_ids': [3, -1]}, {'candidate_id': 4}]
+    responses = run_service(scorer, lambda service: post_while_busy(service, scorer, payloads))
+
+    assert scorer.batches[0] == [1]
+    assert sorted(scorer.batches[1]) == [-1, 2, 3, 4]
+    assert sorted(scorer.batches[2:]) == [[2], [3, -1], [4]]
+    # Only the request holding the failing candidate fails
+    assert [status for status, _ in responses] == [200, 200, 500, 200]
+    assert responses[3] == (200, {'candidate_id': 4, 'scores': {'total_score': 2.0}})
+
+
+def test_health_reports_the_database(sqlite_pool):
+    def no_database():
+        raise ConnectionRefusedError("No database.")
+
+    async def health(service):
+        return await call('GET', service.url + 'health')
+
+    status, body = run_service(RecordingScorer(sqlite_pool()), health)
+    assert status == 200
+    assert body['status'] == 'ok' and body['database'] == 'ok'
+    assert body['pool']['created'] == 1
+
+    status, body = run_service(RecordingScorer(ConnectionPool(no_database)), health)
+    assert status == 503
+    assert body['status'] == 'degraded' and body['database'] == 'error: ConnectionRefusedError'
+
+
+def test_metrics_expose_request_latencies_and_responses(sqlite_pool):
+    async def scrape(service):
+        for candidate_id in (1, 2, 101):
+            await call('POST', service.url + 'score', {'candidate_id': candidate_id})
+        await call('GET', service.url + 'missing')
+        return await call('GET', service.url + 'metrics')
+
+    status, text = run_service(RecordingScorer(sqlite_pool()), scrape)
+
+    assert status == 200
+    assert '# TYPE score_service_request_seconds histogram' in text
+    assert 'score_service_request_seconds_bucket{route="/score",le="+Inf"} 3' in text
+    assert 'score_service_request_seconds_count{route="/score"} 3' in text
+    assert 'score_service_responses_total{route="/score",status="200"} 2' in text
+    assert 'score_service_responses_total{route="/score",status="404"} 1' in text
+    assert 'score_service_responses_total{route="other",status="404"} 1' in text
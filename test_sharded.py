@@ -0,0 +1,51 @@
+"""
+Tests of scoring a pool on a pool of processes, one shard of candidates at a time, against scoring it in
+one process.
+
+Run with:
+    python -m pytest test_sharded.py
+"""
+import datetime
+
+import pandas as pd
+
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from sharded import _funded_max, score_sharded, shard_of
+from snapshot import TableSnapshot
+from table_schema import TABLE_SCHEMAS
+
+AS_OF_DATE = datetime.date(2024, 1, 1)
+
+
+def calculator_for(tables):
+    """
+    Builds a ScoreCalculator over tables keyed by name, scoring as of AS_OF_DATE and parsing locally.
+    """
+    return ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS), as_of_date=AS_OF_DATE,
+                           parser_client=LocalFirstParserClient(ReferenceParserClient(headers={})))
+
+
+def test_shards_give_the_unsharded_scores(tmp_path, journal_ranks, synthetic_pool):
+    tables = synthetic_pool(60, seed=8)
+    # Shuffle the candidates so putting them back in order is not a sort by id
+    tables['candidate'] = tables['candidate'].sample(frac=1, random_state=0).reset_index(drop=True)
+    # One candidate funded well above the others, so every other shard has a smaller top amount of its own
+    top_candidate = int(tables['candidate']['candidate_id'].iloc[0])
+    funded_research = tables['funded_research']
+    tables['funded_research'] = pd.concat([funded_research, pd.DataFrame({'candidate_id': [top_candidate],
+                                                                          'funded_amount_usd': [1e9]})
+                                          .astype(funded_research.dtypes.to_dict())], ignore_index=True)
+    snapshot = TableSnapshot(str(tmp_path/'snapshot'))
+    snapshot.save(tables, {}, typed=True)
+
+    sharded = score_sharded(calculator_for(tables), shards=3, snapshot=snapshot, write_citations=False)
+
+    # Each shard finds its own top amount, only the top candidate's shard finds the top amount of the pool
+    shard_maxima = [_funded_max(snapshot.directory, True, shard, 3) for shard in range(3)]
+    assert sorted(shard_maxima)[-1] == 1e9 > sorted(shard_maxima)[-2]
+    assert shard_maxima.index(1e9) == shard_of([top_candidate], 3)[0]
+    assert len(set(shard_of(sharded['candidate_id'], 3))) == 3
+    # The scores and their order are those of one process scoring the whole pool
+    pd.testing.assert_frame_equal(sharded, calculator_for(tables).calculate_scores(write_citations=False))
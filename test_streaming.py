@@ -0,0 +1,48 @@
+"""
+Tests of the chunked StreamingScorer against the batch pipeline scoring the whole pool at once, over SQLite
+standing in for MySQL.
+
+Run with:
+    python -m pytest test_streaming.py
+"""
+import datetime
+
+import pandas as pd
+import pytest
+
+from local_parser import LocalFirstParserClient
+from reference_parser import ReferenceParserClient
+from scores import ScoreCalculator
+from streaming import StreamingScorer
+from table_schema import TABLE_SCHEMAS
+
+AS_OF_DATE = datetime.date(2024, 1, 1)
+
+# pandas reads over the SQLite stand in as it does over MySQL connections, warning about both
+pytestmark = pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+
+
+def test_chunks_upsert_the_scores_of_the_whole_pool(journal_ranks, synthetic_pool, sqlite_pool):
+    tables = synthetic_pool(60, seed=6)
+    # A funded amount well above the others, so the chunk holding it is not the only one renormalized
+    top_candidate = int(tables['candidate']['candidate_id'].iloc[-1])
+    funded_research = tables['funded_research']
+    tables['funded_research'] = pd.concat([funded_research, pd.DataFrame({'candidate_id': [top_candidate],
+                                                                          'funded_amount_usd': [1e9]})
+                                          .astype(funded_research.dtypes.to_dict())], ignore_index=True)
+    parser_client = LocalFirstParserClient(ReferenceParserClient(headers={}))
+    streamer = StreamingScorer('localhost', 'test', '', 'test', as_of_date=AS_OF_DATE, parser_client=parser_client,
+                               pool=sqlite_pool(tables))
+
+    streamed = streamer.score_stream(chunk_size=7)
+
+    calculator = ScoreCalculator('localhost', 'test', '', 'test', *(tables[name] for name in TABLE_SCHEMAS),
+                                 as_of_date=AS_OF_DATE, parser_client=parser_client)
+    expected = calculator.calculate_scores(write_citations=False).sort_values('candidate_id', ignore_index=True)
+    assert (streamed['candidates'], streamed['chunks'], streamed['max_funded_amount']) == (60, 9, 1e9)
+    assert streamed['rows'] == streamed['rows_uploaded'] == len(expected)
+    with streamer.pool.connection() as cnx:
+        uploaded = pd.read_sql_query("SELECT * FROM score_cal_results ORDER BY candidate_id", cnx)
+    pd.testing.assert_frame_equal(uploaded, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(pd.read_csv('output.csv').sort_values('candidate_id', ignore_index=True), expected,
+                                  check_dtype=False)